@@ -0,0 +1,46 @@
+import torch
+import pytest
+
+from copy import deepcopy
+from pathlib import Path
+from typing import Callable
+from torchvision.io import write_png
+
+from yogo.model import YOGO
+
+
+@pytest.fixture
+def pth_path(tmp_path: Path) -> Path:
+    "a randomly initialized YOGO model, with a small input, saved as a checkpoint"
+    torch.manual_seed(0)
+    model = YOGO(img_size=(96, 128), anchor_w=0.05, anchor_h=0.05, num_classes=2)
+    torch.save(
+        {
+            "epoch": 0,
+            "step": 0,
+            "model_state_dict": deepcopy(model.state_dict()),
+            "model_version": model.model_version,
+        },
+        str(tmp_path / "model.pth"),
+    )
+    return tmp_path / "model.pth"
+
+
+@pytest.fixture
+def write_images(tmp_path: Path) -> Callable[..., Path]:
+    """
+    write_images(name, num_images) writes num_images random grayscale PNGs, sized
+    for the `pth_path` model, to tmp_path / name and returns that directory.
+    Images are drawn from one seeded generator, so they differ between calls.
+    """
+    generator = torch.Generator().manual_seed(0)
+
+    def write(name: str = "images", num_images: int = 5) -> Path:
+        image_dir = tmp_path / name
+        image_dir.mkdir()
+        for i in range(num_images):
+            image = torch.randint(0, 256, (1, 96, 128), generator=generator)
+            write_png(image.to(torch.uint8), str(image_dir / f"img_{i}.png"))
+        return image_dir
+
+    return write
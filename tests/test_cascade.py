@@ -0,0 +1,72 @@
+import torch
+
+from yogo.infer import _CascadeModel, uncertain_frames
+
+
+NUM_CLASSES = 2
+
+
+def make_preds(objectness, class_confidence):
+    """(B, 5 + NUM_CLASSES, 2, 2) predictions, with one box in the first cell"""
+    bs = len(objectness)
+    preds = torch.zeros(bs, 5 + NUM_CLASSES, 2, 2)
+    preds[:, 0:2] = 0.25
+    preds[:, 2:4] = 0.1
+    preds[:, 5] = 1.0
+    preds[:, 4, 0, 0] = torch.tensor(objectness)
+    preds[:, 5, 0, 0] = torch.tensor(class_confidence)
+    preds[:, 6, 0, 0] = 1 - torch.tensor(class_confidence)
+    return preds
+
+
+def test_uncertain_frames():
+    preds = make_preds(
+        objectness=[0.0, 0.95, 0.55, 0.95], class_confidence=[1.0, 0.99, 0.99, 0.6]
+    )
+    uncertain = uncertain_frames(
+        preds, obj_thresh=0.5, objectness_margin=0.2, min_class_confidence=0.9
+    )
+    # confident background, confident object, borderline object, unsure class
+    assert uncertain.tolist() == [False, False, True, True]
+
+
+def test_cascade_replaces_uncertain_frames():
+    fast_preds = make_preds(
+        objectness=[0.95, 0.55, 0.95, 0.95], class_confidence=[0.99, 0.99, 0.6, 0.99]
+    )
+    escalation_preds = make_preds(
+        objectness=[0.95, 0.0, 0.95, 0.95], class_confidence=[0.99, 1.0, 0.05, 0.99]
+    )
+    escalation_inputs = []
+
+    def fast_model(x):
+        return fast_preds[x.flatten()]
+
+    def escalation_model(x):
+        escalation_inputs.append(x.flatten().tolist())
+        return escalation_preds[x.flatten()]
+
+    cascade = _CascadeModel(
+        fast_model,
+        escalation_model,
+        num_classes=NUM_CLASSES,
+        device=torch.device("cpu"),
+        objectness_margin=0.2,
+        min_class_confidence=0.9,
+    )
+
+    # the "images" are the indices of their predictions
+    preds = cascade(torch.arange(4))
+
+    assert escalation_inputs == [[1, 2]]
+    torch.testing.assert_close(preds[[0, 3]], fast_preds[[0, 3]])
+    torch.testing.assert_close(preds[[1, 2]], escalation_preds[[1, 2]])
+
+    report = cascade.report()
+    assert report["num_images"] == 4
+    assert report["num_escalated"] == 2
+    assert report["escalated_fraction"] == 0.5
+    # the fast model found an object of class 0 in each escalated image, the
+    # escalation model only one object, of class 1
+    assert report["fast_counts_on_escalated"] == [2, 0]
+    assert report["escalation_counts_on_escalated"] == [0, 1]
@@ -0,0 +1,132 @@
+import numpy as np
+import pytest
+
+from yogo.infer import predict
+from yogo.utils.columnar_predictions import (
+    ColumnarPredictions,
+    ColumnarPredictionWriter,
+)
+
+
+NUM_CLASSES = 2
+
+
+def fake_rows(image_ids):
+    """rows in the layout of `format_to_numpy`, for NUM_CLASSES classes"""
+    n = len(image_ids)
+    rng = np.random.default_rng(0)
+    probs = rng.random((NUM_CLASSES, n)).astype(np.float32)
+    return np.vstack(
+        (
+            np.array(image_ids, dtype=np.float32),
+            rng.random((5, n)).astype(np.float32),
+            np.argmax(probs, axis=0).astype(np.float32),
+            probs.max(axis=0),
+            probs,
+        )
+    )
+
+
+def test_round_trip_by_image(tmp_path):
+    path = tmp_path / "preds.zarr"
+    writer = ColumnarPredictionWriter(path, num_images=4, num_classes=NUM_CLASSES)
+    writer.write(fake_rows([0, 0, 1]))
+    writer.write(None)
+    writer.write(fake_rows([3]))
+    writer.close()
+
+    preds = ColumnarPredictions(path)
+    assert len(preds) == 4
+    assert preds.num_predictions == 4
+    assert [len(preds[i]["image_id"]) for i in range(4)] == [2, 1, 0, 1]
+    assert preds[-1]["image_id"].tolist() == [3]
+    assert preds[0]["boxes"].shape == (2, 4)
+    assert preds[0]["probs"].dtype == np.float16
+    assert preds[0]["class_id"].dtype == np.uint8
+
+    with pytest.raises(IndexError):
+        preds[4]
+
+
+def test_on_written_is_called_in_order(tmp_path):
+    written = []
+    writer = ColumnarPredictionWriter(
+        tmp_path / "preds.zarr", num_images=2, num_classes=NUM_CLASSES
+    )
+    writer.write(fake_rows([0]), on_written=lambda: written.append(0))
+    writer.write(fake_rows([1]), on_written=lambda: written.append(1))
+    writer.close()
+    assert written == [0, 1]
+
+
+def test_resume_drops_unfinished_rows(tmp_path):
+    path = tmp_path / "preds.zarr"
+    writer = ColumnarPredictionWriter(path, num_images=4, num_classes=NUM_CLASSES)
+    writer.write(fake_rows([2, 3]))
+    writer.write(fake_rows([0]))
+    writer._queue.put(None)
+    writer._thread.join()
+
+    # only images [2, 4) were recorded as done before the "crash"
+    resumed = ColumnarPredictionWriter(
+        path, num_images=4, num_classes=NUM_CLASSES, completed_ranges=[(2, 4)]
+    )
+    resumed.write(fake_rows([0, 1]))
+    resumed.close()
+
+    preds = ColumnarPredictions(path)
+    assert preds.root["image_id"][:].tolist() == [0, 1, 2, 3]
+    assert [len(preds[i]["image_id"]) for i in range(4)] == [1, 1, 1, 1]
+
+
+def test_incomplete_group_is_rejected(tmp_path):
+    path = tmp_path / "preds.zarr"
+    ColumnarPredictionWriter(path, num_images=1, num_classes=NUM_CLASSES)
+    with pytest.raises(ValueError, match="incomplete"):
+        ColumnarPredictions(path)
+
+
+def test_columnar_matches_label_files_with_thresholds(tmp_path, pth_path, write_images):
+    image_dir = write_images()
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+
+    predict(
+        pth_path,
+        path_to_images=image_dir,
+        output_dir=str(output_dir),
+        save_preds=True,
+        save_columnar=True,
+        batch_size=2,
+        # an untrained model is confident about very few cells, so the
+        # default thresholds would keep almost nothing
+        obj_thresh=1e-12,
+        iou_thresh=0.2,
+        device="cpu",
+    )
+
+    preds = ColumnarPredictions(next(output_dir.glob("*.preds.zarr")))
+    assert len(preds) == 5 and preds.num_predictions > 5
+    for i in range(len(preds)):
+        lines = (output_dir / f"img_{i}.txt").read_text().splitlines()
+        labels = np.array([[float(v) for v in line.split()] for line in lines])
+        assert len(preds[i]["class_id"]) == len(labels)
+        if len(labels) == 0:
+            continue
+
+        assert preds[i]["class_id"].tolist() == labels[:, 0].astype(int).tolist()
+        xc, yc, w, h = labels[:, 1:].T
+        np.testing.assert_allclose(
+            preds[i]["boxes"],
+            np.stack(
+                (
+                    (xc - w / 2) * 128,
+                    (yc - h / 2) * 96,
+                    (xc + w / 2) * 128,
+                    (yc + h / 2) * 96,
+                ),
+                axis=1,
+            ),
+            rtol=1e-3,
+            atol=1e-2,
+        )
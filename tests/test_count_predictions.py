@@ -1,7 +1,8 @@
 import torch
 import unittest
 
-from yogo.infer import count_cells_for_formatted_preds
+from yogo.utils import format_preds
+from yogo.infer import count_cells_for_formatted_preds, count_predictions_per_frame
 
 
 class TestCountClassPredictions(unittest.TestCase):
@@ -42,5 +43,40 @@ class TestCountClassPredictions(unittest.TestCase):
         )
 
 
+class TestCountPredictionsPerFrame(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        # (batch, 5 + num classes, Sy, Sx), with box sizes like YOGO's
+        self.batch_preds = torch.rand(4, 9, 12, 16)
+        self.batch_preds[:, 2:4] *= 0.1
+        self.batch_preds[:, 5:] = torch.softmax(self.batch_preds[:, 5:] * 4, dim=1)
+
+    def per_image_counts(self, **thresholds):
+        return torch.stack(
+            [
+                count_cells_for_formatted_preds(format_preds(pred, **thresholds)[:, 5:])
+                for pred in self.batch_preds
+            ]
+        )
+
+    def test_matches_per_image_counting(self):
+        for thresholds in (
+            dict(obj_thresh=0.5, iou_thresh=0.5),
+            dict(obj_thresh=0.9, iou_thresh=0.0),
+            dict(obj_thresh=0.5, iou_thresh=0.5, min_class_confidence_threshold=0.5),
+        ):
+            with self.subTest(**thresholds):
+                torch.testing.assert_close(
+                    count_predictions_per_frame(self.batch_preds, **thresholds),
+                    self.per_image_counts(**thresholds),
+                )
+
+    def test_no_predictions(self):
+        self.batch_preds[:, 4] = 0
+        counts = count_predictions_per_frame(self.batch_preds)
+        self.assertEqual(counts.shape, (4, 4))
+        self.assertEqual(counts.sum().item(), 0)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,3 +1,4 @@
+import shutil
 import pytest
 
 from pathlib import Path
@@ -6,7 +7,10 @@ from yogo.data.split_fractions import SplitFractions
 from yogo.data.dataset_definition_file import (
     DatasetDefinition,
     InvalidDatasetDefinitionFile,
+    LiteralSpecification,
+    default_definition_cache_dir,
 )
+from yogo.data.yogo_dataset import LABEL_INDEX_DIR_NAME, LabelIndex
 
 """
 TODO test test_dataset_paths v. dataset_paths, make sure they play well together
@@ -156,3 +160,70 @@ def test_no_dataset_splits() -> None:
 def test_no_dataset_splits_no_test_split() -> None:
     d = DatasetDefinition.from_yaml(DEFNS_PATH / "no_split_no_test.yml")
     assert d.split_fractions == SplitFractions(train=1, val=0, test=None)
+
+
+def write_recursive_defn(tmp_path: Path) -> Path:
+    shutil.copytree(TEST_DIR / "fake-data" / "data", tmp_path / "data")
+    header = "class_names: [you, only, glance, once]\n"
+    (tmp_path / "child.yml").write_text(
+        header
+        + "dataset_paths:\n"
+        + "".join(
+            f"  set{i}:\n"
+            f"    image_path: {tmp_path / 'data' / f'images{i}'}\n"
+            f"    label_path: {tmp_path / 'data' / f'labels{i}'}\n"
+            for i in (1, 2)
+        )
+    )
+    defn_path = tmp_path / "defn.yml"
+    defn_path.write_text(
+        header
+        + "dataset_split_fractions: {train: 0.5, val: 0.5}\n"
+        + "dataset_paths:\n  child:\n    defn_path: child.yml\n"
+    )
+    return defn_path
+
+
+def test_resolved_definitions_are_cached(tmp_path, monkeypatch) -> None:
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    defn_path = write_recursive_defn(tmp_path)
+
+    uncached = DatasetDefinition.from_yaml(defn_path, use_cache=False)
+    assert not (tmp_path / "cache").exists()
+
+    assert DatasetDefinition.from_yaml(defn_path) == uncached
+    assert len(list(default_definition_cache_dir().glob("*.json"))) == 1
+    assert DatasetDefinition.from_yaml(defn_path) == uncached
+
+    # changing any file of the tree invalidates the cache
+    child_path = tmp_path / "child.yml"
+    child_path.write_text(child_path.read_text().split("  set2:")[0])
+    assert len(DatasetDefinition.from_yaml(defn_path).dataset_paths) == 1
+
+
+def test_cached_definitions_are_still_checked(tmp_path, monkeypatch) -> None:
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    defn_path = write_recursive_defn(tmp_path)
+    DatasetDefinition.from_yaml(defn_path)
+
+    shutil.rmtree(tmp_path / "data" / "labels2")
+    (tmp_path / "data" / "labels2").mkdir()
+    with pytest.raises(FileNotFoundError):
+        DatasetDefinition.from_yaml(defn_path)
+
+
+def test_label_folder_with_only_the_label_index_is_empty(tmp_path) -> None:
+    image_dir, label_dir = tmp_path / "images", tmp_path / "labels"
+    image_dir.mkdir()
+    label_dir.mkdir()
+    label_path = label_dir / "a.txt"
+    label_path.write_text("0 0.5 0.5 0.1 0.1\n")
+    LabelIndex.load_or_build(label_dir, [str(label_path)], ["healthy"])
+    assert (label_dir / LABEL_INDEX_DIR_NAME).is_dir()
+
+    label_path.unlink()
+    spec = LiteralSpecification(image_dir, label_dir)
+    with pytest.raises(FileNotFoundError):
+        DatasetDefinition._check_dataset_paths({spec})
+    with pytest.warns(UserWarning, match="there are no labels"):
+        assert DatasetDefinition._check_dataset_paths({spec}, prune=True) == set()
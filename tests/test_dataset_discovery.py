@@ -0,0 +1,75 @@
+import os
+import pytest
+
+from pathlib import Path
+
+from yogo.data import yogo_dataset
+from yogo.data.yogo_dataset import LABEL_INDEX_DIR_NAME, ObjectDetectionDataset
+
+
+CLASSES = ["you", "only", "glance", "once"]
+
+
+def make_folders(tmp_path: Path, image_names, label_names):
+    image_path, label_path = tmp_path / "images", tmp_path / "labels"
+    image_path.mkdir()
+    label_path.mkdir()
+    for name in image_names:
+        (image_path / name).touch()
+    for name in label_names:
+        (label_path / name).write_text("0 0.5 0.5 0.2 0.2\n")
+    return image_path, label_path
+
+
+def test_labels_are_matched_to_images(tmp_path):
+    image_path, label_path = make_folders(
+        tmp_path,
+        ["img_1.png", "img_2.jpg", "img_3.png", "img_3.jpg", "img_4.png"],
+        ["img_1.txt", "img_2.txt", "img_3.txt", ".img_5.txt", "notes.csv"],
+    )
+
+    dataset = ObjectDetectionDataset(image_path, label_path, 8, 6, CLASSES)
+    pairs = dict(zip(dataset._label_paths, dataset._image_paths))
+    assert pairs == {
+        str(label_path / "img_1.txt"): str(image_path / "img_1.png"),
+        str(label_path / "img_2.txt"): str(image_path / "img_2.jpg"),
+        # pngs are preferred over jpgs
+        str(label_path / "img_3.txt"): str(image_path / "img_3.png"),
+    }
+
+
+def test_missing_images_are_reported(tmp_path):
+    image_path, label_path = make_folders(
+        tmp_path, ["img_1.png", "img_2.tif"], ["img_1.txt", "img_2.txt"]
+    )
+
+    with pytest.raises(FileNotFoundError, match="img_2.txt"):
+        ObjectDetectionDataset(image_path, label_path, 8, 6, CLASSES)
+
+
+def test_pairs_are_cached_until_a_folder_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(yogo_dataset, "DISCOVERY_MIN_AGE_NS", 0)
+    image_path, label_path = make_folders(
+        tmp_path, ["img_1.png", "img_2.png"], ["img_1.txt", "img_2.txt"]
+    )
+
+    def pairs():
+        dataset = ObjectDetectionDataset(image_path, label_path, 8, 6, CLASSES)
+        return sorted(zip(dataset._label_paths, dataset._image_paths))
+
+    first = pairs()
+    assert len(first) == 2
+    assert len(list((label_path / LABEL_INDEX_DIR_NAME).glob("pairs_*.json"))) == 1
+
+    # with the folders' mtimes restored, the new pair is not listed
+    mtimes = [p.stat().st_mtime_ns for p in (image_path, label_path)]
+    (image_path / "img_3.png").touch()
+    (label_path / "img_3.txt").write_text("")
+    for p, mtime in zip((image_path, label_path), mtimes):
+        os.utime(p, ns=(mtime, mtime))
+    assert pairs() == first
+
+    # but it is once the folder has changed
+    (image_path / "img_4.png").touch()
+    (label_path / "img_4.txt").write_text("")
+    assert len(pairs()) == 4
@@ -0,0 +1,58 @@
+import torch
+import pytest
+
+from yogo.infer import _FlipTTA
+from yogo.data.data_transforms import hflip_grid, vflip_grid
+
+
+class FlipEquivariantModel(torch.nn.Module):
+    """
+    fake model for (B, 1, Sy, Sx) images, that predicts a box centered on
+    every cell, with the image's pixel values as sizes, objectness, and class
+    scores - so its predictions flip exactly with its input
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.num_calls = 0
+
+    def forward(self, x):
+        self.num_calls += 1
+        bs, _, Sy, Sx = x.shape
+        xs = ((torch.arange(Sx) + 0.5) / Sx).expand(bs, 1, Sy, Sx)
+        ys = ((torch.arange(Sy)[:, None] + 0.5) / Sy).expand(bs, 1, Sy, Sx)
+        return torch.cat([xs, ys] + [x] * 5, dim=1)
+
+
+def test_hflip_grid_labels():
+    labels = torch.rand(2, 6, 3, 4)
+    flipped = hflip_grid(labels, x_channels=(1, 3))
+
+    expected = torch.flip(labels, dims=(3,))
+    expected[:, 1], expected[:, 3] = 1 - expected[:, 3], 1 - expected[:, 1]
+    torch.testing.assert_close(flipped, expected)
+
+
+def test_vflip_grid_is_involution():
+    labels = torch.rand(2, 6, 3, 4)
+    twice = vflip_grid(vflip_grid(labels, y_channels=(2, 4)), y_channels=(2, 4))
+    torch.testing.assert_close(twice, labels)
+
+
+@pytest.mark.parametrize("flips", [["h"], ["v"], ["hv"], ["h", "v", "hv"]])
+def test_flip_tta_unflips_predictions(flips):
+    model = FlipEquivariantModel()
+    imgs = torch.rand(3, 1, 5, 7)
+
+    expected = model(imgs)
+    model.num_calls = 0
+
+    merged = _FlipTTA(model, flips)(imgs)
+
+    torch.testing.assert_close(merged, expected)
+    assert model.num_calls == 1
+
+
+def test_flip_tta_invalid_flip():
+    with pytest.raises(ValueError):
+        _FlipTTA(FlipEquivariantModel(), ["x"])
@@ -0,0 +1,99 @@
+import time
+import torch
+
+from yogo.data.yogo_dataset import (
+    LABEL_TENSOR_PRED_DIM_SIZE,
+    format_labels_tensor,
+    format_labels_tensor_batched,
+)
+
+
+def format_labels_tensor_loop(labels: torch.Tensor, Sx: int, Sy: int) -> torch.Tensor:
+    "the original, per-label implementation of format_labels_tensor"
+    output = torch.zeros(LABEL_TENSOR_PRED_DIM_SIZE, Sy, Sx)
+
+    iis = (labels[:, 1] + labels[:, 3]) * Sx // 2
+    jjs = (labels[:, 2] + labels[:, 4]) * Sy // 2
+
+    for i, j, label in zip(iis.int(), jjs.int(), labels):
+        output[0, j, i] = 1
+        output[1:5, j, i] = label[1:]
+        output[5, j, i] = label[0]
+
+    return output
+
+
+def random_labels(n: int, num_classes: int = 7) -> torch.Tensor:
+    xy0 = torch.rand(n, 2) * 0.9
+    wh = torch.rand(n, 2) * 0.1
+    classes = torch.randint(0, num_classes, (n, 1)).float()
+    return torch.cat([classes, xy0, xy0 + wh], dim=1)
+
+
+def test_matches_loop():
+    torch.manual_seed(0)
+    for n in (0, 1, 10, 100, 1000):
+        labels = random_labels(n)
+        torch.testing.assert_close(
+            format_labels_tensor(labels, 129, 97),
+            format_labels_tensor_loop(labels, 129, 97),
+        )
+
+
+def test_last_label_in_a_cell_wins():
+    labels = torch.tensor(
+        [
+            [1, 0.1, 0.1, 0.2, 0.2],
+            [2, 0.11, 0.11, 0.21, 0.21],
+            [3, 0.6, 0.6, 0.7, 0.7],
+            [4, 0.12, 0.12, 0.2, 0.2],
+        ]
+    )
+    output = format_labels_tensor(labels, 4, 4)
+    assert output[0].sum() == 2
+    assert output[5, 0, 0] == 4
+    torch.testing.assert_close(output, format_labels_tensor_loop(labels, 4, 4))
+
+
+def test_batched_matches_per_image():
+    torch.manual_seed(1)
+    per_image_labels = [random_labels(n) for n in (100, 0, 37, 100)]
+    labels = torch.cat(per_image_labels)
+    image_idxs = torch.cat(
+        [torch.full((len(lbls),), i) for i, lbls in enumerate(per_image_labels)]
+    )
+
+    batched = format_labels_tensor_batched(labels, image_idxs, 4, 129, 97)
+    torch.testing.assert_close(
+        batched,
+        torch.stack([format_labels_tensor(lbls, 129, 97) for lbls in per_image_labels]),
+    )
+
+
+def test_microbenchmark():
+    """
+    a batch of 64 images of 100 blobs each (as from BlobDataset), formatted
+    per label in Python vs. in one batched call
+    """
+    torch.manual_seed(2)
+    batch_size, blobs_per_image, Sx, Sy = 64, 100, 129, 97
+    per_image_labels = [random_labels(blobs_per_image) for _ in range(batch_size)]
+    labels = torch.cat(per_image_labels)
+    image_idxs = torch.arange(batch_size).repeat_interleave(blobs_per_image)
+
+    t0 = time.perf_counter()
+    expected = torch.stack(
+        [format_labels_tensor_loop(lbls, Sx, Sy) for lbls in per_image_labels]
+    )
+    loop_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    batched = format_labels_tensor_batched(labels, image_idxs, batch_size, Sx, Sy)
+    batched_time = time.perf_counter() - t0
+
+    print(
+        f"format_labels_tensor: loop {1e3 * loop_time:.2f} ms, "
+        f"batched {1e3 * batched_time:.2f} ms"
+    )
+    torch.testing.assert_close(batched, expected)
+    assert batched_time < loop_time
@@ -0,0 +1,56 @@
+import zarr
+import numpy as np
+import pytest
+
+from yogo.utils.frame_counts import FrameCountWriter, trailing_window_sums
+
+
+def test_trailing_window_sums():
+    frame_counts = np.array([[1, 0], [2, 1], [0, 0], [3, 4]], dtype=np.uint16)
+    np.testing.assert_array_equal(
+        trailing_window_sums(frame_counts, 2), [[1, 0], [3, 1], [2, 1], [3, 4]]
+    )
+    np.testing.assert_array_equal(trailing_window_sums(frame_counts, 1), frame_counts)
+    with pytest.raises(ValueError):
+        trailing_window_sums(frame_counts, 0)
+
+
+def test_writer_round_trip(tmp_path):
+    path = tmp_path / "run.counts.zarr"
+    writer = FrameCountWriter(
+        path, num_frames=5, num_classes=2, max_count_per_frame=100
+    )
+    writer.write(0, np.array([[1, 0], [0, 2]]))
+    writer.write(2, np.array([[1, 1], [0, 0], [5, 0]]))
+    writer.close(confidence_histogram=np.ones((2, 4)), window=3)
+
+    root = zarr.open_group(str(path), mode="r")
+    assert root["frame_counts"].dtype == np.uint16
+    assert root.attrs["totals"] == [7, 3]
+    assert root.attrs["class_names"] == ["0", "1"]
+    assert root.attrs["confidence_bin_edges"] == [0.0, 0.25, 0.5, 0.75, 1.0]
+    assert root["window_counts"][-1].tolist() == [6, 1]
+    assert root.attrs["complete"]
+
+
+def test_wide_grids_use_uint32(tmp_path):
+    writer = FrameCountWriter(
+        tmp_path / "run.counts.zarr",
+        num_frames=1,
+        num_classes=1,
+        max_count_per_frame=1 << 17,
+    )
+    assert writer.root["frame_counts"].dtype == np.uint32
+
+
+def test_resume_keeps_written_frames(tmp_path):
+    path = tmp_path / "run.counts.zarr"
+    writer = FrameCountWriter(path, num_frames=2, num_classes=1, max_count_per_frame=9)
+    writer.write(0, np.array([[3]]))
+
+    resumed = FrameCountWriter(
+        path, num_frames=2, num_classes=1, max_count_per_frame=9, resume=True
+    )
+    resumed.write(1, np.array([[4]]))
+    resumed.close()
+    assert zarr.open_group(str(path))["frame_counts"][:].ravel().tolist() == [3, 4]
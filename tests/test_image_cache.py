@@ -0,0 +1,90 @@
+import os
+import pickle
+
+import torch
+
+from yogo.data.image_cache import ImageCache
+
+
+IMAGE_SHAPE = (1, 6, 8)
+IMAGE_NBYTES = 6 * 8
+
+
+def open_cache(tmp_path, max_bytes, num_images=10, name="", total_max_bytes=None):
+    return ImageCache.open_or_create(
+        tmp_path,
+        key={"image_paths": [f"{name}{i}.png" for i in range(num_images)]},
+        num_images=num_images,
+        image_shape=IMAGE_SHAPE,
+        max_bytes=max_bytes,
+        total_max_bytes=total_max_bytes,
+    )
+
+
+def test_image_cache_round_trip(tmp_path):
+    cache = open_cache(tmp_path, max_bytes=10**6)
+    assert cache is not None and len(cache) == 10
+
+    image = torch.randint(0, 256, IMAGE_SHAPE, dtype=torch.uint8)
+    assert cache.get(3) is None
+    cache.put(3, image)
+    torch.testing.assert_close(cache.get(3), image)
+
+    # another process (e.g. a dataloader worker or DDP rank) opening the same
+    # dataset's cache sees the cached image
+    other = open_cache(tmp_path, max_bytes=10**6)
+    assert other.path == cache.path
+    torch.testing.assert_close(other.get(3), image)
+
+    unpickled = pickle.loads(pickle.dumps(cache))
+    assert unpickled._images is None
+    torch.testing.assert_close(unpickled.get(3), image)
+
+
+def test_image_cache_budget(tmp_path):
+    cache = open_cache(tmp_path, max_bytes=4096 + 4 * (IMAGE_NBYTES + 1))
+    assert cache is not None and len(cache) == 4
+    assert cache.nbytes <= 4096 + 4 * (IMAGE_NBYTES + 1)
+    assert cache.path.stat().st_size == cache.nbytes
+
+    # images past the capacity are not cached
+    cache.put(5, torch.zeros(IMAGE_SHAPE, dtype=torch.uint8))
+    assert cache.get(5) is None
+
+    assert open_cache(tmp_path, max_bytes=IMAGE_NBYTES) is None
+
+
+def test_image_cache_evicts_unused_caches(tmp_path):
+    cache_bytes = 4096 + 10 * (IMAGE_NBYTES + 1)
+    first = open_cache(tmp_path, max_bytes=10**6, name="a")
+    second = open_cache(tmp_path, max_bytes=10**6, name="b")
+    assert first.nbytes <= cache_bytes
+
+    # both are in use, so neither is evicted, even over budget
+    third = open_cache(tmp_path, max_bytes=10**6, name="c", total_max_bytes=0)
+    assert all(c.path.exists() for c in (first, second, third))
+
+    # a cache of the same images with a smaller budget is a new file; the
+    # old one is evicted once it's closed
+    first.close()
+    smaller = open_cache(
+        tmp_path,
+        max_bytes=4096 + 5 * (IMAGE_NBYTES + 1),
+        name="a",
+        total_max_bytes=3 * cache_bytes,
+    )
+    assert smaller.path != first.path and not first.path.exists()
+    assert second.path.exists() and third.path.exists()
+
+    # least recently used first
+    second.close()
+    third.close()
+    os.utime(third.path, (0, 0))
+    open_cache(tmp_path, max_bytes=10**6, name="d", total_max_bytes=3 * cache_bytes)
+    assert second.path.exists() and not third.path.exists()
+
+    # reopening an existing cache doesn't evict anything
+    assert open_cache(
+        tmp_path, max_bytes=10**6, name="b", total_max_bytes=0
+    ).path == (second.path)
+    assert len(list(tmp_path.glob("yogo_image_cache_*.bin"))) == 3
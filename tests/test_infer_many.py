@@ -0,0 +1,102 @@
+import pytest
+
+from pathlib import Path
+
+from yogo import infer_many as infer_many_module
+from yogo.infer import predict
+from yogo.infer_many import ProgressDB, infer_many, load_manifest, output_names
+
+
+def test_load_manifest_skips_comments_and_blanks(tmp_path):
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("# a comment\n/data/run_1/images\n\n/data/run_2.zarr\n")
+    assert load_manifest(manifest) == [
+        Path("/data/run_1/images"),
+        Path("/data/run_2.zarr"),
+    ]
+
+
+def test_output_names_disambiguates_same_stem():
+    paths = [Path("/a/images"), Path("/b/images"), Path("/c/run.zarr")]
+    names = output_names(paths)
+    assert names[Path("/c/run.zarr")] == "run"
+    assert names[Path("/a/images")] != names[Path("/b/images")]
+    assert all(names[p].startswith("images_") for p in paths[:2])
+    assert output_names(paths) == names
+
+
+def test_progress_db_survives_restart(tmp_path):
+    db_path = tmp_path / "progress.sqlite"
+    paths = [Path("/a"), Path("/b")]
+
+    db = ProgressDB(db_path)
+    db.register(paths)
+    db.mark_running(paths[0], tmp_path / "a")
+    db.mark_done(paths[0], num_images=10, load_s=0.1, duration_s=1.0)
+    db.mark_running(paths[1], tmp_path / "b")
+    db.mark_failed(paths[1], "boom")
+    db.close()
+
+    db = ProgressDB(db_path)
+    db.register(paths)
+    assert db.status(paths[0]) == "done"
+    assert db.status(paths[1]) == "failed"
+    assert db.failures() == [("/b", 1, "boom")]
+    db.close()
+
+
+def test_infer_many_resumes_interrupted_run(
+    tmp_path, monkeypatch, pth_path, write_images
+):
+    image_dirs = [write_images(f"run_{d}", num_images=3) for d in range(3)]
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("\n".join(str(p) for p in image_dirs))
+    output_dir = tmp_path / "output"
+    predict_kwargs = dict(save_preds=True, batch_size=2, obj_thresh=0.3)
+
+    calls = []
+
+    def interrupt_second_input(predictor, **kwargs):
+        calls.append((kwargs["path_to_images"], kwargs["resume"]))
+        if kwargs["path_to_images"] == image_dirs[1] and not kwargs["resume"]:
+            raise KeyboardInterrupt
+        return predict(predictor, **kwargs)
+
+    monkeypatch.setattr(infer_many_module, "predict", interrupt_second_input)
+    with pytest.raises(KeyboardInterrupt):
+        infer_many(pth_path, manifest, output_dir, device="cpu", **predict_kwargs)
+
+    db = ProgressDB(output_dir / "infer_many.sqlite")
+    assert [db.status(p) for p in image_dirs] == ["done", "running", "pending"]
+    db.close()
+
+    # the finished input must not be run again
+    (output_dir / "run_0" / "img_0.txt").unlink()
+
+    calls.clear()
+    failures = infer_many(
+        pth_path, manifest, output_dir, device="cpu", **predict_kwargs
+    )
+    assert failures == []
+    assert calls == [(image_dirs[1], True), (image_dirs[2], False)]
+    assert not (output_dir / "run_0" / "img_0.txt").exists()
+
+    db = ProgressDB(output_dir / "infer_many.sqlite")
+    assert db.counts_by_status() == {"done": 3}
+    db.close()
+
+    for image_dir in image_dirs[1:]:
+        expected_dir = tmp_path / "expected" / image_dir.name
+        expected_dir.mkdir(parents=True)
+        predict(
+            pth_path,
+            path_to_images=image_dir,
+            output_dir=str(expected_dir),
+            device="cpu",
+            **predict_kwargs,
+        )
+        outputs = {
+            p.name: p.read_text() for p in (output_dir / image_dir.name).glob("*.txt")
+        }
+        assert len(outputs) == 3
+        assert outputs == {p.name: p.read_text() for p in expected_dir.glob("*.txt")}
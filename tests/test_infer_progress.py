@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from yogo.infer import predict
+from yogo.utils.infer_progress import InferenceProgress
+
+
+RUN_CONFIG = {"path_to_pth": "model.pth", "num_images": 10, "obj_thresh": 0.5}
+
+
+def test_remaining_splits_gaps_into_chunks(tmp_path):
+    progress = InferenceProgress(tmp_path / "progress", RUN_CONFIG)
+    assert progress.remaining(10, chunk_size=4) == [(0, 4), (4, 8), (8, 10)]
+
+    progress.record((4, 8), counts=None, np_result=None)
+    assert progress.num_completed == 4
+    assert progress.remaining(10, chunk_size=3) == [(0, 3), (3, 4), (8, 10)]
+
+
+def test_resume_merges_recorded_chunks(tmp_path):
+    progress = InferenceProgress(tmp_path / "progress", RUN_CONFIG)
+    progress.record((4, 8), counts=np.array([1, 2]), np_result=np.ones((3, 2)))
+    progress.record((0, 4), counts=np.array([3, 4]), np_result=np.zeros((3, 1)))
+
+    resumed = InferenceProgress(tmp_path / "progress", RUN_CONFIG, resume=True)
+    assert resumed.remaining(10, chunk_size=4) == [(8, 10)]
+    assert resumed.counts().tolist() == [4, 6]
+
+    np_results = resumed.np_results()
+    assert [arr.shape for arr in np_results] == [(3, 1), (3, 2)]
+    assert np.all(np_results[0] == 0)
+
+
+def test_no_resume_discards_progress(tmp_path):
+    progress = InferenceProgress(tmp_path / "progress", RUN_CONFIG)
+    progress.record((0, 4), counts=None, np_result=None)
+
+    fresh = InferenceProgress(tmp_path / "progress", RUN_CONFIG, resume=False)
+    assert fresh.num_completed == 0
+
+
+def test_resume_with_different_settings_raises(tmp_path):
+    progress = InferenceProgress(tmp_path / "progress", RUN_CONFIG)
+    progress.record((0, 4), counts=None, np_result=None)
+
+    with pytest.raises(ValueError, match="obj_thresh"):
+        InferenceProgress(
+            tmp_path / "progress", {**RUN_CONFIG, "obj_thresh": 0.7}, resume=True
+        )
+
+
+def test_progress_is_only_recorded_when_asked_for(
+    tmp_path, monkeypatch, pth_path, write_images
+):
+    recorded = []
+    record = InferenceProgress.record
+
+    def spy(self, index_range, *args, **kwargs):
+        recorded.append(tuple(index_range))
+        return record(self, index_range, *args, **kwargs)
+
+    monkeypatch.setattr(InferenceProgress, "record", spy)
+
+    image_dir = write_images()
+    npys = []
+    for checkpoint_every, expected_ranges in (
+        (None, []),
+        (2, [(0, 2), (2, 4), (4, 5)]),
+    ):
+        output_dir = tmp_path / f"output_{checkpoint_every}"
+        output_dir.mkdir()
+        recorded.clear()
+        predict(
+            pth_path,
+            path_to_images=image_dir,
+            output_dir=str(output_dir),
+            save_npy=True,
+            count_predictions=True,
+            batch_size=2,
+            obj_thresh=1e-12,
+            device="cpu",
+            checkpoint_every=checkpoint_every,
+        )
+        assert recorded == expected_ranges
+        (npy_path,) = output_dir.glob("*.npy")
+        npys.append(np.load(npy_path))
+
+    np.testing.assert_array_equal(npys[0], npys[1])
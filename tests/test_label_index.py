@@ -0,0 +1,133 @@
+import os
+import json
+import pickle
+
+import numpy as np
+
+from yogo.data import yogo_dataset
+from yogo.data.yogo_dataset import (
+    LABEL_INDEX_DIR_NAME,
+    LabelIndex,
+    label_file_to_tensor,
+    labels_to_tensor,
+    load_labels,
+)
+
+
+CLASSES = ["healthy", "ring", "troph"]
+
+
+def write_labels(tmp_path):
+    label_dir = tmp_path / "labels"
+    label_dir.mkdir()
+    (label_dir / "a.txt").write_text("0 0.5 0.5 0.1 0.1\n1 0.2 0.3 0.05 0.04\n")
+    (label_dir / "b.txt").write_text("")
+    (label_dir / "c.txt").write_text("2 0.7 0.7 0.1 0.2\n1 0.4 0.6 0.1 0.1\n")
+    return label_dir, sorted(str(p) for p in label_dir.glob("*.txt"))
+
+
+def test_label_index_matches_load_labels(tmp_path):
+    label_dir, label_paths = write_labels(tmp_path)
+    index = LabelIndex.load_or_build(label_dir, label_paths, CLASSES)
+
+    assert (label_dir / LABEL_INDEX_DIR_NAME / f"manifest_{index.digest}.json").exists()
+    for label_path in label_paths:
+        expected = np.array(load_labels(label_path, CLASSES), dtype=np.float32)
+        np.testing.assert_allclose(
+            index.file_labels(index.row(label_path)), expected.reshape(-1, 5)
+        )
+        np.testing.assert_allclose(
+            labels_to_tensor(index.file_labels(index.row(label_path)), 8, 6),
+            label_file_to_tensor(label_path, 8, 6, CLASSES),
+        )
+
+
+def test_label_index_is_reused(tmp_path):
+    label_dir, label_paths = write_labels(tmp_path)
+    index = LabelIndex.load_or_build(label_dir, label_paths, CLASSES)
+
+    labels_npy = label_dir / LABEL_INDEX_DIR_NAME / f"labels_{index.digest}.npy"
+    mtime = labels_npy.stat().st_mtime_ns
+    os.utime(labels_npy, ns=(mtime - 10**9, mtime - 10**9))
+
+    index = LabelIndex.load_or_build(label_dir, label_paths, CLASSES)
+    assert labels_npy.stat().st_mtime_ns == mtime - 10**9
+    assert isinstance(index.labels, np.memmap)
+
+
+def test_label_index_is_invalidated(tmp_path):
+    label_dir, label_paths = write_labels(tmp_path)
+    LabelIndex.load_or_build(label_dir, label_paths, CLASSES)
+
+    # label files are replaced rather than edited in place, which changes the
+    # label folder's mtime
+    (label_dir / "b.tmp").write_text("2 0.1 0.1 0.1 0.1\n0 0.3 0.3 0.1 0.1\n")
+    os.replace(label_dir / "b.tmp", label_dir / "b.txt")
+    index = LabelIndex.load_or_build(label_dir, label_paths, CLASSES)
+    np.testing.assert_allclose(
+        index.file_labels(index.row(label_dir / "b.txt")),
+        [[2, 0.1, 0.1, 0.1, 0.1], [0, 0.3, 0.3, 0.1, 0.1]],
+    )
+
+    # notes.json remaps class indices, so it invalidates the index too
+    notes_data = {
+        "categories": [
+            {"id": 0, "name": "ring"},
+            {"id": 1, "name": "troph"},
+            {"id": 2, "name": "healthy"},
+        ]
+    }
+    with open(tmp_path / "notes.json", "w") as f:
+        json.dump(notes_data, f)
+    index = LabelIndex.load_or_build(
+        label_dir, label_paths, CLASSES, notes_data=notes_data
+    )
+    assert index.file_labels(index.row(label_dir / "c.txt"))[0, 0] == 0
+
+
+def test_label_index_skips_stats_of_unchanged_folders(tmp_path, monkeypatch):
+    label_dir, label_paths = write_labels(tmp_path)
+    LabelIndex.load_or_build(label_dir, label_paths, CLASSES)
+
+    # the folder is too new for its mtime to be trusted, so its label files are
+    # stat-ed, and the manifest records the mtime once it's old enough
+    mtime = label_dir.stat().st_mtime_ns - 10**10
+    os.utime(label_dir, ns=(mtime, mtime))
+    LabelIndex.load_or_build(label_dir, label_paths, CLASSES)
+
+    def fail(path):
+        if path.suffix == ".txt":
+            raise AssertionError(f"{path} was stat-ed")
+        return file_key(path)
+
+    file_key = yogo_dataset._file_key
+    monkeypatch.setattr(yogo_dataset, "_file_key", fail)
+    index = LabelIndex.load_or_build(label_dir, label_paths, CLASSES)
+    assert isinstance(index.labels, np.memmap)
+
+
+def test_label_indices_of_a_shared_folder_are_kept_apart(tmp_path):
+    label_dir, label_paths = write_labels(tmp_path)
+    index_ab = LabelIndex.load_or_build(label_dir, label_paths[:2], CLASSES)
+    index_c = LabelIndex.load_or_build(label_dir, label_paths[2:], CLASSES)
+    assert index_ab.digest != index_c.digest
+
+    for index, paths in ((index_ab, label_paths[:2]), (index_c, label_paths[2:])):
+        reloaded = LabelIndex.load_or_build(label_dir, paths, CLASSES)
+        assert isinstance(reloaded.labels, np.memmap)
+        for label_path in paths:
+            np.testing.assert_array_equal(
+                reloaded.file_labels(reloaded.row(label_path)),
+                index.file_labels(index.row(label_path)),
+            )
+    assert len(index_c.offsets) == 2
+
+
+def test_label_index_pickles_without_arrays(tmp_path):
+    label_dir, label_paths = write_labels(tmp_path)
+    index = LabelIndex.load_or_build(label_dir, label_paths, CLASSES)
+    index.labels, index.offsets  # open the memory maps
+
+    unpickled = pickle.loads(pickle.dumps(index))
+    assert unpickled._labels is None
+    np.testing.assert_array_equal(unpickled.file_labels(0), index.file_labels(0))
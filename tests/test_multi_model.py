@@ -0,0 +1,101 @@
+import torch
+
+from pathlib import Path
+from types import SimpleNamespace
+
+from yogo.infer import (
+    _InferenceOptions,
+    _PredictionSink,
+    _model_output_names,
+    _run_batches,
+)
+from yogo.utils import StageTimers
+
+
+NUM_CLASSES = 2
+
+
+def make_opts(**kwargs):
+    defaults = dict(
+        batch_size=2,
+        device=torch.device("cpu"),
+        half=False,
+        draw_boxes=False,
+        save_preds=False,
+        save_npy=False,
+        save_columnar=False,
+        save_frame_counts=False,
+        confidence_bins=0,
+        compress_level=1,
+        count_predictions=True,
+        return_full_predictions=True,
+        output_dir=None,
+        output_img_ftype=".png",
+        obj_thresh=0.5,
+        iou_thresh=0.5,
+        min_class_confidence_threshold=0.0,
+        class_names=None,
+        images_are_normalized=False,
+        img_hw=(4, 4),
+        output_shape=(1, 5 + NUM_CLASSES, 2, 2),
+    )
+    defaults.update(kwargs)
+    return _InferenceOptions(**defaults)
+
+
+def make_model(class_idx):
+    """fake model that predicts one object of class_idx per image"""
+
+    def model(x):
+        preds = torch.zeros(len(x), 5 + NUM_CLASSES, 2, 2)
+        preds[:, 0:2] = 0.25
+        preds[:, 2:4] = 0.1
+        preds[:, 4, 0, 0] = 1.0
+        preds[:, 5 + class_idx] = 1.0
+        return preds
+
+    return model
+
+
+def test_run_batches_runs_every_model_on_each_batch():
+    num_images = 5
+    dataloader = [
+        (torch.zeros(2, 1, 4, 4), ["a.png", "b.png"]),
+        (torch.zeros(2, 1, 4, 4), ["c.png", "d.png"]),
+        (torch.zeros(1, 1, 4, 4), ["e.png"]),
+    ]
+    opts = make_opts()
+    stage_timers = StageTimers(enabled=False)
+    sinks = [
+        _PredictionSink(opts, num_images, index_offset=0, stage_timers=stage_timers)
+        for _ in range(2)
+    ]
+    seen = []
+
+    _run_batches(
+        [(make_model(0), sinks[0]), (make_model(1), sinks[1])],
+        dataloader,
+        opts,
+        stage_timers,
+        on_batch=seen.append,
+    )
+
+    assert seen == [2, 2, 1]
+
+    results = [sink.partial_results() for sink in sinks]
+    assert results[0].counts.tolist() == [5, 0]
+    assert results[1].counts.tolist() == [0, 5]
+    assert results[0].full_predictions.shape == (5, 5 + NUM_CLASSES, 2, 2)
+    assert (results[1].full_predictions[:, 6, 0, 0] == 1).all()
+
+
+def test_model_output_names():
+    def predictor(model_name, pth):
+        return SimpleNamespace(model_name=model_name, path_to_pth=Path(pth))
+
+    assert _model_output_names(
+        [predictor("fast", "a/best.pth"), predictor(None, "b/best.pth")]
+    ) == ["fast", "best"]
+    assert _model_output_names(
+        [predictor(None, "a/best.pth"), predictor(None, "b/best.pth")]
+    ) == ["0_best", "1_best"]
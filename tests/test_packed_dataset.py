@@ -0,0 +1,236 @@
+import shutil
+
+import torch
+import pytest
+
+from pathlib import Path
+from collections import Counter
+from torchvision.io import write_png
+
+from yogo.utils.pack import pack_dataset_definition
+from yogo.data.yogo_dataset import ObjectDetectionDataset
+from yogo.data.path_table import PathTable
+from yogo.data.tar_dataset import TarShardDataset
+from yogo.data.split_fractions import SplitFractions
+from yogo.data.yogo_dataloader import get_tar_datasets
+from yogo.data.packed_dataset import PackedDetectionDataset
+from yogo.data.dataset_definition_file import (
+    DatasetDefinition,
+    PackedSpecification,
+    TarSpecification,
+)
+
+
+DATA_PATH = Path(__file__).parent / "fake-data" / "data"
+CLASSES = ["you", "only", "glance", "once"]
+IMAGE_HW = (12, 16)
+
+
+def write_defn(tmp_path):
+    data_path = tmp_path / "data"
+    shutil.copytree(DATA_PATH, data_path)
+    # the fake images are empty files, and packing needs images it can decode
+    generator = torch.Generator().manual_seed(0)
+    for image_path in sorted(data_path.glob("images*/*.png")):
+        image = torch.randint(0, 256, (1, 24, 32), generator=generator)
+        write_png(image.to(torch.uint8), str(image_path))
+    (data_path / "labels1" / "img_2.txt").write_text(
+        "0 0.5 0.5 0.2 0.2\n3 0.2 0.3 0.1 0.2\n"
+    )
+    (data_path / "labels3" / "img_1.txt").write_text(
+        "2 0.7 0.7 0.2 0.2\n1 0.3 0.6 0.1 0.1\n"
+    )
+
+    defn_path = tmp_path / "defn.yml"
+    defn_path.write_text(
+        "class_names: [you, only, glance, once]\n"
+        "dataset_split_fractions: {train: 1, val: 0, test: 0}\n"
+        "dataset_paths:\n"
+        + "".join(
+            f"  set{i}:\n"
+            f"    image_path: {data_path / f'images{i}'}\n"
+            f"    label_path: {data_path / f'labels{i}'}\n"
+            for i in (1, 2, 3)
+        )
+    )
+    return defn_path
+
+
+def test_pack_round_trip(tmp_path):
+    defn_path = write_defn(tmp_path)
+    packed_defn_path = pack_dataset_definition(
+        defn_path, tmp_path / "packed", image_hw=IMAGE_HW, images_per_shard=4
+    )
+
+    literal_defn = DatasetDefinition.from_yaml(defn_path)
+    packed_defn = DatasetDefinition.from_yaml(packed_defn_path)
+    assert packed_defn.classes == literal_defn.classes
+    assert packed_defn.split_fractions == literal_defn.split_fractions
+    # 9 images, at most 4 per shard
+    assert len(packed_defn.dataset_paths) == 3
+    assert all(isinstance(s, PackedSpecification) for s in packed_defn.dataset_paths)
+
+    expected = {}
+    for spec in literal_defn.dataset_paths:
+        dataset = ObjectDetectionDataset(
+            spec.image_path, spec.label_path, 8, 6, CLASSES, image_hw=IMAGE_HW
+        )
+        for i in range(len(dataset)):
+            expected[str(dataset._image_paths[i])] = dataset[i]
+
+    found = 0
+    for spec in packed_defn.dataset_paths:
+        packed = PackedDetectionDataset(
+            spec.packed_path, 8, 6, CLASSES, image_hw=IMAGE_HW
+        )
+        assert isinstance(packed.image_paths, PathTable)
+        for i in range(len(packed)):
+            image, labels = packed[i]
+            expected_image, expected_labels = expected[packed.image_paths[i]]
+            torch.testing.assert_close(image, expected_image)
+            torch.testing.assert_close(labels, expected_labels)
+            found += 1
+
+    assert found == len(expected) == 9
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        dict(classes=CLASSES[::-1], image_hw=IMAGE_HW),
+        dict(classes=CLASSES, image_hw=(24, 32)),
+        dict(classes=CLASSES, image_hw=IMAGE_HW, rgb=True),
+    ],
+)
+def test_packed_dataset_rejects_mismatched_settings(tmp_path, kwargs):
+    defn_path = write_defn(tmp_path)
+    packed_defn_path = pack_dataset_definition(
+        defn_path, tmp_path / "packed", image_hw=IMAGE_HW
+    )
+    (spec,) = DatasetDefinition.from_yaml(packed_defn_path).dataset_paths
+
+    with pytest.raises(ValueError):
+        PackedDetectionDataset(spec.packed_path, 8, 6, **kwargs)
+
+
+def sample_key(sample):
+    image, labels = sample
+    return image.numpy().tobytes() + labels.numpy().tobytes()
+
+
+def literal_samples(defn_path):
+    samples = Counter()
+    for spec in DatasetDefinition.from_yaml(defn_path).dataset_paths:
+        dataset = ObjectDetectionDataset(
+            spec.image_path, spec.label_path, 8, 6, CLASSES, image_hw=IMAGE_HW
+        )
+        samples.update(sample_key(dataset[i]) for i in range(len(dataset)))
+    return samples
+
+
+def test_tar_round_trip(tmp_path):
+    defn_path = write_defn(tmp_path)
+    packed_defn_path = pack_dataset_definition(
+        defn_path, tmp_path / "tar", images_per_shard=4, shard_format="tar"
+    )
+    specs = DatasetDefinition.from_yaml(packed_defn_path).dataset_paths
+    assert len(specs) == 3
+    assert all(isinstance(s, TarSpecification) for s in specs)
+
+    for shuffle in (False, True):
+        dataset = TarShardDataset(
+            [s.tar_path for s in specs],
+            8,
+            6,
+            CLASSES,
+            image_hw=IMAGE_HW,
+            shuffle=shuffle,
+            shuffle_buffer_size=3,
+            rank=0,
+            world_size=1,
+        )
+        assert Counter(map(sample_key, dataset)) == literal_samples(defn_path)
+
+
+def test_tar_shards_are_split_across_ranks(tmp_path):
+    defn_path = write_defn(tmp_path)
+    packed_defn_path = pack_dataset_definition(
+        defn_path, tmp_path / "tar", images_per_shard=2, shard_format="tar"
+    )
+    # 9 images in 5 shards of 2, 2, 2, 2, and 1 images
+    specs = DatasetDefinition.from_yaml(packed_defn_path).dataset_paths
+    tar_paths = [s.tar_path for s in specs]
+
+    for world_size in (2, 7):
+        rank_samples = [
+            list(
+                TarShardDataset(
+                    tar_paths,
+                    8,
+                    6,
+                    CLASSES,
+                    image_hw=IMAGE_HW,
+                    shuffle=True,
+                    rank=rank,
+                    world_size=world_size,
+                )
+            )
+            for rank in range(world_size)
+        ]
+        # every rank reads as many samples, and no sample is read twice
+        assert len({len(samples) for samples in rank_samples}) == 1
+        assert len(rank_samples[0]) > 0
+        read = Counter(sample_key(s) for samples in rank_samples for s in samples)
+        expected = literal_samples(defn_path)
+        assert all(read[k] <= expected[k] for k in read)
+
+
+def test_unreadable_tar_samples_are_dropped(tmp_path):
+    defn_path = write_defn(tmp_path)
+    (tmp_path / "data" / "images2" / "img_3.png").write_bytes(b"")
+    (tmp_path / "data" / "images3" / "img_1.png").write_bytes(b"not a png")
+    packed_defn_path = pack_dataset_definition(
+        defn_path, tmp_path / "tar", shard_format="tar"
+    )
+    (spec,) = DatasetDefinition.from_yaml(packed_defn_path).dataset_paths
+
+    dataset = TarShardDataset(
+        [spec.tar_path], 8, 6, CLASSES, image_hw=IMAGE_HW, rank=0, world_size=1
+    )
+    with pytest.warns(UserWarning):
+        samples = list(dataset)
+    assert len(samples) == 9
+    assert sum(sample is None for sample in samples) == 2
+
+
+@pytest.mark.parametrize(
+    "images_per_shard,split_by_shard", [(10_000, False), (4, False), (2, True)]
+)
+def test_tar_datasets_split_every_fraction(tmp_path, images_per_shard, split_by_shard):
+    defn_path = write_defn(tmp_path)
+    packed_defn_path = pack_dataset_definition(
+        defn_path,
+        tmp_path / "tar",
+        images_per_shard=images_per_shard,
+        shard_format="tar",
+    )
+    defn = DatasetDefinition.from_yaml(packed_defn_path)
+    split_fractions = SplitFractions(0.6, 0.2, 0.2)
+
+    if split_by_shard:
+        datasets = get_tar_datasets(
+            defn, 8, 6, image_hw=IMAGE_HW, split_fraction_override=split_fractions
+        )
+        # 5 shards, split into 3, 1, and 1
+        assert [len(d.tar_paths) for d in datasets.values()] == [3, 1, 1]
+    else:
+        # too few shards to give each split at least one
+        with pytest.warns(UserWarning, match="samples are split"):
+            datasets = get_tar_datasets(
+                defn, 8, 6, image_hw=IMAGE_HW, split_fraction_override=split_fractions
+            )
+        assert [len(d) for d in datasets.values()] == [5, 2, 2]
+
+    split_samples = {k: Counter(map(sample_key, d)) for k, d in datasets.items()}
+    assert all(len(samples) > 0 for samples in split_samples.values())
+    assert sum(split_samples.values(), Counter()) == literal_samples(defn_path)
@@ -0,0 +1,56 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from yogo.data.path_table import PathTable
+from yogo.data.image_path_dataset import ImagePathDataset
+
+
+PATHS = [
+    "/nfs/run_1/images/img_001.png",
+    "/nfs/run_1/images/img_002.png",
+    "/nfs/run_2/images/ïmg_001.png",
+    "relative/img.png",
+    "img.png",
+    "/nfs/run_1/images/img_003.png",
+]
+
+
+def test_path_table_round_trip():
+    table = PathTable.from_paths(PATHS)
+    assert len(table) == len(PATHS)
+    assert list(table) == table.tolist() == PATHS
+    assert [table[i] for i in range(-len(PATHS), 0)] == PATHS
+    assert table[np.int64(2)] == PATHS[2]
+    # each directory is stored once
+    assert len(table.dirs) == 4
+
+    with pytest.raises(IndexError):
+        table[len(PATHS)]
+
+    assert pickle.loads(pickle.dumps(table)).tolist() == PATHS
+    assert PathTable.from_paths([]).tolist() == []
+
+
+def test_path_table_is_smaller_than_unicode_arrays():
+    paths = [
+        f"/hpc/mydata/some.user/experiments/2024-01-01/run_{i // 1000}/images/"
+        f"img_{i:06d}.png"
+        for i in range(10_000)
+    ]
+    table = PathTable.from_paths(paths)
+    assert table.tolist() == paths
+    assert table.nbytes * 10 < np.array(paths).astype(np.str_).nbytes
+
+
+def test_image_path_dataset_paths(tmp_path):
+    for name in ("img_2.png", "img_1.png", ".img_3.png", "img_4.jpg"):
+        (tmp_path / name).touch()
+
+    dataset = ImagePathDataset(tmp_path)
+    assert isinstance(dataset.image_paths, PathTable)
+    assert dataset.image_paths.tolist() == [
+        str(tmp_path / "img_1.png"),
+        str(tmp_path / "img_2.png"),
+    ]
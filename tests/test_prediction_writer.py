@@ -0,0 +1,79 @@
+import torch
+import tarfile
+import zipfile
+
+from yogo.infer import format_label_strings
+from yogo.data.yogo_dataset import load_labels
+from yogo.utils.prediction_formatting import format_to_numpy
+from yogo.utils.prediction_writer import LabelFileWriter
+
+
+def fake_batch_preds():
+    """two images of (7, 4, 4) predictions for 2 classes; the second is empty"""
+    preds = torch.zeros(2, 7, 4, 4)
+    preds[0, 4, 1, 1] = 0.9
+    preds[0, 0:4, 1, 1] = torch.tensor([0.3, 0.4, 0.1, 0.2])
+    preds[0, 5:, 1, 1] = torch.tensor([0.25, 0.75])
+    preds[0, 4, 3, 2] = 0.8
+    preds[0, 0:4, 3, 2] = torch.tensor([0.7, 0.8, 0.15, 0.1])
+    preds[0, 5:, 3, 2] = torch.tensor([0.6, 0.4])
+    return preds
+
+
+def test_label_strings_read_back_through_load_labels(tmp_path):
+    first, second = format_label_strings(fake_batch_preds())
+    assert second == ""
+
+    label_path = tmp_path / "labels.txt"
+    label_path.write_text(first)
+    labels = load_labels(label_path, classes=["a", "b"])
+
+    assert sorted(labels) == sorted(
+        [
+            [1.0, *torch.tensor([0.3, 0.4, 0.1, 0.2]).tolist()],
+            [0.0, *torch.tensor([0.7, 0.8, 0.15, 0.1]).tolist()],
+        ]
+    )
+
+
+def test_min_class_confidence_applies_to_label_strings_and_npy():
+    preds = fake_batch_preds()
+    first, _ = format_label_strings(preds, min_class_confidence_threshold=0.7)
+    assert len(first.splitlines()) == 1 and first.startswith("1 ")
+
+    rows = format_to_numpy(
+        0, preds[0].numpy(), 4, 4, min_class_confidence_threshold=0.7
+    )
+    assert rows.shape[1] == 1 and rows[6, 0] == 1
+
+
+def test_writes_loose_files(tmp_path):
+    writer = LabelFileWriter(tmp_path)
+    for i in range(20):
+        writer.write(tmp_path / f"img_{i}.txt", f"0 0.{i} 0.5 0.1 0.1")
+    writer.close()
+    assert (tmp_path / "img_7.txt").read_text() == "0 0.7 0.5 0.1 0.1"
+
+
+def test_writes_tar_archive_and_appends(tmp_path):
+    writer = LabelFileWriter(tmp_path, archive="tar", archive_name="run")
+    writer.write(tmp_path / "img_0.txt", "0 0.5 0.5 0.1 0.1")
+    writer.close()
+
+    writer = LabelFileWriter(tmp_path, archive="tar", archive_name="run", append=True)
+    writer.write(tmp_path / "img_1.txt", "1 0.5 0.5 0.1 0.1")
+    writer.close()
+
+    assert not (tmp_path / "img_0.txt").exists()
+    with tarfile.open(tmp_path / "run.tar") as tar:
+        assert tar.getnames() == ["img_0.txt", "img_1.txt"]
+        assert tar.extractfile("img_1.txt").read() == b"1 0.5 0.5 0.1 0.1"
+
+
+def test_writes_zip_archive(tmp_path):
+    writer = LabelFileWriter(tmp_path, archive="zip")
+    writer.write(tmp_path / "img_0.txt", "")
+    writer.close()
+
+    with zipfile.ZipFile(tmp_path / "preds.zip") as zf:
+        assert zf.read("img_0.txt") == b""
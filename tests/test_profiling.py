@@ -0,0 +1,101 @@
+import torch
+import pytest
+
+from yogo.infer import do_infer, predict
+from yogo.utils.profiling import StepTracer
+from yogo.utils.argparsers import global_parser
+
+
+def run_steps(tracer: StepTracer, num_steps: int) -> None:
+    with tracer:
+        for _ in range(num_steps):
+            torch.ones(8, 8) @ torch.ones(8, 8)
+            tracer.step()
+
+
+def test_tracer_writes_trace(tmp_path):
+    tracer = StepTracer((1, 3), tmp_path, name="loop")
+    run_steps(tracer, 5)
+
+    assert tracer.trace_written
+    assert (tmp_path / "loop.pt.trace.json").stat().st_size > 0
+    assert "aten::" in (tmp_path / "loop_top_ops.txt").read_text()
+
+
+def test_tracer_is_a_no_op_without_steps(tmp_path):
+    tracer = StepTracer(None, tmp_path / "traces")
+    run_steps(tracer, 5)
+
+    assert tracer.profiler is None
+    assert not tracer.trace_written
+    assert not (tmp_path / "traces").exists()
+
+
+def test_tracer_warns_if_loop_ends_early(tmp_path):
+    with pytest.warns(UserWarning, match="no trace was written"):
+        run_steps(StepTracer((5, 10), tmp_path), 3)
+    assert list(tmp_path.iterdir()) == []
+
+    with pytest.raises(ValueError):
+        StepTracer((3, 3), tmp_path)
+
+
+@pytest.mark.parametrize("trace_args", [[], ["--trace-steps", "1:2"]])
+def test_infer_trace_steps(tmp_path, trace_args, pth_path, write_images):
+    image_dir = write_images(num_images=6)
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+
+    args = global_parser().parse_args(
+        [
+            "infer",
+            str(pth_path),
+            "--path-to-images",
+            str(image_dir),
+            "--output-dir",
+            str(output_dir),
+            "--save-preds",
+            "--batch-size",
+            "2",
+            "--device",
+            "cpu",
+            *trace_args,
+        ]
+    )
+    do_infer(args)
+
+    traces = sorted(p.name for p in output_dir.glob("infer*"))
+    if len(trace_args) == 0:
+        assert traces == []
+    else:
+        assert traces == ["infer.pt.trace.json", "infer_top_ops.txt"]
+
+
+def test_tiled_infer_steps_once_per_batch_of_tiles(
+    tmp_path, monkeypatch, pth_path, write_images
+):
+    steps = []
+    monkeypatch.setattr(StepTracer, "step", lambda self: steps.append(1))
+    image_dir = write_images(num_images=6)
+
+    # each image is one tile, so batches of 4 tiles span images
+    predict(
+        pth_path,
+        path_to_images=image_dir,
+        output_dir=str(tmp_path),
+        count_predictions=True,
+        batch_size=4,
+        tile_overlap=8,
+        device="cpu",
+    )
+    assert len(steps) == 2
+
+
+def test_train_trace_steps_are_parsed():
+    parser = global_parser()
+    assert parser.parse_args(["train", "defn.yml"]).trace_steps is None
+    args = parser.parse_args(["train", "defn.yml", "--trace-steps", "10:15"])
+    assert args.trace_steps == (10, 15)
+
+    with pytest.raises(SystemExit):
+        parser.parse_args(["train", "defn.yml", "--trace-steps", "15:10"])
@@ -0,0 +1,52 @@
+import torch
+
+from yogo.utils.rendering import draw_box_outlines, draw_yogo_predictions_batched
+
+
+def test_draw_box_outlines():
+    imgs = torch.zeros(2, 3, 6, 8, dtype=torch.uint8)
+    draw_box_outlines(
+        imgs,
+        image_idxs=torch.tensor([1]),
+        boxes=torch.tensor([[1, 2, 4, 4]]),
+        colours=torch.tensor([[255, 0, 0]], dtype=torch.uint8),
+    )
+
+    assert imgs[0].sum() == 0
+
+    red = imgs[1, 0]
+    expected = torch.zeros(6, 8, dtype=torch.uint8)
+    expected[2, 1:5] = expected[4, 1:5] = 255
+    expected[2:5, 1] = expected[2:5, 4] = 255
+    assert torch.equal(red, expected)
+    assert imgs[1, 1:].sum() == 0
+
+
+def test_boxes_are_clamped_to_the_image():
+    imgs = torch.zeros(1, 3, 4, 4, dtype=torch.uint8)
+    draw_box_outlines(
+        imgs,
+        image_idxs=torch.tensor([0]),
+        boxes=torch.tensor([[-3, -3, 10, 10]]),
+        colours=torch.tensor([[1, 1, 1]], dtype=torch.uint8),
+    )
+    assert imgs[0, 0, 0].tolist() == [1, 1, 1, 1]
+    assert imgs[0, 0, 1].tolist() == [1, 0, 0, 1]
+
+
+def test_draw_yogo_predictions_batched():
+    preds = torch.zeros(2, 7, 4, 4)
+    preds[1, 4, 1, 1] = 0.9
+    preds[1, 0:4, 1, 1] = torch.tensor([0.5, 0.5, 0.25, 0.25])
+    preds[1, 5:, 1, 1] = torch.tensor([0.2, 0.8])
+
+    imgs = torch.full((2, 1, 16, 16), 0.5)
+    drawn, label_texts = draw_yogo_predictions_batched(
+        imgs, preds, labels=["a", "b"], images_are_normalized=True
+    )
+
+    assert drawn.shape == (2, 3, 16, 16)
+    assert drawn.dtype == torch.uint8
+    assert (drawn[0] == 127).all()
+    assert (drawn[1] != 127).any()
+    assert label_texts == [[], [(6, 6, "b")]]
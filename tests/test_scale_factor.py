@@ -0,0 +1,75 @@
+import torch
+import pytest
+
+from copy import deepcopy
+
+from yogo.model import YOGO
+from yogo.infer import YOGOPredictor
+from yogo.utils.eval_scales import label_counts_per_frame
+
+
+def make_model():
+    return YOGO(img_size=(772, 1032), anchor_w=0.05, anchor_h=0.05, num_classes=7)
+
+
+def test_resize_model_scale_factor():
+    y = make_model()
+    Sx, Sy = y.get_grid_size()
+
+    y.resize_model(scale_factor=0.5)
+
+    assert tuple(int(d) for d in y.img_size) == (386, 516)
+    assert y.height_multiplier.item() == pytest.approx(2.0)
+    assert y.width_multiplier.item() == pytest.approx(2.0)
+    assert y._Cxs.shape == (y.Sy, y.Sx)
+    assert y.Sx < Sx and y.Sy < Sy
+
+
+def test_resize_model_crop_and_scale_factor():
+    y = make_model()
+    y.resize_model(img_height=193, scale_factor=0.5)
+
+    assert tuple(int(d) for d in y.img_size) == (96, 516)
+    assert y.height_multiplier.item() == pytest.approx(772 / 96)
+    assert y.width_multiplier.item() == pytest.approx(2.0)
+
+
+def test_resize_model_invalid_scale_factor():
+    y = make_model()
+    with pytest.raises(ValueError):
+        y.resize_model(scale_factor=0)
+    with pytest.raises(ValueError):
+        y.resize_model(scale_factor=1.5)
+
+
+def test_predictor_scale_factor(tmpdir):
+    y = make_model()
+    torch.save(
+        {
+            "epoch": 0,
+            "step": 0,
+            "model_state_dict": deepcopy(y.state_dict()),
+            "model_version": y.model_version,
+        },
+        str(tmpdir / "test.pth"),
+    )
+
+    predictor = YOGOPredictor(tmpdir / "test.pth", device="cpu", scale_factor=0.5)
+
+    # images are given at native resolution, and downsampled by the predictor
+    assert (predictor.img_h, predictor.img_w) == (772, 1032)
+    preds = predictor.model_jit(torch.randint(0, 256, (2, 1, 772, 1032)))
+    assert preds.shape == (2, 12, predictor.model.Sy, predictor.model.Sx)
+    assert predictor.output_shape[2:] == (predictor.model.Sy, predictor.model.Sx)
+
+
+def test_label_counts_per_frame():
+    labels = torch.zeros(2, 6, 3, 4)
+    labels[0, 0, 0, 0], labels[0, 5, 0, 0] = 1, 2
+    labels[0, 0, 1, 2], labels[0, 5, 1, 2] = 1, 2
+    labels[1, 0, 2, 3], labels[1, 5, 2, 3] = 1, 0
+    # class is ignored where the mask is 0
+    labels[1, 5, 0, 0] = 1
+
+    counts = label_counts_per_frame(labels, num_classes=3)
+    assert counts.tolist() == [[0, 0, 2], [1, 0, 0]]
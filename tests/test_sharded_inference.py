@@ -0,0 +1,68 @@
+import torch
+import pytest
+
+from pathlib import Path
+
+from yogo import infer
+from yogo.infer import predict
+
+
+@pytest.fixture
+def two_cores(monkeypatch):
+    # shards are capped at the number of cores, which CI machines may lack
+    monkeypatch.setattr(infer, "_available_cores", lambda: [0, 0])
+
+
+def read_outputs(output_dir: Path):
+    return {p.name: p.read_bytes() for p in sorted(output_dir.iterdir())}
+
+
+def test_procs_match_single_process(tmp_path, two_cores, pth_path, write_images):
+    image_dir = write_images()
+
+    results, outputs = [], []
+    for procs in (1, 2):
+        output_dir = tmp_path / f"procs_{procs}"
+        output_dir.mkdir()
+        results.append(
+            predict(
+                pth_path,
+                path_to_images=image_dir,
+                output_dir=str(output_dir),
+                save_preds=True,
+                batch_size=2,
+                obj_thresh=0.3,
+                device="cpu",
+                return_full_predictions=True,
+                procs=procs,
+            )
+        )
+        outputs.append(read_outputs(output_dir))
+
+    torch.testing.assert_close(results[0], results[1])
+    assert len(outputs[0]) == 5 and any(len(v) > 0 for v in outputs[0].values())
+    assert outputs[0] == outputs[1]
+
+
+def test_procs_draw_boxes(tmp_path, two_cores, pth_path, write_images):
+    image_dir = write_images()
+
+    outputs = []
+    for procs in (1, 2):
+        output_dir = tmp_path / f"procs_{procs}"
+        output_dir.mkdir()
+        predict(
+            pth_path,
+            path_to_images=image_dir,
+            output_dir=str(output_dir),
+            draw_boxes=True,
+            render_workers=1,
+            batch_size=2,
+            obj_thresh=0.3,
+            device="cpu",
+            procs=procs,
+        )
+        outputs.append(read_outputs(output_dir))
+
+    assert sorted(outputs[1]) == [f"img_{i}.png" for i in range(5)]
+    assert outputs[0] == outputs[1]
@@ -0,0 +1,63 @@
+import torch
+
+from yogo.data.utils import collate_batch_robust
+from yogo.data.yogo_dataset import densify_labels, format_labels_tensor
+from yogo.data.data_transforms import (
+    MultiArgSequential,
+    RandomHorizontalFlipWithBBs,
+    RandomVerticalFlipWithBBs,
+)
+
+
+Sx, Sy = 16, 12
+
+
+def random_labels(n: int, num_classes: int = 4) -> torch.Tensor:
+    xy0 = torch.rand(n, 2) * 0.9
+    wh = torch.rand(n, 2) * 0.1
+    classes = torch.randint(0, num_classes, (n, 1)).float()
+    return torch.cat([classes, xy0, xy0 + wh], dim=1)
+
+
+def make_batch():
+    torch.manual_seed(0)
+    batch = [(torch.zeros(1, 8, 8), random_labels(n)) for n in (5, 0, 3, 0)]
+    # unreadable images are dropped by collate_batch_robust
+    batch.insert(3, None)
+    return batch
+
+
+def test_collate_sparse_labels_matches_dense():
+    batch = make_batch()
+
+    imgs, sparse = collate_batch_robust(batch)
+    _, dense = collate_batch_robust(
+        [
+            (img, format_labels_tensor(labels, Sx, Sy))
+            for img, labels in filter(None, batch)
+        ]
+    )
+
+    assert sparse.shape == (8, 6)
+    assert sparse[:, 0].tolist() == [0] * 5 + [2] * 3
+    torch.testing.assert_close(densify_labels(sparse, len(imgs), Sx, Sy), dense)
+    # dense labels pass through unchanged
+    assert densify_labels(dense, len(imgs), Sx, Sy) is dense
+
+
+def test_sparse_flips_match_dense_flips():
+    batch = make_batch()
+
+    for flip in (RandomHorizontalFlipWithBBs(p=1), RandomVerticalFlipWithBBs(p=1)):
+        transforms = MultiArgSequential(flip)
+        imgs, sparse = collate_batch_robust(batch, transforms=transforms)
+        _, dense = collate_batch_robust(
+            [
+                (img, format_labels_tensor(labels, Sx, Sy))
+                for img, labels in filter(None, batch)
+            ],
+            transforms=transforms,
+        )
+        # dense flips mirror the coordinates of empty cells too, which are ignored
+        dense[:, 1:5] *= dense[:, :1]
+        torch.testing.assert_close(densify_labels(sparse, len(imgs), Sx, Sy), dense)
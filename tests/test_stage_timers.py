@@ -0,0 +1,66 @@
+import json
+import pickle
+
+from yogo.utils import StageTimers
+
+
+def test_disabled_timers_record_nothing():
+    timers = StageTimers(enabled=False)
+    with timers.stage("forward"):
+        pass
+    timers.add("load", 1.0)
+    assert timers.to_dict() == {}
+
+
+def test_stage_accumulates_counts_and_items():
+    timers = StageTimers()
+    for _ in range(3):
+        with timers.stage("forward", num_items=4):
+            pass
+    timers.add("load", 0.5)
+
+    report = timers.to_dict()
+    assert report["forward"]["count"] == 3
+    assert report["forward"]["items"] == 12
+    assert report["load"]["total_s"] == 0.5
+    assert "forward" in timers.summary()
+
+
+def test_merge_and_write_json(tmp_path):
+    a, b = StageTimers(), StageTimers()
+    a.add("load", 1.0)
+    b.add("load", 2.0, count=2)
+    a.merge(b)
+
+    a.write_json(tmp_path / "profile.json", num_images=10)
+    with open(tmp_path / "profile.json") as f:
+        report = json.load(f)
+
+    assert report["num_images"] == 10
+    assert report["stages"]["load"]["total_s"] == 3.0
+    assert report["stages"]["load"]["count"] == 3
+
+
+def test_nested_stages_are_not_counted_twice():
+    timers = StageTimers()
+    for _ in range(2):
+        with timers.stage("load"):
+            with timers.stage("decode"):
+                pass
+        with timers.stage("forward"):
+            pass
+    timers.totals.update({"load": 3.0, "decode": 2.0, "forward": 1.0})
+
+    assert timers.to_dict()["decode"]["parent"] == "load"
+    assert timers.to_dict()["load"]["parent"] is None
+
+    lines = timers.summary().splitlines()
+    assert [line.split()[0] for line in lines[1:]] == ["load", "decode", "forward"]
+    # decode is indented under load, and percentages are of load + forward
+    assert lines[2].startswith("  decode")
+    assert [float(line.split()[2]) for line in lines[1:]] == [75.0, 50.0, 25.0]
+
+    # nesting survives a round trip through a shard process
+    merged = StageTimers()
+    merged.merge(pickle.loads(pickle.dumps(timers)))
+    assert merged.summary() == timers.summary()
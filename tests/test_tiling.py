@@ -0,0 +1,59 @@
+import torch
+import pytest
+
+from yogo.utils.tiling import (
+    iter_tiles,
+    merge_tile_predictions,
+    tile_starts,
+    tile_to_image_boxes,
+)
+
+
+def test_tile_starts_cover_with_overlap():
+    assert tile_starts(100, 40, 10) == [0, 30, 60]
+    assert tile_starts(95, 40, 10) == [0, 30, 55]
+    assert tile_starts(40, 40, 10) == [0]
+    assert tile_starts(10, 40, 10) == [0]
+
+    for length in range(40, 200):
+        starts = tile_starts(length, 40, 8)
+        assert starts[-1] + 40 == length
+        assert all(b - a <= 32 for a, b in zip(starts, starts[1:]))
+
+
+def test_tile_starts_rejects_bad_overlap():
+    with pytest.raises(ValueError):
+        tile_starts(100, 40, 40)
+
+
+def test_iter_tiles_pads_small_images():
+    img = torch.ones(1, 30, 100)
+    tiles = list(iter_tiles(img, (40, 40), overlap=10))
+
+    assert [(y0, x0) for _, y0, x0 in tiles] == [(0, 0), (0, 30), (0, 60)]
+    for tile, _, _ in tiles:
+        assert tile.shape == (1, 40, 40)
+        assert tile[:, 30:].sum() == 0
+        assert tile[:, :30].all()
+
+
+def test_tile_to_image_boxes():
+    boxes = torch.tensor([[0.0, 0.0, 0.5, 0.5], [0.5, 0.5, 1.0, 1.0]])
+    offsets = torch.tensor([[0, 0], [30, 60]])
+    image_boxes = tile_to_image_boxes(boxes, offsets, (40, 40), (60, 90))
+    torch.testing.assert_close(
+        image_boxes, torch.tensor([[0.0, 0.0, 20.0, 20.0], [80.0, 50.0, 90.0, 60.0]])
+    )
+
+
+def test_merge_removes_duplicates_from_overlaps():
+    boxes = torch.tensor(
+        [[10.0, 10.0, 20.0, 20.0], [11.0, 10.0, 21.0, 20.0], [50.0, 50.0, 60.0, 60.0]]
+    )
+    preds = torch.zeros(3, 7)
+    preds[:, 4] = torch.tensor([0.9, 0.8, 0.9])
+    preds[:, 5] = 1.0
+
+    keep = merge_tile_predictions(boxes, preds, iou_thresh=0.5)
+    assert sorted(keep.tolist()) == [0, 2]
+    assert len(merge_tile_predictions(boxes, preds, iou_thresh=0)) == 3
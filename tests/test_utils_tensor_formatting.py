@@ -1,7 +1,7 @@
 import torch
 import unittest
 
-from yogo.utils import format_preds
+from yogo.utils import format_preds, format_preds_batched
 
 
 # TODO convert unittest to pytest
@@ -66,3 +66,33 @@ class TestFormatPreds(unittest.TestCase):
         actual[:, 2] = actual[:, 0] + actual[:, 2]
         actual[:, 3] = actual[:, 1] + actual[:, 3]
         torch.testing.assert_close(pred, actual)
+
+
+class TestFormatPredsBatched(unittest.TestCase):
+    def test_matches_format_preds(self):
+        torch.manual_seed(0)
+        batch = torch.rand(3, 9, 12, 16)
+        batch[:, 2:4] *= 0.1
+
+        for box_format in ("cxcywh", "xyxy"):
+            image_idxs, preds = format_preds_batched(
+                batch.clone(),
+                box_format=box_format,
+                min_class_confidence_threshold=0.3,
+            )
+            for i in range(len(batch)):
+                expected = format_preds(
+                    batch[i].clone(),
+                    box_format=box_format,
+                    min_class_confidence_threshold=0.3,
+                )
+                actual = preds[image_idxs == i]
+                # NMS output order can differ between batched and single images
+                torch.testing.assert_close(
+                    actual[actual[:, 0].argsort()],
+                    expected[expected[:, 0].argsort()],
+                )
+
+    def test_requires_batch(self):
+        with self.assertRaises(ValueError):
+            format_preds_batched(torch.zeros(12, 4, 4))
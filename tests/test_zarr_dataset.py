@@ -0,0 +1,175 @@
+import zarr
+import torch
+import shutil
+import pytest
+import numpy as np
+
+from pathlib import Path
+from torchvision.io import write_png
+from torchvision.transforms import Resize
+
+from yogo.data.yogo_dataloader import get_datasets
+from yogo.data.yogo_dataset import labels_to_tensor
+from yogo.data.zarr_dataset import ZarrDetectionDataset
+from yogo.data.dataset_definition_file import DatasetDefinition, ZarrSpecification
+
+
+DATA_PATH = Path(__file__).parent / "fake-data" / "data"
+CLASSES = ["you", "only", "glance", "once"]
+IMAGE_HW = (12, 16)
+NUM_FRAMES = 10
+
+# label files of a single row are read as a header by `load_labels`, so every
+# labelled frame has either no objects or several
+LABELS = {
+    2: [[0, 0.5, 0.5, 0.2, 0.2], [3, 0.2, 0.3, 0.1, 0.2]],
+    7: [[2, 0.7, 0.7, 0.2, 0.2], [1, 0.3, 0.6, 0.1, 0.1]],
+    9: [],
+}
+
+
+def random_frames() -> np.ndarray:
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, size=(*IMAGE_HW, NUM_FRAMES), dtype=np.uint8)
+
+
+def write_array(path: Path, frames_per_chunk: int = 3) -> np.ndarray:
+    frames = random_frames()
+    arr = zarr.open_array(
+        str(path),
+        mode="w",
+        shape=frames.shape,
+        chunks=(*IMAGE_HW, frames_per_chunk),
+        dtype=np.uint8,
+    )
+    arr[:] = frames
+    return frames
+
+
+def write_label_dir(path: Path) -> Path:
+    path.mkdir()
+    for frame_idx, labels in LABELS.items():
+        (path / f"img_{frame_idx:02d}.txt").write_text(
+            "".join(" ".join(map(str, label)) + "\n" for label in labels)
+        )
+    return path
+
+
+def write_label_table(path: Path) -> Path:
+    rows = ["frame_idx,class_idx,xc,yc,w,h"]
+    for frame_idx, labels in LABELS.items():
+        # a frame without objects is just its index
+        rows.extend([",".join(map(str, [frame_idx, *label])) for label in labels])
+        if len(labels) == 0:
+            rows.append(str(frame_idx))
+    path.write_text("\n".join(rows) + "\n")
+    return path
+
+
+def expected_samples(frames: np.ndarray):
+    resize = Resize(IMAGE_HW, antialias=True)
+    return [
+        (
+            resize(torch.from_numpy(np.ascontiguousarray(frames[:, :, i]))[None]),
+            labels_to_tensor(np.array(LABELS[i], dtype=np.float32), 8, 6),
+        )
+        for i in sorted(LABELS)
+    ]
+
+
+@pytest.mark.parametrize("label_kind", ["dir", "table"])
+@pytest.mark.parametrize("chunk_cache_size", [0, 1, 4])
+def test_zarr_array_samples(tmp_path, label_kind, chunk_cache_size):
+    frames = write_array(tmp_path / "run.zarr")
+    label_path = (
+        write_label_dir(tmp_path / "labels")
+        if label_kind == "dir"
+        else write_label_table(tmp_path / "labels.csv")
+    )
+
+    dataset = ZarrDetectionDataset(
+        tmp_path / "run.zarr",
+        label_path,
+        8,
+        6,
+        CLASSES,
+        image_hw=IMAGE_HW,
+        chunk_cache_size=chunk_cache_size,
+    )
+    assert len(dataset) == len(LABELS)
+    assert len(dataset._chunks) <= chunk_cache_size
+
+    # read twice, so that the second pass reads from the chunk cache
+    for _ in range(2):
+        for (image, labels), (expected_image, expected_labels) in zip(
+            (dataset[i] for i in range(len(dataset))), expected_samples(frames)
+        ):
+            torch.testing.assert_close(image, expected_image)
+            torch.testing.assert_close(labels, expected_labels)
+        assert len(dataset._chunks) <= chunk_cache_size
+
+    assert dataset.calc_class_counts().tolist() == [1, 1, 1, 1]
+
+
+def test_zarr_group_samples(tmp_path):
+    frames = random_frames()
+    group = zarr.open_group(str(tmp_path / "run.zarr"), mode="w")
+    for i in range(NUM_FRAMES):
+        group.array(str(i), frames[:, :, i])
+
+    dataset = ZarrDetectionDataset(
+        tmp_path / "run.zarr",
+        write_label_table(tmp_path / "labels.csv"),
+        8,
+        6,
+        CLASSES,
+        image_hw=IMAGE_HW,
+    )
+    for i, (expected_image, expected_labels) in enumerate(expected_samples(frames)):
+        image, labels = dataset[i]
+        torch.testing.assert_close(image, expected_image)
+        torch.testing.assert_close(labels, expected_labels)
+
+
+def test_labels_past_the_last_frame_are_rejected(tmp_path):
+    write_array(tmp_path / "run.zarr")
+    (tmp_path / "labels.csv").write_text(f"{NUM_FRAMES},0,0.5,0.5,0.2,0.2\n")
+
+    with pytest.raises(ValueError):
+        ZarrDetectionDataset(
+            tmp_path / "run.zarr", tmp_path / "labels.csv", 8, 6, CLASSES
+        )
+
+
+def test_zarr_specs_mix_with_literal_specs(tmp_path):
+    write_array(tmp_path / "run.zarr")
+    write_label_dir(tmp_path / "labels")
+    shutil.copytree(DATA_PATH, tmp_path / "data")
+    # the fake images are empty files, which can't be decoded
+    for image_path in (tmp_path / "data" / "images1").glob("*.png"):
+        write_png(torch.zeros(1, 24, 32, dtype=torch.uint8), str(image_path))
+    defn_path = tmp_path / "defn.yml"
+    defn_path.write_text(
+        "class_names: [you, only, glance, once]\n"
+        "dataset_split_fractions: {train: 1, val: 0, test: 0}\n"
+        "dataset_paths:\n"
+        "  run:\n"
+        "    zarr_path: run.zarr\n"
+        "    label_path: labels\n"
+        "  set1:\n"
+        f"    image_path: {tmp_path / 'data' / 'images1'}\n"
+        f"    label_path: {tmp_path / 'data' / 'labels1'}\n"
+    )
+
+    defn = DatasetDefinition.from_yaml(defn_path)
+    (zarr_spec,) = [s for s in defn.dataset_paths if isinstance(s, ZarrSpecification)]
+    assert zarr_spec.zarr_path == tmp_path / "run.zarr"
+    assert zarr_spec.label_path == tmp_path / "labels"
+
+    datasets = get_datasets(defn, 8, 6, image_hw=IMAGE_HW)
+    train = datasets["train"]
+    assert len(train) == len(LABELS) + 3  # type: ignore
+    for i in range(len(train)):  # type: ignore
+        image, labels = train[i]
+        assert image.shape == (1, *IMAGE_HW)
+        assert labels.shape == (6, 6, 8)
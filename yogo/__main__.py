@@ -35,6 +35,18 @@ def main():
         from yogo.infer import do_infer
 
         do_infer(args)
+    elif args.task == "infer-many":
+        from yogo.infer_many import do_infer_many
+
+        do_infer_many(args)
+    elif args.task == "eval-scales":
+        from yogo.utils.eval_scales import do_eval_scales
+
+        do_eval_scales(args)
+    elif args.task == "pack":
+        from yogo.utils.pack import do_pack
+
+        do_pack(args)
     else:
         p.print_help()
 
@@ -33,6 +33,7 @@ class BlobDataset(Dataset):
         length: int = 1000,
         background_img_shape: Tuple[int, int] = (772, 1032),
         normalize_images: bool = False,
+        sparse_labels: bool = False,
     ):
         """
         thumbnail_dir_paths: a mapping from class (whether by class name or by class idx)
@@ -43,6 +44,7 @@ class BlobDataset(Dataset):
         length: "length" of dataset
         background_img_shape: shape of background image
         normalize_images: whether to normalize images into [0,1]
+        sparse_labels: return (N, 5) label tensors instead of dense grids
         """
         super().__init__()
 
@@ -63,6 +65,7 @@ class BlobDataset(Dataset):
         self.loader = read_image_robust
         self.background_img_shape = background_img_shape
         self.normalize_images = normalize_images
+        self.sparse_labels = sparse_labels
         self.area_threshold: int = 500
 
         self.classes, thumbnail_paths = self.get_thumbnail_paths(
@@ -255,7 +258,10 @@ class BlobDataset(Dataset):
         coords = torch.cat(coords)
         classes = torch.tensor(classes).view(-1, 1)
         coords = torch.cat([classes, coords], dim=1)
-        label_tensor = format_labels_tensor(coords, self.Sx, self.Sy)
+        if self.sparse_labels:
+            label_tensor = coords
+        else:
+            label_tensor = format_labels_tensor(coords, self.Sx, self.Sy)
 
         if self.normalize_images:
             img = img / 255
@@ -1,7 +1,7 @@
 import torch
 import torchvision.transforms.functional as F
 
-from typing import Tuple
+from typing import Sequence, Tuple
 
 
 """ Major TODO
@@ -48,6 +48,39 @@ class ImageTransformLabelIdentity(DualInputModule):
         return self.transform(img_batch), labels
 
 
+def hflip_grid(grid: torch.Tensor, x_channels: Sequence[int]) -> torch.Tensor:
+    """
+    horizontally flip a (batch size, C, Sy, Sx) grid of labels or predictions,
+    mirroring the normalized x coordinates in x_channels. The coordinates are
+    also reversed in order, so that the x0 and x1 of xyxy boxes are swapped,
+    e.g. x_channels=(1, 3) for labels, or (0,) for YOGO's cxcywh predictions.
+    """
+    flipped = torch.flip(grid, dims=(3,))
+    flipped[:, list(x_channels)] = 1 - flipped[:, list(reversed(x_channels))]
+    return flipped
+
+
+def vflip_grid(grid: torch.Tensor, y_channels: Sequence[int]) -> torch.Tensor:
+    """like `hflip_grid`, but vertically, for the y coordinates in y_channels"""
+    flipped = torch.flip(grid, dims=(2,))
+    flipped[:, list(y_channels)] = 1 - flipped[:, list(reversed(y_channels))]
+    return flipped
+
+
+def flip_sparse_labels(
+    labels: torch.Tensor, coord_columns: Sequence[int]
+) -> torch.Tensor:
+    """
+    flip a batch of sparse labels, as packed by `collate_batch_robust` -
+    (image_idx, class_idx, x, y, x, y) rows - mirroring the normalized
+    coordinates in coord_columns, e.g. (2, 4) for a horizontal flip. As in
+    `hflip_grid`, the coordinates are reversed in order so boxes stay xyxy.
+    """
+    flipped = labels.clone()
+    flipped[:, list(coord_columns)] = 1 - labels[:, list(reversed(coord_columns))]
+    return flipped
+
+
 class RandomHorizontalFlipWithBBs(DualInputModule):
     """Random HFLIP that will flip the labels if the image is flipped!"""
 
@@ -59,17 +92,16 @@ class RandomHorizontalFlipWithBBs(DualInputModule):
         self, img_batch: torch.Tensor, label_batch: torch.Tensor
     ) -> Tuple[torch.Tensor, torch.Tensor]:
         """
-        labels have shape (batch size, len([obj mask *[x y x y] class]), Sy, Sx) == (batch size, 6, Sy, Sx)
+        labels have shape (batch size, len([obj mask *[x y x y] class]), Sy, Sx) == (batch size, 6, Sy, Sx),
+        or are sparse, with shape (N, len([image idx, class, *[x y x y]])) == (N, 6)
 
         Need to flip labels around the tensor axes too!
         """
-        assert img_batch.ndim == 4 and label_batch.ndim == 4
+        assert img_batch.ndim == 4 and label_batch.ndim in (2, 4)
         if torch.rand(1) < self.p:
-            label_batch[:, 1, :, :], label_batch[:, 3, :, :] = (
-                1 - label_batch[:, 3, :, :],
-                1 - label_batch[:, 1, :, :],
-            )
-            return F.hflip(img_batch), torch.flip(label_batch, dims=(3,))
+            if label_batch.ndim == 2:
+                return F.hflip(img_batch), flip_sparse_labels(label_batch, (2, 4))
+            return F.hflip(img_batch), hflip_grid(label_batch, x_channels=(1, 3))
         return img_batch, label_batch
 
 
@@ -84,15 +116,14 @@ class RandomVerticalFlipWithBBs(DualInputModule):
         self, img_batch: torch.Tensor, label_batch: torch.Tensor
     ) -> Tuple[torch.Tensor, torch.Tensor]:
         """
-        labels have shape (batch size, len([obj mask *[x y x y] class]), Sy, Sx) == (batch size, 6, Sy, Sx)
+        labels have shape (batch size, len([obj mask *[x y x y] class]), Sy, Sx) == (batch size, 6, Sy, Sx),
+        or are sparse, with shape (N, len([image idx, class, *[x y x y]])) == (N, 6)
 
         Need to flip labels around the tensor axes too!
         """
-        assert img_batch.ndim == 4 and label_batch.ndim == 4
+        assert img_batch.ndim == 4 and label_batch.ndim in (2, 4)
         if torch.rand(1) < self.p:
-            label_batch[:, 2, :, :], label_batch[:, 4, :, :] = (
-                1 - label_batch[:, 4, :, :],
-                1 - label_batch[:, 2, :, :],
-            )
-            return F.vflip(img_batch), torch.flip(label_batch, dims=(2,))
+            if label_batch.ndim == 2:
+                return F.vflip(img_batch), flip_sparse_labels(label_batch, (3, 5))
+            return F.vflip(img_batch), vflip_grid(label_batch, y_channels=(2, 4))
         return img_batch, label_batch
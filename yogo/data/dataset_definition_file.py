@@ -1,3 +1,6 @@
+import os
+import json
+import hashlib
 import warnings
 
 from enum import Enum
@@ -97,6 +100,23 @@ we're defining a Tree ( https://en.wikipedia.org/wiki/Tree_(graph_theory) ).
 class InvalidDatasetDefinitionFile(Exception): ...
 
 
+DEFINITION_CACHE_VERSION = 2
+
+
+def default_definition_cache_dir() -> Path:
+    "where `DatasetDefinition.from_yaml` caches resolved definitions"
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "yogo" / "dataset_definitions"
+
+
+def _file_digest(path: Path) -> Optional[str]:
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
 @dataclass
 class LiteralSpecification:
     """
@@ -154,6 +174,96 @@ class LiteralSpecification:
         return hash((self.image_path, self.label_path))
 
 
+@dataclass(frozen=True)
+class PackedSpecification:
+    """
+    A shard of images and labels written by `yogo pack` (see `packed_dataset.py`).
+    In the yaml, it's a `packed_path` key, and it can be used anywhere that a
+    Literal Specification can. Relative paths are relative to the parent directory
+    of the definition file, as with Recursive Specifications.
+    """
+
+    packed_path: Path
+
+    @classmethod
+    def from_dict(cls, dct: Dict[str, str]) -> "PackedSpecification":
+        if len(dct) != 1 or "packed_path" not in dct:
+            raise InvalidDatasetDefinitionFile(
+                f"PackedSpecification must have one key, 'packed_path'; found {list(dct)}"
+            )
+        return PackedSpecification(Path(dct["packed_path"]))
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"packed_path": str(self.packed_path)}
+
+
+@dataclass(frozen=True)
+class TarSpecification:
+    """
+    A tar shard of images and labels written by `yogo pack --format tar` (see
+    `tar_dataset.py`), which is read as a stream instead of by random access. In
+    the yaml, it's a `tar_path` key. Tar shards can't be mixed with other kinds of
+    specifications, and dataset splits are made per shard, not per image. As with
+    Packed Specifications, relative paths are relative to the definition file.
+    """
+
+    tar_path: Path
+
+    @classmethod
+    def from_dict(cls, dct: Dict[str, str]) -> "TarSpecification":
+        if len(dct) != 1 or "tar_path" not in dct:
+            raise InvalidDatasetDefinitionFile(
+                f"TarSpecification must have one key, 'tar_path'; found {list(dct)}"
+            )
+        return TarSpecification(Path(dct["tar_path"]))
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"tar_path": str(self.tar_path)}
+
+
+@dataclass(frozen=True)
+class ZarrSpecification:
+    """
+    The labelled frames of a zarr store of an experiment run (see `zarr_dataset.py`),
+    so they can be trained on without exporting them to images first. In the yaml,
+    it's a `zarr_path` key and a `label_path` key, where `label_path` is either a
+    folder of label files named by frame index, or a csv table of labels keyed by
+    frame index. It can be used anywhere that a Literal Specification can. As with
+    Packed Specifications, relative paths are relative to the definition file.
+    """
+
+    zarr_path: Path
+    label_path: Path
+
+    @classmethod
+    def from_dict(cls, dct: Dict[str, str]) -> "ZarrSpecification":
+        if set(dct) != {"zarr_path", "label_path"}:
+            raise InvalidDatasetDefinitionFile(
+                "ZarrSpecification must have keys 'zarr_path' and 'label_path'; "
+                f"found {list(dct)}"
+            )
+        return ZarrSpecification(Path(dct["zarr_path"]), Path(dct["label_path"]))
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"zarr_path": str(self.zarr_path), "label_path": str(self.label_path)}
+
+
+DatasetSpecification = Union[
+    LiteralSpecification, PackedSpecification, TarSpecification, ZarrSpecification
+]
+
+
+def specification_from_dict(dct: Dict[str, str]) -> DatasetSpecification:
+    "the inverse of the `to_dict` of each kind of (non-recursive) specification"
+    if "packed_path" in dct:
+        return PackedSpecification.from_dict(dct)
+    elif "tar_path" in dct:
+        return TarSpecification.from_dict(dct)
+    elif "zarr_path" in dct:
+        return ZarrSpecification.from_dict(dct)
+    return LiteralSpecification.from_dict(dct)
+
+
 class SpecificationsKey(Enum):
     DATASET_PATHS = "dataset_paths"
     TEST_DATASET_PATHS = "test_paths"
@@ -175,32 +285,164 @@ class DatasetDefinition:
         - thumbnail_augmentation: a dict of {class_name: Path}
     """
 
-    _dataset_paths: Set[LiteralSpecification]
-    _test_dataset_paths: Set[LiteralSpecification]
+    _dataset_paths: Set[DatasetSpecification]
+    _test_dataset_paths: Set[DatasetSpecification]
 
     classes: List[str]
     thumbnail_augmentation: Optional[Dict[str, Union[Path, List[Path]]]]
     split_fractions: SplitFractions
 
     @property
-    def dataset_paths(self) -> List[LiteralSpecification]:
+    def dataset_paths(self) -> List[DatasetSpecification]:
         return list(self._dataset_paths)
 
     @property
-    def test_dataset_paths(self) -> List[LiteralSpecification]:
+    def test_dataset_paths(self) -> List[DatasetSpecification]:
         return list(self._test_dataset_paths)
 
     @property
-    def all_dataset_paths(self) -> List[LiteralSpecification]:
+    def all_dataset_paths(self) -> List[DatasetSpecification]:
         return list(self._dataset_paths | self._test_dataset_paths)
 
     @classmethod
-    def from_yaml(cls, path: Path) -> "DatasetDefinition":
+    def from_yaml(cls, path: Path, use_cache: bool = True) -> "DatasetDefinition":
         """
         Load ddf file from the yaml file definition.
+
+        Resolving a large tree of definition files can take a while, so resolved
+        definitions are cached in `default_definition_cache_dir()`. A cached
+        definition is used as long as every yaml file of its tree is unchanged.
+        Paths are still checked every time, but label folders are only listed
+        again if their mtime changed. use_cache=False resolves from scratch.
         """
         path = Path(path)  # defensive, in-case we're handed a string
 
+        if not use_cache:
+            definition, _ = cls._resolve_yaml(path)
+            definition._check_all_dataset_paths()
+            return definition
+
+        cache_path = (
+            default_definition_cache_dir()
+            / f"{hashlib.sha1(str(path.absolute()).encode()).hexdigest()[:16]}.json"
+        )
+        cache = cls._load_cache(cache_path)
+
+        cache_is_fresh = cache is not None and all(
+            _file_digest(Path(p)) == digest
+            for p, digest in cache["yml_digests"].items()
+        )
+
+        if cache is not None and cache_is_fresh:
+            definition = cls._from_dict(cache["definition"])
+            yml_digests = cache["yml_digests"]
+        else:
+            definition, yml_paths = cls._resolve_yaml(path)
+            yml_digests = {
+                str(p.absolute()): _file_digest(p) for p in sorted(yml_paths)
+            }
+
+        # label folders that haven't changed aren't listed again, even if the
+        # definition files have
+        label_dir_counts = cache["label_dir_counts"] if cache is not None else {}
+        definition._check_all_dataset_paths(label_dir_counts)
+        label_dirs = {
+            str(spec.label_path.absolute())
+            for spec in definition.all_dataset_paths
+            if isinstance(spec, LiteralSpecification)
+        }
+        label_dir_counts = {
+            k: v for k, v in label_dir_counts.items() if k in label_dirs
+        }
+
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(
+                    {
+                        "version": DEFINITION_CACHE_VERSION,
+                        "yml_digests": yml_digests,
+                        "definition": definition._to_dict(),
+                        "label_dir_counts": label_dir_counts,
+                    },
+                    f,
+                )
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            warnings.warn(f"couldn't cache the dataset definition to {cache_path}: {e}")
+
+        return definition
+
+    @staticmethod
+    def _load_cache(cache_path: Path) -> Optional[Dict[str, Any]]:
+        try:
+            with open(cache_path, "r") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if not (
+            isinstance(cache, dict)
+            and cache.get("version") == DEFINITION_CACHE_VERSION
+            and {"yml_digests", "definition", "label_dir_counts"} <= set(cache)
+        ):
+            return None
+        return cache
+
+    def _to_dict(self) -> Dict[str, Any]:
+        return {
+            "dataset_paths": [spec.to_dict() for spec in self._dataset_paths],
+            "test_paths": [spec.to_dict() for spec in self._test_dataset_paths],
+            "classes": self.classes,
+            "thumbnail_augmentation": (
+                {
+                    k: [str(p) for p in v] if isinstance(v, list) else [str(v)]
+                    for k, v in self.thumbnail_augmentation.items()
+                }
+                if self.thumbnail_augmentation is not None
+                else None
+            ),
+            "split_fractions": [
+                self.split_fractions.train,
+                self.split_fractions.val,
+                self.split_fractions.test,
+            ],
+        }
+
+    @classmethod
+    def _from_dict(cls, dct: Dict[str, Any]) -> "DatasetDefinition":
+        thumbnail_augmentation = dct["thumbnail_augmentation"]
+        return cls(
+            _dataset_paths={specification_from_dict(d) for d in dct["dataset_paths"]},
+            _test_dataset_paths={specification_from_dict(d) for d in dct["test_paths"]},
+            classes=dct["classes"],
+            thumbnail_augmentation=(
+                {k: [Path(p) for p in v] for k, v in thumbnail_augmentation.items()}
+                if thumbnail_augmentation is not None
+                else None
+            ),
+            split_fractions=SplitFractions(*dct["split_fractions"]),
+        )
+
+    def _check_all_dataset_paths(
+        self, label_dir_counts: Optional[Dict[str, List[int]]] = None
+    ) -> None:
+        self._dataset_paths = DatasetDefinition._check_dataset_paths(
+            self._dataset_paths, label_dir_counts=label_dir_counts
+        )
+        self._test_dataset_paths = DatasetDefinition._check_dataset_paths(
+            self._test_dataset_paths, label_dir_counts=label_dir_counts
+        )
+
+    @classmethod
+    def _resolve_yaml(cls, path: Path) -> Tuple["DatasetDefinition", Set[Path]]:
+        """
+        parse the tree of definition files rooted at path, without checking the
+        dataset paths. Returns the definition and the paths of the files of the tree.
+        """
+        yml_paths: Set[Path] = {path}
+
         with open(path, "r") as f:
             yaml = YAML(typ="safe")
             data = yaml.load(f)
@@ -216,7 +458,10 @@ class DatasetDefinition:
 
         if test_paths_present:
             dataset_specs = cls._load_dataset_specifications(
-                path, classes, dataset_paths_key=SpecificationsKey.DATASET_PATHS
+                path,
+                classes,
+                dataset_paths_key=SpecificationsKey.DATASET_PATHS,
+                yml_paths=yml_paths,
             )
             test_specs = cls._load_dataset_specifications(
                 path,
@@ -224,15 +469,17 @@ class DatasetDefinition:
                 exclude_ymls=[path],
                 exclude_specs=dataset_specs,
                 dataset_paths_key=SpecificationsKey.TEST_DATASET_PATHS,
+                yml_paths=yml_paths,
             )
         else:
             dataset_specs = cls._load_dataset_specifications(
-                path, classes, dataset_paths_key=SpecificationsKey.ALL_DATASET_PATHS
+                path,
+                classes,
+                dataset_paths_key=SpecificationsKey.ALL_DATASET_PATHS,
+                yml_paths=yml_paths,
             )
             test_specs = set()
 
-        dataset_specs = DatasetDefinition._check_dataset_paths(dataset_specs)
-        test_specs = DatasetDefinition._check_dataset_paths(test_specs)
         if "dataset_split_fractions" in data:
             split_fractions = SplitFractions.from_dict(
                 data["dataset_split_fractions"], test_paths_present=test_paths_present
@@ -240,13 +487,14 @@ class DatasetDefinition:
         else:
             split_fractions = SplitFractions.train_only()
 
-        return cls(
+        definition = cls(
             _dataset_paths=dataset_specs,
             _test_dataset_paths=test_specs,
             classes=classes,
             thumbnail_augmentation=DatasetDefinition._load_thumbnails(classes, data),
             split_fractions=split_fractions,
         )
+        return definition, yml_paths
 
     def __add__(self, other: "DatasetDefinition") -> "DatasetDefinition":
         """
@@ -325,9 +573,10 @@ class DatasetDefinition:
         yml_path: Path,
         classes: List[str],
         exclude_ymls: List[Path] = [],
-        exclude_specs: Set[LiteralSpecification] = set(),
+        exclude_specs: Set[DatasetSpecification] = set(),
         dataset_paths_key: SpecificationsKey = SpecificationsKey.DATASET_PATHS,
-    ) -> Set[LiteralSpecification]:
+        yml_paths: Optional[Set[Path]] = None,
+    ) -> Set[DatasetSpecification]:
         """
         load the list of dataset specifications into a list
         of LiteralSpecification. Essentially, we try to to_dict
@@ -342,8 +591,12 @@ class DatasetDefinition:
         should be excluded for one reason or another. for example,
         if a literal specifcation is in the training set, you want
         to make sure you exclude it in the testing set.
+
+        The path of every definition file that is read is added to `yml_paths`.
         """
-        literal_defns: Set[LiteralSpecification] = set()
+        literal_defns: Set[DatasetSpecification] = set()
+        if yml_paths is not None:
+            yml_paths.add(yml_path)
 
         spec_classes, specs = DatasetDefinition._extract_specs(
             yml_path, dataset_paths_key
@@ -373,6 +626,7 @@ class DatasetDefinition:
                     classes,
                     exclude_ymls=[new_yml_path, *exclude_ymls],
                     dataset_paths_key=dataset_paths_key,
+                    yml_paths=yml_paths,
                 )
 
                 if "classes" in spec:
@@ -397,6 +651,45 @@ class DatasetDefinition:
 
                 literal_defns.add(LiteralSpecification.from_dict(spec))
 
+            elif "packed_path" in spec:
+                packed_spec = PackedSpecification.from_dict(spec)
+                if not packed_spec.packed_path.is_absolute():
+                    packed_spec = PackedSpecification(
+                        yml_path.parent / packed_spec.packed_path
+                    )
+
+                DatasetDefinition._check_for_non_disjoint_sets(
+                    literal_defns, {packed_spec}
+                )
+
+                literal_defns.add(packed_spec)
+
+            elif "tar_path" in spec:
+                tar_spec = TarSpecification.from_dict(spec)
+                if not tar_spec.tar_path.is_absolute():
+                    tar_spec = TarSpecification(yml_path.parent / tar_spec.tar_path)
+
+                DatasetDefinition._check_for_non_disjoint_sets(
+                    literal_defns, {tar_spec}
+                )
+
+                literal_defns.add(tar_spec)
+
+            elif "zarr_path" in spec:
+                zarr_spec = ZarrSpecification.from_dict(spec)
+                zarr_spec = ZarrSpecification(
+                    *(
+                        p if p.is_absolute() else yml_path.parent / p
+                        for p in (zarr_spec.zarr_path, zarr_spec.label_path)
+                    )
+                )
+
+                DatasetDefinition._check_for_non_disjoint_sets(
+                    literal_defns, {zarr_spec}
+                )
+
+                literal_defns.add(zarr_spec)
+
             else:
                 # even easier case
                 raise InvalidDatasetDefinitionFile(
@@ -449,16 +742,80 @@ class DatasetDefinition:
 
         return None
 
+    @staticmethod
+    def _count_label_dir_entries(
+        label_path: Path, label_dir_counts: Optional[Dict[str, List[int]]] = None
+    ) -> int:
+        """
+        the number of entries of the label folder, not counting hidden ones like
+        the label index (see `yogo_dataset.LabelIndex`), which isn't a label. If
+        label_dir_counts is given, it maps absolute label folder paths to their
+        [mtime, number of entries] the last time they were listed, and folders
+        are only listed again if their mtime changed.
+        """
+        if label_dir_counts is None:
+            with os.scandir(label_path) as entries:
+                return sum(1 for entry in entries if not entry.name.startswith("."))
+
+        key = str(label_path.absolute())
+        mtime = label_path.stat().st_mtime_ns
+        if key in label_dir_counts and label_dir_counts[key][0] == mtime:
+            return label_dir_counts[key][1]
+
+        count = DatasetDefinition._count_label_dir_entries(label_path)
+        label_dir_counts[key] = [mtime, count]
+        return count
+
     @staticmethod
     def _check_dataset_paths(
-        dataset_paths: Set[LiteralSpecification], prune: bool = False
-    ) -> Set[LiteralSpecification]:
-        to_prune: Set[LiteralSpecification] = set()
+        dataset_paths: Set[DatasetSpecification],
+        prune: bool = False,
+        label_dir_counts: Optional[Dict[str, List[int]]] = None,
+    ) -> Set[DatasetSpecification]:
+        to_prune: Set[DatasetSpecification] = set()
         for spec in dataset_paths:
-            if not (
+            if isinstance(spec, PackedSpecification):
+                if not spec.packed_path.is_dir():
+                    if prune:
+                        warnings.warn(
+                            f"packed_path={spec.packed_path} is not a directory; will prune."
+                        )
+                        to_prune.add(spec)
+                    else:
+                        raise FileNotFoundError(
+                            f"packed_path={spec.packed_path} is not a directory"
+                        )
+            elif isinstance(spec, TarSpecification):
+                if not spec.tar_path.is_file():
+                    if prune:
+                        warnings.warn(
+                            f"tar_path={spec.tar_path} is not a file; will prune."
+                        )
+                        to_prune.add(spec)
+                    else:
+                        raise FileNotFoundError(
+                            f"tar_path={spec.tar_path} is not a file"
+                        )
+            elif isinstance(spec, ZarrSpecification):
+                if not (spec.zarr_path.exists() and spec.label_path.exists()):
+                    if prune:
+                        warnings.warn(
+                            f"zarr_path={spec.zarr_path} or label_path={spec.label_path} "
+                            "does not exist; will prune."
+                        )
+                        to_prune.add(spec)
+                    else:
+                        raise FileNotFoundError(
+                            f"zarr_path={spec.zarr_path} or label_path={spec.label_path} "
+                            "does not exist"
+                        )
+            elif not (
                 spec.image_path.is_dir()
                 and spec.label_path.is_dir()
-                and len(list(spec.label_path.iterdir())) > 0
+                and DatasetDefinition._count_label_dir_entries(
+                    spec.label_path, label_dir_counts
+                )
+                > 0
             ):
                 if prune:
                     warnings.warn(
@@ -0,0 +1,265 @@
+import os
+import json
+import torch
+import hashlib
+import tempfile
+import warnings
+import numpy as np
+import numpy.typing as npt
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:
+    # no flock (e.g. windows), so we can't tell which caches are in use
+    fcntl = None  # type: ignore
+
+
+IMAGE_CACHE_VERSION = 1
+_PAGE_SIZE = 4096
+
+
+def default_image_cache_dir() -> Path:
+    "shared memory if we have it, so cached images never touch the disk"
+    shm = Path("/dev/shm")
+    return shm if shm.is_dir() else Path(tempfile.gettempdir())
+
+
+def evict_image_caches(cache_dir: Union[str, Path], max_bytes: int) -> None:
+    """
+    delete image cache files in cache_dir that no process has open, least
+    recently used first, until all of the cache files take at most max_bytes
+    """
+    if fcntl is None:
+        return
+
+    cache_files: List[Tuple[float, int, Path]] = []
+    for path in Path(cache_dir).glob("yogo_image_cache_*.bin"):
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            continue
+        cache_files.append((max(st.st_atime, st.st_mtime), st.st_size, path))
+
+    total_bytes = sum(size for _, size, _ in cache_files)
+    for _, size, path in sorted(cache_files):
+        if total_bytes <= max_bytes:
+            break
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            total_bytes -= size
+            continue
+        try:
+            # open caches hold a shared lock (see `ImageCache._lock`)
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            continue
+        else:
+            path.unlink(missing_ok=True)
+            total_bytes -= size
+        finally:
+            os.close(fd)
+
+
+class ImageCache:
+    """
+    Decoded and resized images of a dataset, in one memory-mapped file, so that
+    each image is decoded once instead of once per epoch. The file holds
+
+        filled  uint8 (capacity,): 1 if the image at that index is cached
+        images  uint8 (capacity, C, H, W): the images, from a page-aligned offset
+
+    The cache is filled lazily, by whichever process first loads an image.
+    Since the file's name is derived from the dataset (see `open_or_create`),
+    every dataloader worker and DDP rank on a node maps the same file, and so
+    shares one copy of the images through the page cache.
+
+    Only the first `capacity` images of a dataset are cached, where capacity
+    is set by a byte budget; the rest are decoded every time. Epochs visit
+    every image once, so evicting images to make room for others would only
+    trade one cache miss for another.
+
+    Cache files are not deleted after training, so that later runs on the same
+    data start with a full cache. Instead, before a run creates a cache, the
+    cache files in the directory that no process has open are deleted (least
+    recently used first) until all of them fit in the run's budget. Caches are
+    keyed by image paths, not contents, so delete them if images are changed in
+    place.
+    """
+
+    def __init__(self, path: Path, capacity: int, image_shape: Tuple[int, int, int]):
+        self.path = path
+        self.capacity = capacity
+        self.image_shape = tuple(image_shape)
+        self._filled: Optional[npt.NDArray] = None
+        self._images: Optional[npt.NDArray] = None
+        self._lock_fd: Optional[int] = None
+
+    @staticmethod
+    def _images_offset(capacity: int) -> int:
+        return -(-capacity // _PAGE_SIZE) * _PAGE_SIZE
+
+    @property
+    def nbytes(self) -> int:
+        image_nbytes = int(np.prod(self.image_shape))
+        return self._images_offset(self.capacity) + self.capacity * image_nbytes
+
+    def _open(self) -> None:
+        self._filled = np.memmap(
+            self.path, dtype=np.uint8, mode="r+", shape=(self.capacity,)
+        )
+        self._images = np.memmap(
+            self.path,
+            dtype=np.uint8,
+            mode="r+",
+            offset=self._images_offset(self.capacity),
+            shape=(self.capacity, *self.image_shape),
+        )
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # reopen the memory maps in each dataloader worker
+        state = self.__dict__.copy()
+        state["_filled"], state["_images"] = None, None
+        # the process that opened the cache holds the lock for its workers
+        state["_lock_fd"] = None
+        return state
+
+    def _lock(self, fd: Optional[int] = None) -> bool:
+        """
+        hold a shared lock on the cache file (through fd, if given) until
+        `close`, which marks it as in use so that other runs don't evict it.
+        Returns False if the file doesn't exist, e.g. if it was just evicted.
+        """
+        if fd is None:
+            try:
+                fd = os.open(self.path, os.O_RDONLY)
+            except FileNotFoundError:
+                return False
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+        if os.fstat(fd).st_nlink == 0:
+            # evicted between opening and locking
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    def close(self) -> None:
+        "release the cache file, which may then be evicted by other runs"
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def __len__(self) -> int:
+        return self.capacity
+
+    def get(self, index: int) -> Optional[torch.Tensor]:
+        "the cached image at index, or None if it isn't cached (yet)"
+        if index >= self.capacity:
+            return None
+        if self._filled is None:
+            self._open()
+        assert self._filled is not None and self._images is not None
+        if not self._filled[index]:
+            return None
+        return torch.from_numpy(np.array(self._images[index]))
+
+    def put(self, index: int, image: torch.Tensor) -> None:
+        if index >= self.capacity:
+            return
+        if self._filled is None:
+            self._open()
+        assert self._filled is not None and self._images is not None
+        # write the image before marking it as filled, for concurrent readers
+        self._images[index] = image.numpy()
+        self._filled[index] = 1
+
+    @classmethod
+    def open_or_create(
+        cls,
+        cache_dir: Union[str, Path],
+        key: Dict[str, Any],
+        num_images: int,
+        image_shape: Tuple[int, int, int],
+        max_bytes: int,
+        total_max_bytes: Optional[int] = None,
+    ) -> Optional["ImageCache"]:
+        """
+        Opens the cache of the dataset identified by key (e.g. its image paths and
+        the image shape), creating it if it doesn't exist. The cache's space is
+        allocated up front, so running out of shared memory is an error here,
+        instead of a crash when an image is written. Returns None if max_bytes is
+        too small for any images, or if the cache can't be created.
+
+        Before creating a cache, unused cache files in cache_dir are evicted so
+        that all of them (including the new one) take at most total_max_bytes
+        (by default, max_bytes). The cache stays in use until `close`.
+        """
+        # a byte of `filled` per image, plus at most a page of padding
+        image_nbytes = int(np.prod(image_shape))
+        capacity = min(num_images, (max_bytes - _PAGE_SIZE) // (image_nbytes + 1))
+        if capacity <= 0:
+            return None
+
+        digest = hashlib.sha1(
+            json.dumps(
+                {
+                    "version": IMAGE_CACHE_VERSION,
+                    "capacity": capacity,
+                    "image_shape": list(image_shape),
+                    **key,
+                },
+                sort_keys=True,
+            ).encode()
+        ).hexdigest()
+        cache = cls(
+            Path(cache_dir) / f"yogo_image_cache_{digest[:16]}.bin",
+            capacity,
+            image_shape,
+        )
+        if cache._lock():
+            return cache
+
+        evict_image_caches(
+            cache_dir,
+            (max_bytes if total_max_bytes is None else total_max_bytes) - cache.nbytes,
+        )
+
+        # create the file under a temporary name and link it into place, so
+        # no process can map it before its space is allocated. The lock is
+        # taken before linking, so the new file is never evictable.
+        tmp_path = cache.path.with_name(f"{cache.path.name}.{os.getpid()}.tmp")
+        fd: Optional[int] = None
+        try:
+            fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_SH)
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(fd, 0, cache.nbytes)
+            else:
+                os.truncate(fd, cache.nbytes)
+            try:
+                os.link(tmp_path, cache.path)
+            except FileExistsError:
+                # another process beat us to it
+                os.close(fd)
+                fd = None
+        except OSError as e:
+            if fd is not None:
+                os.close(fd)
+            warnings.warn(
+                f"could not create an image cache of {cache.nbytes / 1e9:.2f} GB "
+                f"in {cache_dir}; images will not be cached: {e}"
+            )
+            return None
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+        if fd is not None:
+            cache._lock(fd)
+        elif not cache._lock():
+            return None
+        return cache
@@ -4,8 +4,6 @@ import zarr
 import math
 import torch
 
-import numpy as np
-
 from torch import nn
 from pathlib import Path
 from collections.abc import Sized
@@ -15,6 +13,8 @@ from torch.utils.data import Dataset
 from torchvision.transforms import Compose
 
 from yogo.data.utils import read_image
+from yogo.data.path_table import PathTable
+from yogo.utils import StageTimers
 
 
 class ImageAndIdDataset(Dataset, Sized):
@@ -39,6 +39,7 @@ class ImagePathDataset(ImageAndIdDataset):
             torch.Tensor,
         ] = read_image,
         normalize_images: bool = False,
+        stage_timers: Optional[StageTimers] = None,
     ):
         self.root = Path(root)
         if not self.root.exists():
@@ -49,8 +50,11 @@ class ImagePathDataset(ImageAndIdDataset):
         self.transform = Compose(image_transforms)
         self.loader = loader
         self.normalize_images = normalize_images
+        # only records timings when __getitem__ is called in this process
+        # (i.e. with 0 dataloader workers)
+        self.stage_timers = stage_timers or StageTimers(enabled=False)
 
-    def make_dataset(self, path_to_data: Path) -> np.ndarray:
+    def make_dataset(self, path_to_data: Path) -> PathTable:
         if path_to_data.is_file() and path_to_data.suffix == ".png":
             img_paths = [path_to_data]
         else:
@@ -59,17 +63,19 @@ class ImagePathDataset(ImageAndIdDataset):
             )
         if len(img_paths) == 0:
             raise FileNotFoundError(f"{str(path_to_data)} does not contain any images")
-        return np.array(img_paths).astype(np.unicode_)
+        return PathTable.from_paths(img_paths)
 
     def __len__(self) -> int:
         return len(self.image_paths)
 
     def __getitem__(self, idx: int) -> Tuple[torch.Tensor, str]:
         image_path = self.image_paths[idx]
-        image = self.loader(image_path)
-        image = self.transform(image)
-        if self.normalize_images:
-            image = image / 255
+        with self.stage_timers.stage("decode", num_items=1):
+            image = self.loader(image_path)
+        with self.stage_timers.stage("transform", num_items=1):
+            image = self.transform(image)
+            if self.normalize_images:
+                image = image / 255
         return image, image_path
 
 
@@ -80,6 +86,7 @@ class ZarrDataset(ImageAndIdDataset):
         image_name_from_idx: Optional[Callable[[int], str]] = None,
         image_transforms: List[nn.Module] = [],
         normalize_images: bool = False,
+        stage_timers: Optional[StageTimers] = None,
     ):
         """
         Dataset for loading images from a zarr array. The "__getitem__" method
@@ -100,6 +107,7 @@ class ZarrDataset(ImageAndIdDataset):
 
         self.transform = Compose(image_transforms)
         self.normalize_images = normalize_images
+        self.stage_timers = stage_timers or StageTimers(enabled=False)
         self._N = int(math.log(len(self), 10) + 1)
 
     def _image_name_from_idx(self, idx: int) -> str:
@@ -113,15 +121,17 @@ class ZarrDataset(ImageAndIdDataset):
         )
 
     def __getitem__(self, idx) -> Tuple[torch.Tensor, str]:
-        image = (
-            self.zarr_store[:, :, idx]
-            if isinstance(self.zarr_store, zarr.Array)
-            else self.zarr_store[idx][:]
-        )[None, ...]
-        image = torch.from_numpy(image)
-        image = self.transform(image)
-        if self.normalize_images:
-            image = image / 255
+        with self.stage_timers.stage("decode", num_items=1):
+            image = (
+                self.zarr_store[:, :, idx]
+                if isinstance(self.zarr_store, zarr.Array)
+                else self.zarr_store[idx][:]
+            )[None, ...]
+        with self.stage_timers.stage("transform", num_items=1):
+            image = torch.from_numpy(image)
+            image = self.transform(image)
+            if self.normalize_images:
+                image = image / 255
 
         return image, self.image_name_from_idx(idx)
 
@@ -138,6 +148,7 @@ def get_dataset(
     path_to_zarr: Optional[Path] = None,
     image_transforms: List[nn.Module] = [],
     normalize_images: bool = False,
+    stage_timers: Optional[StageTimers] = None,
 ) -> ImageAndIdDataset:
     if path_to_images is not None and path_to_zarr is not None:
         raise ValueError(
@@ -148,12 +159,14 @@ def get_dataset(
             path_to_images,
             image_transforms=image_transforms,
             normalize_images=normalize_images,
+            stage_timers=stage_timers,
         )
     elif path_to_zarr is not None:
         return ZarrDataset(
             path_to_zarr,
             image_transforms=image_transforms,
             normalize_images=normalize_images,
+            stage_timers=stage_timers,
         )
     else:
         raise ValueError("one of 'path_to_images' or 'path_to_zarr' must not be None")
@@ -0,0 +1,160 @@
+import json
+import torch
+import numpy as np
+import numpy.typing as npt
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from torch.utils.data import Dataset
+
+from yogo.data.path_table import PathTable
+from yogo.data.yogo_dataset import labels_to_sparse_tensor, labels_to_tensor
+
+
+"""
+Packed datasets
+---------------
+
+`yogo pack` (see `yogo/utils/pack.py`) converts the image and label folders of a
+dataset definition into a few large "shards", so that training reads a handful
+of big files instead of an image file and a label file per sample. A shard is a
+directory with
+
+    images.npy     uint8 (num images, C, H, W): the images, resized to image_hw
+    labels.npy     float32 (num labels, 5): (class_idx, xc, yc, w, h) rows, as
+                   returned by `load_labels`
+    offsets.npy    int64 (num images + 1,): the labels of the i-th image are
+                   labels[offsets[i] : offsets[i + 1]]
+    manifest.json  the class names, image_hw, whether images are rgb, the source
+                   image and label path of each image, and the indices of images
+                   that couldn't be read when packing
+
+Shards are referenced from a dataset definition with `packed_path` (see
+`PackedSpecification`), and `PackedDetectionDataset` reads them.
+"""
+
+
+PACKED_VERSION = 1
+PACKED_MANIFEST_NAME = "manifest.json"
+
+
+class PackedDetectionDataset(Dataset):
+    """
+    Reads a shard written by `yogo pack`. The arrays are memory-mapped, so each
+    sample's image is a slice of the mapped file rather than a decoded copy, and
+    dataloader workers share the page cache instead of holding their own copies.
+    Samples are the same as `ObjectDetectionDataset`'s.
+    """
+
+    def __init__(
+        self,
+        packed_path: Path,
+        Sx: int,
+        Sy: int,
+        classes: List[str],
+        image_hw: Tuple[int, int] = (772, 1032),
+        rgb: bool = False,
+        normalize_images: bool = False,
+        sparse_labels: bool = False,
+    ):
+        self.packed_path = Path(packed_path)
+        self.Sx = Sx
+        self.Sy = Sy
+        self.classes = classes
+        self.normalize_images = normalize_images
+        self.sparse_labels = sparse_labels
+
+        with open(self.packed_path / PACKED_MANIFEST_NAME, "r") as f:
+            manifest = json.load(f)
+
+        if manifest["version"] != PACKED_VERSION:
+            raise ValueError(
+                f"{self.packed_path} was packed with version {manifest['version']} "
+                f"of the packed format, but this is version {PACKED_VERSION}; "
+                "please re-run `yogo pack`"
+            )
+        elif manifest["classes"] != classes:
+            raise ValueError(
+                f"{self.packed_path} was packed with classes {manifest['classes']}, "
+                f"but classes {classes} were requested"
+            )
+        elif tuple(manifest["image_hw"]) != tuple(image_hw) or manifest["rgb"] != rgb:
+            raise ValueError(
+                f"{self.packed_path} was packed with image_hw={manifest['image_hw']} "
+                f"and rgb={manifest['rgb']}, but image_hw={image_hw} and rgb={rgb} "
+                "were requested; please re-run `yogo pack` with these settings"
+            )
+
+        # a PathTable rather than lists of strings, so dataloader workers don't
+        # copy them (see `PathTable`)
+        self.image_paths = PathTable.from_paths(manifest["image_paths"])
+        self.label_paths = PathTable.from_paths(manifest["label_paths"])
+        self.unreadable = frozenset(manifest["unreadable"])
+
+        self._images: Optional[npt.NDArray] = None
+        self._labels: Optional[npt.NDArray] = None
+        self._offsets: Optional[npt.NDArray] = None
+
+    def _load(self, name: str) -> npt.NDArray:
+        # copy-on-write, so the images are writable for `torch.from_numpy`,
+        # but pages are only copied if written to - which they never are
+        return np.load(self.packed_path / f"{name}.npy", mmap_mode="c")
+
+    @property
+    def images(self) -> npt.NDArray:
+        if self._images is None:
+            self._images = self._load("images")
+        return self._images
+
+    @property
+    def labels(self) -> npt.NDArray:
+        if self._labels is None:
+            self._labels = self._load("labels")
+        return self._labels
+
+    @property
+    def offsets(self) -> npt.NDArray:
+        if self._offsets is None:
+            self._offsets = self._load("offsets")
+        return self._offsets
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # reopen the memory maps in each dataloader worker
+        state = self.__dict__.copy()
+        state["_images"], state["_labels"], state["_offsets"] = None, None, None
+        return state
+
+    def __len__(self) -> int:
+        return len(self.image_paths)
+
+    def file_labels(self, index: int) -> npt.NDArray:
+        "the (N, 5) labels of the image at index"
+        return self.labels[self.offsets[index] : self.offsets[index + 1]]
+
+    def __getitem__(self, index: int) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
+        if index in self.unreadable:
+            return None
+
+        image = torch.from_numpy(self.images[index])
+
+        file_labels = self.file_labels(index)
+        if self.sparse_labels:
+            labels = labels_to_sparse_tensor(file_labels)
+        else:
+            labels = labels_to_tensor(file_labels, self.Sx, self.Sy)
+
+        if self.normalize_images:
+            # turns our torch.uint8 tensor 'sample' into a torch.FloatTensor
+            image = image / 255
+
+        return image, labels
+
+    def calc_class_counts(self) -> torch.Tensor:
+        """
+        returns a tensor of shape (num_classes,) where each index is the number of
+        times that class appears in the dataset
+        """
+        return torch.from_numpy(
+            np.bincount(self.labels[:, 0].astype(np.int64), minlength=len(self.classes))
+        )
@@ -0,0 +1,82 @@
+import os
+import numpy as np
+import numpy.typing as npt
+
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Union
+
+
+class PathTable:
+    """
+    A compact, read-only list of file paths. Datasets used to keep their paths in
+    numpy unicode arrays, which are UTF-32 and as wide as the longest path, so
+    with long paths and millions of samples they took hundreds of MB - per
+    dataloader worker, since each worker gets its own copy of the dataset.
+
+    Paths are split into their directory and file name. The (few) distinct
+    directories are stored once, and the names are stored as one buffer of
+    UTF-8 bytes, so that path i is
+
+        dirs[dir_idxs[i]] / names[offsets[i] : offsets[i + 1]]
+
+    Like the unicode arrays, everything is in a handful of numpy arrays rather
+    than a list of python strings, so reading paths in forked dataloader
+    workers doesn't touch refcounts and copy pages (see
+    https://github.com/pytorch/pytorch/issues/13246#issuecomment-905703662).
+    """
+
+    def __init__(
+        self,
+        dirs: npt.NDArray,
+        dir_idxs: npt.NDArray,
+        names: npt.NDArray,
+        offsets: npt.NDArray,
+    ):
+        self.dirs = dirs
+        self.dir_idxs = dir_idxs
+        self.names = names
+        self.offsets = offsets
+
+    @classmethod
+    def from_paths(cls, paths: Iterable[Union[str, Path]]) -> "PathTable":
+        dir_ids: Dict[str, int] = {}
+        dir_idxs: List[int] = []
+        names: List[bytes] = []
+        for path in paths:
+            dirname, name = os.path.split(str(path))
+            dir_idxs.append(dir_ids.setdefault(dirname, len(dir_ids)))
+            names.append(os.fsencode(name))
+
+        offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum([len(name) for name in names], out=offsets[1:])
+        return cls(
+            np.array(list(dir_ids), dtype=np.str_),
+            np.array(dir_idxs, dtype=np.int32),
+            np.frombuffer(b"".join(names), dtype=np.uint8),
+            offsets,
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            a.nbytes for a in (self.dirs, self.dir_idxs, self.names, self.offsets)
+        )
+
+    def __len__(self) -> int:
+        return len(self.dir_idxs)
+
+    def __getitem__(self, index: int) -> str:
+        if not -len(self) <= index < len(self):
+            raise IndexError(f"index {index} out of range for {len(self)} paths")
+        index %= len(self)
+
+        name = self.names[self.offsets[index] : self.offsets[index + 1]]
+        return os.path.join(
+            str(self.dirs[self.dir_idxs[index]]), os.fsdecode(name.tobytes())
+        )
+
+    def __iter__(self) -> Iterator[str]:
+        return (self[i] for i in range(len(self)))
+
+    def tolist(self) -> List[str]:
+        return list(self)
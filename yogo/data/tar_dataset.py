@@ -0,0 +1,271 @@
+import io
+import json
+import torch
+import tarfile
+import warnings
+import itertools
+import numpy as np
+import numpy.typing as npt
+
+from pathlib import Path
+from typing import Any, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from torch.utils.data import IterableDataset, get_worker_info
+from torchvision.io import decode_image, ImageReadMode
+from torchvision.transforms import Resize
+
+from yogo.data.yogo_dataset import labels_to_sparse_tensor, labels_to_tensor
+
+
+"""
+Tar shards
+----------
+
+`yogo pack --format tar` (see `yogo/utils/pack.py`) writes the samples of a
+dataset definition, in a random order, into tar files of (image, label) pairs,
+so that an epoch is a few large sequential reads instead of two small random
+reads per sample. Each sample `key` of a shard is two consecutive members:
+
+    {key}.png   the original image file (or .jpg, etc.)
+    {key}.txt   its labels, one `class_idx xc yc w h` row per object. Class
+                indices are those of the dataset definition's class_names, and
+                the area filter of `load_labels` has been applied
+
+A sidecar `{shard}.tar.json` holds the class names and the number of samples,
+so epoch sizes are known without scanning the shards. Shards are referenced
+from a dataset definition with `tar_path` (see `TarSpecification`), and
+`TarShardDataset` reads them.
+"""
+
+
+TAR_VERSION = 1
+
+Sample = Tuple[str, bytes, bytes]
+
+
+def tar_index_path(tar_path: Union[str, Path]) -> Path:
+    tar_path = Path(tar_path)
+    return tar_path.with_name(f"{tar_path.name}.json")
+
+
+def iter_tar_samples(tar_path: Union[str, Path]) -> Iterator[Sample]:
+    "(key, image bytes, label bytes) for each sample of a tar shard, in order"
+    with tarfile.open(tar_path, "r|") as tar:
+        key, image, labels = None, None, None
+        for member in tar:
+            member_file = tar.extractfile(member)
+            if member_file is None:
+                continue
+
+            stem, _, ext = member.name.rpartition(".")
+            if stem != key:
+                key, image, labels = stem, None, None
+
+            if ext == "txt":
+                labels = member_file.read()
+            else:
+                image = member_file.read()
+
+            if image is not None and labels is not None:
+                yield stem, image, labels
+                key, image, labels = None, None, None
+
+
+def parse_labels(label_bytes: bytes) -> npt.NDArray:
+    "the (N, 5) labels of a `{key}.txt` member"
+    if len(label_bytes.strip()) == 0:
+        return np.zeros((0, 5), dtype=np.float32)
+    return np.loadtxt(io.BytesIO(label_bytes), dtype=np.float32, ndmin=2)
+
+
+class TarShardDataset(IterableDataset):
+    """
+    Streams samples from tar shards, reading each shard front to back. Samples
+    are the same as `ObjectDetectionDataset`'s.
+
+    Every (DDP rank, dataloader worker) pair reads its own subset of the shards.
+    With fewer shards than readers, every reader reads every shard and keeps
+    every (number of readers)-th sample - correct, but with more I/O, which is
+    fine for small validation and test sets. Each reader yields the same number
+    of samples, so every rank runs the same number of steps; the few samples this
+    drops vary from epoch to epoch when shuffling.
+
+    With shuffle=True, the order of the shards is shuffled every epoch, and
+    samples go through a shuffle buffer of shuffle_buffer_size (undecoded)
+    samples. `yogo pack` shuffles samples across shards, so that this is enough.
+
+    sample_range = (start, stop) keeps only a fraction of the samples of the
+    shards: each sample gets a random position in [0, 1), which depends only on
+    the seed and the shards' sizes, and samples in [start, stop) are kept. So
+    datasets of the same shards and seed with disjoint ranges split the samples
+    between them, whichever reader reads them.
+    """
+
+    def __init__(
+        self,
+        tar_paths: Sequence[Union[str, Path]],
+        Sx: int,
+        Sy: int,
+        classes: List[str],
+        image_hw: Tuple[int, int] = (772, 1032),
+        rgb: bool = False,
+        normalize_images: bool = False,
+        sparse_labels: bool = False,
+        shuffle: bool = False,
+        shuffle_buffer_size: int = 512,
+        seed: int = 7271978,
+        rank: Optional[int] = None,
+        world_size: Optional[int] = None,
+        sample_range: Tuple[float, float] = (0.0, 1.0),
+    ):
+        super().__init__()
+
+        self.tar_paths = [Path(p) for p in tar_paths]
+        self.Sx = Sx
+        self.Sy = Sy
+        self.classes = classes
+        self.image_mode = ImageReadMode.RGB if rgb else ImageReadMode.GRAY
+        self.resize = Resize(image_hw, antialias=True)
+        self.normalize_images = normalize_images
+        self.sparse_labels = sparse_labels
+        self.shuffle = shuffle
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.seed = seed
+
+        self.num_samples: List[int] = []
+        for tar_path in self.tar_paths:
+            with open(tar_index_path(tar_path), "r") as f:
+                index = json.load(f)
+            if index["version"] != TAR_VERSION:
+                raise ValueError(
+                    f"{tar_path} was packed with version {index['version']} of the "
+                    f"tar format, but this is version {TAR_VERSION}; please re-run "
+                    "`yogo pack --format tar`"
+                )
+            elif index["classes"] != classes:
+                raise ValueError(
+                    f"{tar_path} was packed with classes {index['classes']}, "
+                    f"but classes {classes} were requested"
+                )
+            self.num_samples.append(index["num_samples"])
+
+        # which samples of each shard to keep, if this is a split of the samples
+        self._keep: Optional[List[npt.NDArray]] = None
+        if tuple(sample_range) != (0.0, 1.0):
+            total = sum(self.num_samples)
+            start, stop = (round(f * total) for f in sample_range)
+            positions = np.random.default_rng(seed).permutation(total)
+            keep = (start <= positions) & (positions < stop)
+            self._keep = np.split(keep, np.cumsum(self.num_samples)[:-1])
+            self.num_samples = [int(k.sum()) for k in self._keep]
+
+        # the dataloader's worker processes can't ask torch.distributed, so ask now
+        if rank is None or world_size is None:
+            try:
+                rank = torch.distributed.get_rank()
+                world_size = torch.distributed.get_world_size()
+            except (RuntimeError, ValueError):
+                rank, world_size = 0, 1
+        self.rank = rank
+        self.world_size = world_size
+
+        # each worker has its own copy of the dataset, which it iterates once per
+        # epoch, so counting iterations counts epochs in every worker
+        self._epoch = 0
+
+    def __len__(self) -> int:
+        "about how many samples this rank reads per epoch"
+        return sum(self.num_samples) // self.world_size
+
+    def _reader(self) -> Tuple[int, int]:
+        "(this reader's index, the number of readers)"
+        worker_info = get_worker_info()
+        if worker_info is None:
+            return self.rank, self.world_size
+        return (
+            self.rank * worker_info.num_workers + worker_info.id,
+            self.world_size * worker_info.num_workers,
+        )
+
+    def _read(self, shard_idxs: Iterable[int]) -> Iterator[Sample]:
+        for shard_idx in shard_idxs:
+            samples = iter_tar_samples(self.tar_paths[shard_idx])
+            if self._keep is not None:
+                samples = itertools.compress(samples, self._keep[shard_idx])
+            yield from samples
+
+    def _shuffled(
+        self, samples: Iterable[Sample], rng: np.random.Generator
+    ) -> Iterator[Sample]:
+        buffer: List[Sample] = []
+        for sample in samples:
+            if len(buffer) < self.shuffle_buffer_size:
+                buffer.append(sample)
+                continue
+            i = rng.integers(len(buffer))
+            yield buffer[i]
+            buffer[i] = sample
+        rng.shuffle(buffer)  # type: ignore
+        yield from buffer
+
+    def _decode(self, sample: Sample) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
+        key, image_bytes, label_bytes = sample
+        try:
+            image = decode_image(
+                torch.frombuffer(bytearray(image_bytes), dtype=torch.uint8),
+                self.image_mode,
+            )
+        except (RuntimeError, ValueError) as e:
+            # dropped by `collate_batch_robust`, like unreadable image files. An
+            # empty image file raises a ValueError from `torch.frombuffer`
+            warnings.warn(f"sample {key} threw: {e}")
+            return None
+
+        image = self.resize(image)
+
+        file_labels = parse_labels(label_bytes)
+        if self.sparse_labels:
+            labels = labels_to_sparse_tensor(file_labels)
+        else:
+            labels = labels_to_tensor(file_labels, self.Sx, self.Sy)
+
+        if self.normalize_images:
+            # turns our torch.uint8 tensor 'sample' into a torch.FloatTensor
+            image = image / 255
+
+        return image, labels
+
+    def __iter__(self) -> Iterator[Any]:
+        reader, num_readers = self._reader()
+        epoch = self._epoch
+        self._epoch += 1
+
+        # the same shard order on every reader
+        rng = np.random.default_rng((self.seed, epoch))
+        shard_order = (
+            rng.permutation(len(self.tar_paths))
+            if self.shuffle
+            else np.arange(len(self.tar_paths))
+        )
+
+        samples: Iterator[Sample]
+        if len(shard_order) >= num_readers:
+            reader_shards = [shard_order[i::num_readers] for i in range(num_readers)]
+            samples_per_reader = min(
+                sum(self.num_samples[s] for s in shards) for shards in reader_shards
+            )
+            samples = self._read(reader_shards[reader])
+        else:
+            samples_per_reader = sum(self.num_samples) // num_readers
+            samples = itertools.islice(
+                self._read(shard_order), reader, None, num_readers
+            )
+
+        samples = itertools.islice(samples, samples_per_reader)
+        if self.shuffle:
+            samples = self._shuffled(
+                samples, np.random.default_rng((self.seed, epoch, reader))
+            )
+
+        for sample in samples:
+            yield self._decode(sample)
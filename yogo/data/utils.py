@@ -10,7 +10,7 @@ from ruamel.yaml import YAML
 from torchvision.io import read_image as read_image_torch, ImageReadMode
 
 from yogo.data.data_transforms import MultiArgSequential
-from yogo.data.dataset_definition_file import DatasetDefinition
+from yogo.data.dataset_definition_file import DatasetDefinition, LiteralSpecification
 
 
 def read_image(img_path: Union[str, Path], rgb: bool = False) -> torch.Tensor:
@@ -56,10 +56,22 @@ def collate_batch_robust(
     Filters out None items from a batch and applies transformations to the batched inputs and labels. This function
     is designed to work with datasets that may return None for some items, allowing the DataLoader to skip these items
     gracefully.
+
+    Dense labels, of shape (LABEL_TENSOR_PRED_DIM, Sy, Sx), are stacked. Sparse labels, of
+    shape (N, 5), are concatenated into one (sum(N), 6) tensor, with the index of each
+    label's image in the batch prepended - see `yogo_dataset.densify_labels`.
     """
     inputs, labels = zip(*[pair for pair in batch if pair is not None])
     batched_inputs = torch.stack(inputs)
-    batched_labels = torch.stack(labels)
+    if labels[0].ndim == 2:
+        image_idxs = torch.repeat_interleave(
+            torch.arange(len(labels)), torch.tensor([len(ls) for ls in labels])
+        )
+        batched_labels = torch.cat(
+            [image_idxs.unsqueeze(1).to(labels[0].dtype), torch.cat(labels)], dim=1
+        )
+    else:
+        batched_labels = torch.stack(labels)
     return transforms(batched_inputs, batched_labels)
 
 
@@ -79,6 +91,27 @@ def convert_dataset_definition_to_ultralytics_format(
     """
     dataset_definition = DatasetDefinition.from_yaml(dataset_definition_path)
 
+    # only image and label folders can be symlinked for ultralytics
+    if not all(
+        isinstance(spec, LiteralSpecification)
+        for spec in dataset_definition.all_dataset_paths
+    ):
+        raise ValueError(
+            "only dataset definitions of image and label folders can be converted to "
+            "the ultralytics format - packed, tar, and zarr datasets can't be; use the "
+            "original definition file"
+        )
+    train_specs = [
+        spec
+        for spec in dataset_definition.dataset_paths
+        if isinstance(spec, LiteralSpecification)
+    ]
+    test_specs = [
+        spec
+        for spec in dataset_definition.test_dataset_paths
+        if isinstance(spec, LiteralSpecification)
+    ]
+
     classes = dataset_definition.classes
 
     target_dir.mkdir(exist_ok=True, parents=True)
@@ -90,7 +123,7 @@ def convert_dataset_definition_to_ultralytics_format(
     val_dir.mkdir(exist_ok=True)
 
     train_dir_paths = []
-    for spec in dataset_definition.dataset_paths:
+    for spec in train_specs:
         (train_dir / spec.image_path.parent.name).mkdir(exist_ok=True)
 
         try:
@@ -109,7 +142,7 @@ def convert_dataset_definition_to_ultralytics_format(
         train_dir_paths.append(str(train_dir / spec.image_path.parent.name / "images"))
 
     test_dir_paths = []
-    for spec in dataset_definition.test_dataset_paths:
+    for spec in test_specs:
         (val_dir / spec.image_path.parent.name).mkdir(exist_ok=True)
 
         try:
@@ -4,10 +4,20 @@ import torch
 import warnings
 
 from tqdm import tqdm
+from pathlib import Path
 from functools import partial
+from itertools import accumulate
+from concurrent.futures import ThreadPoolExecutor
 
 from torch.utils.data.distributed import DistributedSampler
-from torch.utils.data import Dataset, ConcatDataset, DataLoader, Subset, random_split
+from torch.utils.data import (
+    Dataset,
+    ConcatDataset,
+    DataLoader,
+    IterableDataset,
+    Subset,
+    random_split,
+)
 
 
 from typing import Any, List, Dict, Optional, Tuple, MutableMapping, Iterable, Union
@@ -16,7 +26,17 @@ from yogo.data.blobgen import BlobDataset
 from yogo.data.utils import collate_batch_robust
 from yogo.data.split_fractions import SplitFractions
 from yogo.data.yogo_dataset import ObjectDetectionDataset
-from yogo.data.dataset_definition_file import DatasetDefinition
+from yogo.data.tar_dataset import TarShardDataset
+from yogo.data.zarr_dataset import ZarrDetectionDataset
+from yogo.data.packed_dataset import PackedDetectionDataset
+from yogo.data.dataset_definition_file import (
+    DatasetDefinition,
+    DatasetSpecification,
+    LiteralSpecification,
+    PackedSpecification,
+    TarSpecification,
+    ZarrSpecification,
+)
 from yogo.data.data_transforms import (
     DualInputModule,
     RandomHorizontalFlipWithBBs,
@@ -77,14 +97,68 @@ def get_datasets(
     image_hw: Tuple[int, int] = (772, 1032),
     normalize_images: bool = False,
     split_fraction_override: Optional[SplitFractions] = None,
+    sparse_labels: bool = False,
+    image_cache_bytes: int = 0,
+    image_cache_dir: Optional[Path] = None,
 ) -> MutableMapping[str, Dataset[Any]]:
     """
     The job of this function is to convert the dataset_definition_file to actual pytorch datasets.
 
-    See the spec in `dataset_definition_file.py`
+    See the spec in `dataset_definition_file.py`. If sparse_labels is True, datasets yield
+    (N, 5) label tensors instead of dense grids - see `yogo_dataset.densify_labels`.
+    If image_cache_bytes > 0, decoded images are cached in image_cache_dir, up to
+    image_cache_bytes in total, counting unused caches of earlier runs, which are evicted
+    to make room - see `image_cache.ImageCache`. Shards from `yogo pack`
+    (see `packed_dataset.py`) are already decoded, so they aren't cached. Frames of
+    zarr stores (see `zarr_dataset.py`) are read directly, and aren't cached either.
+
+    Tar shards (see `tar_dataset.py`) are handled by `get_tar_datasets`.
     """
-    full_dataset: ConcatDataset[ObjectDetectionDataset] = ConcatDataset(
-        ObjectDetectionDataset(
+    if any(
+        isinstance(dsp, TarSpecification)
+        for dsp in dataset_definition.all_dataset_paths
+    ):
+        return get_tar_datasets(
+            dataset_definition,
+            Sx,
+            Sy,
+            rgb=rgb,
+            image_hw=image_hw,
+            normalize_images=normalize_images,
+            split_fraction_override=split_fraction_override,
+            sparse_labels=sparse_labels,
+        )
+
+    def load_dataset(
+        dsp: DatasetSpecification,
+    ) -> Union[ObjectDetectionDataset, PackedDetectionDataset, ZarrDetectionDataset]:
+        if isinstance(dsp, PackedSpecification):
+            return PackedDetectionDataset(
+                dsp.packed_path,
+                Sx,
+                Sy,
+                image_hw=image_hw,
+                rgb=rgb,
+                classes=dataset_definition.classes,
+                normalize_images=normalize_images,
+                sparse_labels=sparse_labels,
+            )
+        elif isinstance(dsp, ZarrSpecification):
+            return ZarrDetectionDataset(
+                dsp.zarr_path,
+                dsp.label_path,
+                Sx,
+                Sy,
+                image_hw=image_hw,
+                rgb=rgb,
+                classes=dataset_definition.classes,
+                normalize_images=normalize_images,
+                sparse_labels=sparse_labels,
+            )
+        elif not isinstance(dsp, LiteralSpecification):
+            # tar shards are handled by `get_tar_datasets`
+            raise ValueError(f"unexpected dataset specification {dsp}")
+        return ObjectDetectionDataset(
             dsp.image_path,
             dsp.label_path,
             Sx,
@@ -93,29 +167,30 @@ def get_datasets(
             rgb=rgb,
             classes=dataset_definition.classes,
             normalize_images=normalize_images,
+            sparse_labels=sparse_labels,
         )
-        for dsp in tqdm(dataset_definition.dataset_paths, desc="loading dataset")
+
+    def load_datasets(specs: List[DatasetSpecification], desc: str) -> List[Dataset]:
+        # finding a dataset's images and labels is mostly waiting on the file
+        # system (often NFS), so load datasets concurrently
+        with ThreadPoolExecutor(max_workers=min(32, max(1, len(specs)))) as executor:
+            return list(
+                tqdm(executor.map(load_dataset, specs), total=len(specs), desc=desc)
+            )
+
+    full_dataset: ConcatDataset[ObjectDetectionDataset] = ConcatDataset(
+        load_datasets(dataset_definition.dataset_paths, "loading dataset")
     )
+    datasets = list(full_dataset.datasets)
 
     if (
         dataset_definition.test_dataset_paths is not None
         and len(dataset_definition.test_dataset_paths) > 0
     ):
         test_dataset: ConcatDataset[ObjectDetectionDataset] = ConcatDataset(
-            ObjectDetectionDataset(
-                dsp.image_path,
-                dsp.label_path,
-                Sx,
-                Sy,
-                image_hw=image_hw,
-                rgb=rgb,
-                classes=dataset_definition.classes,
-                normalize_images=normalize_images,
-            )
-            for dsp in tqdm(
-                dataset_definition.test_dataset_paths, desc="loading test dataset"
-            )
+            load_datasets(dataset_definition.test_dataset_paths, "loading test dataset")
         )
+        datasets.extend(test_dataset.datasets)
         if split_fraction_override is not None:
             split_datasets = split_dataset(
                 ConcatDataset([full_dataset, test_dataset]), split_fraction_override
@@ -134,6 +209,20 @@ def get_datasets(
                 full_dataset, dataset_definition.split_fractions
             )
 
+    if image_cache_bytes > 0:
+        # hand out the budget in the same order on every DDP rank, so that
+        # they all open the same caches
+        remaining_cache_bytes = image_cache_bytes
+        for dataset in sorted(
+            (d for d in datasets if isinstance(d, ObjectDetectionDataset)),
+            key=lambda d: str(d.image_folder_path),
+        ):
+            remaining_cache_bytes -= dataset.open_image_cache(
+                remaining_cache_bytes,
+                image_cache_dir,
+                total_max_bytes=image_cache_bytes,
+            )
+
     if dataset_definition.thumbnail_augmentation is not None:
         for k, v in dataset_definition.thumbnail_augmentation.items():
             if not isinstance(v, list):
@@ -148,12 +237,99 @@ def get_datasets(
             length=len(split_datasets["train"]) // 2,  # type: ignore
             background_img_shape=image_hw,
             normalize_images=normalize_images,
+            sparse_labels=sparse_labels,
         )
         split_datasets["train"] = ConcatDataset([split_datasets["train"], bd])
 
     return split_datasets
 
 
+def get_tar_datasets(
+    dataset_definition: DatasetDefinition,
+    Sx: int,
+    Sy: int,
+    rgb: bool = False,
+    image_hw: Tuple[int, int] = (772, 1032),
+    normalize_images: bool = False,
+    split_fraction_override: Optional[SplitFractions] = None,
+    sparse_labels: bool = False,
+) -> MutableMapping[str, Dataset[Any]]:
+    """
+    `get_datasets` for dataset definitions of tar shards. Since the shards are
+    read as streams, datasets are split per shard instead of per image, and the
+    train / val / test datasets are each a `TarShardDataset` of their shards.
+
+    If that would leave a split without shards (e.g. a small dataset, packed into
+    a few large shards), every split reads every shard instead, and keeps its
+    fraction of the samples (see `TarShardDataset`'s sample_range). This reads
+    the shards once per split, rather than once in total.
+    """
+    if not all(
+        isinstance(dsp, TarSpecification)
+        for dsp in dataset_definition.all_dataset_paths
+    ):
+        raise ValueError(
+            "tar shards can't be mixed with other kinds of dataset specifications"
+        )
+    elif dataset_definition.thumbnail_augmentation is not None:
+        warnings.warn("thumbnail_augmentation is not supported for tar shards")
+
+    def shard_paths(specs: List[DatasetSpecification]) -> List[Path]:
+        return sorted(spec.tar_path for spec in specs)  # type: ignore
+
+    def split_shards(
+        shards: List[Path], split_fractions: SplitFractions
+    ) -> Dict[str, Dict[str, Any]]:
+        "the `TarShardDataset` arguments of each split"
+        fractions = split_fractions.to_dict()
+        sizes = split_fractions.partition_sizes(len(shards))
+        if all(sizes[k] > 0 or fractions[k] == 0 for k in sizes):
+            # random_split works on any sequence
+            splits = split_dataset(shards, split_fractions)  # type: ignore
+            return {k: dict(tar_paths=list(v)) for k, v in splits.items()}  # type: ignore
+
+        warnings.warn(
+            f"{len(shards)} tar shards are too few to split by shard into "
+            f"{split_fractions}, so samples are split instead - every split reads "
+            "every shard. Pack with fewer images per shard to avoid this"
+        )
+        bounds = list(accumulate([0.0, *fractions.values()]))
+        return {
+            k: dict(tar_paths=shards, sample_range=(bounds[i], bounds[i + 1]))
+            for i, k in enumerate(fractions)
+        }
+
+    train_shards = shard_paths(dataset_definition.dataset_paths)
+    test_shards = shard_paths(dataset_definition.test_dataset_paths)
+
+    if len(test_shards) > 0 and split_fraction_override is None:
+        assert "test" not in dataset_definition.split_fractions
+        shards = {
+            **split_shards(train_shards, dataset_definition.split_fractions),
+            "test": dict(tar_paths=test_shards),
+        }
+    else:
+        shards = split_shards(
+            train_shards + test_shards,
+            split_fraction_override or dataset_definition.split_fractions,
+        )
+
+    return {
+        designation: TarShardDataset(
+            Sx=Sx,
+            Sy=Sy,
+            classes=dataset_definition.classes,
+            image_hw=image_hw,
+            rgb=rgb,
+            normalize_images=normalize_images,
+            sparse_labels=sparse_labels,
+            shuffle=designation == "train",
+            **split_kwargs,
+        )
+        for designation, split_kwargs in shards.items()
+    }
+
+
 def split_dataset(
     dataset: Dataset, split_fractions: SplitFractions
 ) -> MutableMapping[str, Dataset[Any]]:
@@ -189,6 +365,9 @@ def get_dataloader(
     rgb: bool = False,
     normalize_images: bool = False,
     split_fraction_override: Optional[SplitFractions] = None,
+    sparse_labels: bool = False,
+    image_cache_bytes: int = 0,
+    image_cache_dir: Optional[Path] = None,
 ) -> Dict[str, DataLoader]:
     split_datasets = get_datasets(
         dataset_definition,
@@ -198,6 +377,9 @@ def get_dataloader(
         image_hw=image_hw,
         normalize_images=normalize_images,
         split_fraction_override=split_fraction_override,
+        sparse_labels=sparse_labels,
+        image_cache_bytes=image_cache_bytes,
+        image_cache_dir=image_cache_dir,
     )
 
     augmentations: List[DualInputModule] = (
@@ -246,10 +428,15 @@ def _get_dataloader(
 ) -> DataLoader:
     transforms = MultiArgSequential(*augmentations)
 
-    sampler: Iterable = DistributedSampler(
-        dataset,
-        rank=rank,
-        num_replicas=world_size,
+    # tar shard datasets split their shards across ranks themselves
+    sampler: Optional[Iterable] = (
+        None
+        if isinstance(dataset, IterableDataset)
+        else DistributedSampler(
+            dataset,
+            rank=rank,
+            num_replicas=world_size,
+        )
     )
 
     # TODO this division by world_size is hacky. Starting up the dataloaders
@@ -302,7 +489,13 @@ def get_class_counts(
     pbar = tqdm(
         total=len(d) * (d.batch_size or 1), desc="counting...", disable=not verbose
     )
-    for _, labels in d:  #:
+    for imgs, labels in d:  #:
+        if labels.ndim == 2:
+            # sparse labels, see `yogo_dataset.densify_labels`
+            class_counts += torch.bincount(labels[:, 1].long(), minlength=num_classes)
+            pbar.update(len(imgs))
+            continue
+
         bs, pd, Sy, Sx = labels.shape
         labels = labels.permute(1, 0, 2, 3)
         labels = labels.reshape(pd, bs * Sy * Sx)
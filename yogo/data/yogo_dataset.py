@@ -1,7 +1,13 @@
+import os
 import csv
 import json
+import time
 import torch
+import hashlib
+import threading
+import warnings
 import numpy as np
+import numpy.typing as npt
 
 from torchvision import ops
 from torchvision import datasets
@@ -12,6 +18,8 @@ from functools import partial
 from typing import List, Dict, Union, Tuple, Optional, Callable, Any, cast
 
 from yogo.data.utils import read_image_robust
+from yogo.data.image_cache import ImageCache, default_image_cache_dir
+from yogo.data.path_table import PathTable
 
 
 LABEL_TENSOR_PRED_DIM_SIZE = 1 + 4 + 1
@@ -29,23 +37,72 @@ def format_labels_tensor(labels: torch.Tensor, Sx: int, Sy: int) -> torch.Tensor
     normalized to the input image's shape.
 
     The LABEL_TENSOR_PRED_DIM consists of (mask, x, y, x, y, class_idx).
-    The mask is 1 if there is a prediction, 0 otherwise.
+    The mask is 1 if there is a prediction, 0 otherwise. If several labels fall in
+    the same grid cell, the last one is kept.
     """
-    output = torch.zeros(LABEL_TENSOR_PRED_DIM_SIZE, Sy, Sx)
+    image_idxs = torch.zeros(len(labels), dtype=torch.long, device=labels.device)
+    return format_labels_tensor_batched(labels, image_idxs, 1, Sx, Sy)[0]
 
-    # find the center of each bbox in a grid of size (Sx,Sy)
-    iis = (labels[:, 1] + labels[:, 3]) * Sx // 2
-    jjs = (labels[:, 2] + labels[:, 4]) * Sy // 2
 
-    # Go through each of our labels and
-    for i, j, label in zip(iis.int(), jjs.int(), labels):
-        output[0, j, i] = 1  # mask that there is a prediction here
-        output[1:5, j, i] = label[1:]  # xyxy
-        output[5, j, i] = label[0]  # class prediction idx
+def format_labels_tensor_batched(
+    labels: torch.Tensor, image_idxs: torch.Tensor, batch_size: int, Sx: int, Sy: int
+) -> torch.Tensor:
+    """
+    `format_labels_tensor` for a whole batch at once: labels is (N, 5), and
+    image_idxs is (N,), the index of the image of each label. Returns a tensor
+    of shape (batch_size, LABEL_TENSOR_PRED_DIM, Sy, Sx).
+    """
+    output = torch.zeros(
+        batch_size, LABEL_TENSOR_PRED_DIM_SIZE, Sy, Sx, device=labels.device
+    )
+    if len(labels) == 0:
+        return output
+
+    # find the center of each bbox in a grid of size (Sx,Sy)
+    iis = ((labels[:, 1] + labels[:, 3]) * Sx // 2).long()
+    jjs = ((labels[:, 2] + labels[:, 4]) * Sy // 2).long()
+
+    # negative indices wrap around, as they would when indexing the grid
+    if ((iis < -Sx) | (iis >= Sx) | (jjs < -Sy) | (jjs >= Sy)).any():
+        raise IndexError(f"label centers fall outside of the ({Sy}, {Sx}) grid")
+
+    image_idxs, iis, jjs = image_idxs.long(), iis % Sx, jjs % Sy
+    cells = (image_idxs * Sy + jjs) * Sx + iis
+
+    # of the labels in each cell, keep the last one
+    label_order = torch.arange(len(labels), device=labels.device)
+    last_label = torch.full(
+        (batch_size * Sy * Sx,), -1, dtype=torch.long, device=labels.device
+    ).scatter_reduce_(0, cells, label_order, reduce="amax")
+    kept = last_label[cells] == label_order
+
+    output[image_idxs[kept], :, jjs[kept], iis[kept]] = torch.cat(
+        [
+            torch.ones_like(labels[kept, :1]),  # mask that there is a prediction here
+            labels[kept, 1:],  # xyxy
+            labels[kept, :1],  # class prediction idx
+        ],
+        dim=1,
+    ).to(output.dtype)
 
     return output
 
 
+def densify_labels(
+    labels: torch.Tensor, batch_size: int, Sx: int, Sy: int
+) -> torch.Tensor:
+    """
+    converts a batch of sparse labels, as packed by `collate_batch_robust`, into
+    the (batch_size, LABEL_TENSOR_PRED_DIM, Sy, Sx) tensor that YOGOLoss expects.
+
+    Sparse labels have shape (N, 6), with elements (image_idx, class_idx, x, y, x, y).
+    Dense labels are returned as-is, so this can be called on either.
+    """
+    if labels.ndim == 4:
+        return labels
+    return format_labels_tensor_batched(labels[:, 1:], labels[:, 0], batch_size, Sx, Sy)
+
+
 def correct_label_idx(
     label: str,
     classes: List[str],
@@ -110,6 +167,30 @@ def load_labels(
     return labels
 
 
+def labels_to_sparse_tensor(
+    labels: Union[List[List[float]], npt.NDArray]
+) -> torch.Tensor:
+    """
+    converts labels from `load_labels` into a tensor of shape (N, 5), with
+    elements (class_idx, x, y, x, y) - the input to `format_labels_tensor`
+    """
+    labels_tensor = torch.tensor(np.asarray(labels, dtype=np.float32)).view(-1, 5)
+    labels_tensor[:, 1:] = ops.box_convert(labels_tensor[:, 1:], "cxcywh", "xyxy")
+    return labels_tensor
+
+
+def labels_to_tensor(
+    labels: Union[List[List[float]], npt.NDArray], Sx: int, Sy: int
+) -> torch.Tensor:
+    "converts labels from `load_labels` into a tensor suitible for back prop"
+    labels_tensor = labels_to_sparse_tensor(labels)
+
+    if labels_tensor.nelement() == 0:
+        return torch.zeros(LABEL_TENSOR_PRED_DIM_SIZE, Sy, Sx)
+
+    return format_labels_tensor(labels_tensor, Sx, Sy)
+
+
 def label_file_to_tensor(
     label_path: Path,
     Sx: int,
@@ -124,13 +205,263 @@ def label_file_to_tensor(
     except Exception as e:
         raise RuntimeError(f"exception from {label_path}") from e
 
-    labels_tensor = torch.Tensor(labels)
+    return labels_to_tensor(labels, Sx, Sy)
 
-    if labels_tensor.nelement() == 0:
-        return torch.zeros(LABEL_TENSOR_PRED_DIM_SIZE, Sy, Sx)
 
-    labels_tensor[:, 1:] = ops.box_convert(labels_tensor[:, 1:], "cxcywh", "xyxy")
-    return format_labels_tensor(labels_tensor, Sx, Sy)
+LABEL_INDEX_DIR_NAME = ".yogo_label_index"
+LABEL_INDEX_VERSION = 2
+
+
+def list_file_names(folder: Path) -> List[str]:
+    "the names of the files in folder, in one listing of the folder"
+    with os.scandir(folder) as entries:
+        return [entry.name for entry in entries if entry.is_file()]
+
+
+def _file_key(path: Path) -> Optional[List[Any]]:
+    "what a label index is invalidated by: a file's name, size, and modification time"
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return [path.name, stat.st_size, stat.st_mtime_ns]
+
+
+def _write_atomic(path: Path, write: Callable[[Any], None]) -> None:
+    # datasets are loaded concurrently, so the pid alone isn't unique
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+DISCOVERY_VERSION = 1
+
+# folders that changed more recently than this may change again within the
+# same mtime tick, so their pairs aren't cached yet
+DISCOVERY_MIN_AGE_NS = 2_000_000_000
+
+
+def _discovery_cache(
+    image_folder_path: Path,
+    label_folder_path: Path,
+    extensions: Union[str, Tuple[str, ...]],
+) -> Tuple[Optional[Path], Dict[str, Any]]:
+    """
+    where to cache the (image, label) pairs that `make_dataset` finds in the folders,
+    and what the cache is valid for: the folders' mtimes, which change whenever a
+    file is added to, removed from, or renamed in them. The path is None if the
+    pairs can't be cached.
+    """
+    if isinstance(extensions, str):
+        extensions = (extensions,)
+
+    index_dir = label_folder_path / LABEL_INDEX_DIR_NAME
+    try:
+        # before the label folder's mtime, which creating index_dir changes
+        index_dir.mkdir(exist_ok=True)
+        key = {
+            "version": DISCOVERY_VERSION,
+            "extensions": sorted(extensions),
+            "image_folder": [
+                str(image_folder_path.absolute()),
+                image_folder_path.stat().st_mtime_ns,
+            ],
+            "label_folder": label_folder_path.stat().st_mtime_ns,
+        }
+    except OSError:
+        return None, {}
+
+    digest = hashlib.sha1(str(image_folder_path.absolute()).encode()).hexdigest()
+    return index_dir / f"pairs_{digest[:16]}.json", key
+
+
+class LabelIndex:
+    """
+    The parsed labels of all the label files of a label folder, so that
+    `load_labels` (csv sniffing, parsing, and class remapping) runs once per
+    label file, instead of once per file per epoch. Two arrays hold the labels:
+
+        labels   float32 (num labels, 5): (class_idx, xc, yc, w, h) rows, as
+                 returned by `load_labels`
+        offsets  int64 (num files + 1,): the labels of the i-th file are
+                 labels[offsets[i] : offsets[i + 1]]
+
+    They are saved to LABEL_INDEX_DIR_NAME in the label folder, named by a digest
+    of the label file names, since datasets that share a label folder may use
+    different label files of it. They are memory-mapped when loaded, so
+    dataloader workers share one copy.
+
+    The index is rebuilt if any label file (or notes.json, or the class list)
+    changed since it was built, going by the files' sizes and mtimes. The label
+    files are only stat-ed if the label folder's mtime changed, so a label file
+    that is edited in place, rather than replaced, isn't noticed until the
+    folder changes.
+    """
+
+    def __init__(
+        self,
+        names: List[str],
+        index_dir: Optional[Path] = None,
+        labels: Optional[npt.NDArray] = None,
+        offsets: Optional[npt.NDArray] = None,
+    ):
+        """
+        names are the label file names, in order. Either index_dir (to mmap the
+        arrays from) or labels and offsets must be given.
+        """
+        self.index_dir = index_dir
+        self.digest = self._digest(names)
+        self.rows = {name: i for i, name in enumerate(names)}
+        self._labels = labels
+        self._offsets = offsets
+
+    @property
+    def labels(self) -> npt.NDArray:
+        if self._labels is None:
+            assert self.index_dir is not None
+            self._labels = np.load(
+                self.index_dir / f"labels_{self.digest}.npy", mmap_mode="r"
+            )
+        return self._labels
+
+    @property
+    def offsets(self) -> npt.NDArray:
+        if self._offsets is None:
+            assert self.index_dir is not None
+            self._offsets = np.load(
+                self.index_dir / f"offsets_{self.digest}.npy", mmap_mode="r"
+            )
+        return self._offsets
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # reopen the memory maps in each dataloader worker, rather than
+        # pickling their contents
+        state = self.__dict__.copy()
+        if self.index_dir is not None:
+            state["_labels"], state["_offsets"] = None, None
+        return state
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def row(self, label_path: Union[str, Path]) -> int:
+        return self.rows[Path(label_path).name]
+
+    def file_labels(self, row: int) -> npt.NDArray:
+        "the (N, 5) labels of the label file at `row`"
+        return self.labels[self.offsets[row] : self.offsets[row + 1]]
+
+    @staticmethod
+    def _digest(names: List[str]) -> str:
+        return hashlib.sha1("\n".join(names).encode()).hexdigest()[:16]
+
+    @staticmethod
+    def _key(classes: List[str], notes_path: Path) -> Dict[str, Any]:
+        return {
+            "version": LABEL_INDEX_VERSION,
+            "area_filter_threshold": AREA_FILTER_THRESHOLD,
+            "classes": classes,
+            "notes": _file_key(notes_path),
+        }
+
+    @staticmethod
+    def _folder_mtime(label_folder_path: Path) -> Optional[int]:
+        """
+        the label folder's mtime, or None if it changed too recently to be sure
+        that it won't change again within the same mtime tick
+        """
+        try:
+            mtime = label_folder_path.stat().st_mtime_ns
+        except OSError:
+            return None
+        return mtime if time.time_ns() - mtime >= DISCOVERY_MIN_AGE_NS else None
+
+    @classmethod
+    def load_or_build(
+        cls,
+        label_folder_path: Path,
+        label_paths: List[str],
+        classes: List[str],
+        notes_data: Optional[Dict[str, Any]] = None,
+    ) -> "LabelIndex":
+        label_folder_path = Path(label_folder_path)
+        sorted_paths = sorted((Path(p) for p in label_paths), key=lambda p: p.name)
+        names = [p.name for p in sorted_paths]
+        index_dir = label_folder_path / LABEL_INDEX_DIR_NAME
+        notes_path = label_folder_path.parent / "notes.json"
+        digest = cls._digest(names)
+        manifest_path = index_dir / f"manifest_{digest}.json"
+
+        try:
+            # before the label folder's mtime, which creating index_dir changes
+            index_dir.mkdir(exist_ok=True)
+        except OSError:
+            pass
+        # before reading any label file, so that changes made while the index
+        # is built change the mtime that is saved with it
+        folder_mtime = cls._folder_mtime(label_folder_path)
+        key = cls._key(classes, notes_path)
+
+        def write_manifest(files: List[Optional[List[Any]]]) -> None:
+            contents = {**key, "label_folder": folder_mtime, "files": files}
+            _write_atomic(
+                manifest_path, lambda f: f.write(json.dumps(contents).encode())
+            )
+
+        try:
+            with open(manifest_path, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+
+        if all(manifest.get(k) == v for k, v in key.items()):
+            if folder_mtime is not None and manifest["label_folder"] == folder_mtime:
+                return cls(names, index_dir=index_dir)
+            files = [_file_key(p) for p in sorted_paths]
+            if manifest["files"] == files:
+                if folder_mtime is not None:
+                    # so that next time, the label files needn't be stat-ed
+                    try:
+                        write_manifest(files)
+                    except OSError:
+                        pass
+                return cls(names, index_dir=index_dir)
+        else:
+            files = [_file_key(p) for p in sorted_paths]
+
+        file_labels: List[List[List[float]]] = []
+        for label_path in sorted_paths:
+            try:
+                file_labels.append(
+                    load_labels(label_path, classes=classes, notes_data=notes_data)
+                )
+            except Exception as e:
+                raise RuntimeError(f"exception from {label_path}") from e
+
+        labels = np.array(
+            [label for labels in file_labels for label in labels], dtype=np.float32
+        ).reshape(-1, 5)
+        offsets = np.zeros(len(file_labels) + 1, dtype=np.int64)
+        np.cumsum([len(labels) for labels in file_labels], out=offsets[1:])
+
+        try:
+            _write_atomic(
+                index_dir / f"labels_{digest}.npy", partial(np.save, arr=labels)
+            )
+            _write_atomic(
+                index_dir / f"offsets_{digest}.npy", partial(np.save, arr=offsets)
+            )
+            # the manifest goes last, so it only ever describes complete arrays
+            write_manifest(files)
+        except OSError as e:
+            warnings.warn(
+                f"couldn't save the label index to {index_dir} ({e}); "
+                "labels will be parsed again next time"
+            )
+            return cls(names, labels=labels, offsets=offsets)
+
+        return cls(names, index_dir=index_dir)
 
 
 class ObjectDetectionDataset(datasets.VisionDataset):
@@ -144,6 +475,7 @@ class ObjectDetectionDataset(datasets.VisionDataset):
         image_hw: Tuple[int, int] = (772, 1032),
         rgb: bool = False,
         normalize_images: bool = False,
+        sparse_labels: bool = False,
         extensions: Tuple[str, ...] = ("png", "jpg", "jpeg", "tif"),
         is_valid_file: Optional[Callable[[str], bool]] = None,
         *args,
@@ -159,12 +491,15 @@ class ObjectDetectionDataset(datasets.VisionDataset):
         self.loader = partial(read_image_robust, retries=3, min_duration=0.1, rgb=rgb)
         self.resize = Resize(image_hw, antialias=True)
         self.normalize_images = normalize_images
+        # if True, labels are (N, 5) tensors of (class_idx, x, y, x, y) instead
+        # of dense grids; see `densify_labels`
+        self.sparse_labels = sparse_labels
         self.notes_data: Optional[Dict[str, Any]] = None
 
         # https://pytorch.org/docs/stable/data.html#multi-process-data-loading
         # https://github.com/pytorch/pytorch/issues/13246#issuecomment-905703662
         # essentially, to avoid dataloader workers from copying tonnes of mem,
-        # we can't store samples in lists. Hence, numpy arrays.
+        # we can't store samples in lists. Hence, numpy arrays, in `PathTable`s.
         image_paths, label_paths = self.make_dataset(
             Sx,
             Sy,
@@ -175,8 +510,40 @@ class ObjectDetectionDataset(datasets.VisionDataset):
         self.Sx = Sx
         self.Sy = Sy
 
-        self._image_paths = np.array(image_paths).astype(np.unicode_)
-        self._label_paths = np.array(label_paths).astype(np.unicode_)
+        self._image_paths = PathTable.from_paths(image_paths)
+        self._label_paths = PathTable.from_paths(label_paths)
+
+        self.label_index = LabelIndex.load_or_build(
+            label_folder_path, label_paths, classes, notes_data=self.notes_data
+        )
+        self._label_rows = np.array(
+            [self.label_index.row(p) for p in label_paths], dtype=np.int64
+        )
+
+        self.image_shape = (3 if rgb else 1, *image_hw)
+        self.image_cache: Optional[ImageCache] = None
+
+    def open_image_cache(
+        self,
+        max_bytes: int,
+        cache_dir: Optional[Path] = None,
+        total_max_bytes: Optional[int] = None,
+    ) -> int:
+        """
+        cache up to max_bytes of decoded and resized images, in a file in cache_dir
+        (by default, shared memory) that dataloader workers and DDP ranks share. Unused
+        cache files in cache_dir are evicted to keep all of them within total_max_bytes.
+        See `ImageCache`. Returns the size of the cache in bytes.
+        """
+        self.image_cache = ImageCache.open_or_create(
+            cache_dir or default_image_cache_dir(),
+            key={"image_paths": self._image_paths.tolist()},
+            num_images=len(self),
+            image_shape=self.image_shape,
+            max_bytes=max_bytes,
+            total_max_bytes=total_max_bytes,
+        )
+        return self.image_cache.nbytes if self.image_cache is not None else 0
 
     def make_dataset(
         self,
@@ -216,32 +583,54 @@ class ObjectDetectionDataset(datasets.VisionDataset):
             with open(str(self.label_folder_path.parent / "notes.json"), "r") as notes:
                 self.notes_data = json.load(notes)
 
-        # maps file name to a list of tuples of bounding boxes + classes
+        # the pairs found last time, if neither folder has changed since
+        cache_path: Optional[Path] = None
+        cache_key: Dict[str, Any] = {}
+        if extensions is not None:
+            cache_path, cache_key = _discovery_cache(
+                Path(self.image_folder_path), Path(self.label_folder_path), extensions
+            )
+        if cache_path is not None:
+            try:
+                with open(cache_path, "r") as f:
+                    cached = json.load(f)
+                if cached["key"] == cache_key:
+                    return (
+                        [str(self.image_folder_path / n) for n in cached["images"]],
+                        [str(self.label_folder_path / n) for n in cached["labels"]],
+                    )
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+
+        # list each folder once and match labels to images in memory, instead
+        # of stat-ing candidate image paths per label, which is slow on NFS
+        image_file_names = set(list_file_names(self.image_folder_path))
+
         image_paths: List[str] = []
         label_paths: List[str] = []
         missing_images: List[str] = []
 
-        for label_file_path in self.label_folder_path.glob("*.txt"):
+        for label_file_name in list_file_names(self.label_folder_path):
             # ignore (*nix convention) hidden files
-            if label_file_path.name.startswith("."):
+            if label_file_name.startswith(".") or not label_file_name.endswith(".txt"):
                 continue
 
+            stem = label_file_name[: -len(".txt")]
             possible_image_paths = [
-                self.image_folder_path / label_file_path.with_suffix(sfx).name
+                self.image_folder_path / f"{stem}{sfx}"
                 for sfx in [".png", ".jpg"]
+                if f"{stem}{sfx}" in image_file_names
             ]
 
             try:
                 image_file_path = next(
-                    ip
-                    for ip in possible_image_paths
-                    if (ip.exists() and is_valid_file(str(ip)))
+                    ip for ip in possible_image_paths if is_valid_file(str(ip))
                 )
                 image_paths.append(str(image_file_path))
-                label_paths.append(str(label_file_path))
+                label_paths.append(str(self.label_folder_path / label_file_name))
             except StopIteration:
                 # image is missing
-                missing_images.append(str(label_file_path))
+                missing_images.append(str(self.label_folder_path / label_file_name))
                 if len(image_paths) > 10:
                     # just give up!
                     break
@@ -261,21 +650,55 @@ class ObjectDetectionDataset(datasets.VisionDataset):
                 f"{missing_subset}"
             )
 
+        now = time.time_ns()
+        if (
+            cache_path is not None
+            and now - cache_key["image_folder"][1] > DISCOVERY_MIN_AGE_NS
+            and now - cache_key["label_folder"] > DISCOVERY_MIN_AGE_NS
+        ):
+            cached = {
+                "key": cache_key,
+                "images": [Path(p).name for p in image_paths],
+                "labels": [Path(p).name for p in label_paths],
+            }
+            try:
+                _write_atomic(
+                    cache_path, lambda f: f.write(json.dumps(cached).encode())
+                )
+            except OSError:
+                pass
+
         return image_paths, label_paths
 
-    def __getitem__(self, index: int) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
-        image_path = self._image_paths[index]
-        label_path = self._label_paths[index]
+    def load_image(self, index: int) -> Optional[torch.Tensor]:
+        "the resized uint8 image at index, or None if it can't be read"
+        image = self.image_cache.get(index) if self.image_cache is not None else None
 
-        maybe_image = self.loader(image_path)
-        if maybe_image is None:
-            return None
+        if image is None:
+            maybe_image = self.loader(self._image_paths[index])
+            if maybe_image is None:
+                return None
 
-        image = self.resize(maybe_image)
+            image = self.resize(maybe_image)
+            if self.image_cache is not None:
+                self.image_cache.put(index, image)
 
-        labels = label_file_to_tensor(
-            Path(label_path), self.Sx, self.Sy, self.classes, self.notes_data
-        )
+        return image
+
+    def file_labels(self, index: int) -> npt.NDArray:
+        "the (N, 5) labels of the image at index, as returned by `load_labels`"
+        return self.label_index.file_labels(self._label_rows[index])
+
+    def __getitem__(self, index: int) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
+        image = self.load_image(index)
+        if image is None:
+            return None
+
+        file_labels = self.file_labels(index)
+        if self.sparse_labels:
+            labels = labels_to_sparse_tensor(file_labels)
+        else:
+            labels = labels_to_tensor(file_labels, self.Sx, self.Sy)
 
         if self.normalize_images:
             # turns our torch.uint8 tensor 'sample' into a torch.FloatTensor
@@ -291,11 +714,10 @@ class ObjectDetectionDataset(datasets.VisionDataset):
         returns a tensor of shape (num_classes,) where each index is the number of
         times that class appears in the dataset
         """
-        class_counts = torch.zeros(len(self.classes), dtype=torch.long)
-        for label_path in self._label_paths:
-            labels = load_labels(
-                label_path, classes=self.classes, notes_data=self.notes_data
-            )
-            for label in labels:
-                class_counts[int(label[0])] += 1
-        return class_counts
+        class_idxs = np.concatenate(
+            [np.zeros(0, dtype=np.float32)]
+            + [self.label_index.file_labels(row)[:, 0] for row in self._label_rows]
+        )
+        return torch.from_numpy(
+            np.bincount(class_idxs.astype(np.int64), minlength=len(self.classes))
+        )
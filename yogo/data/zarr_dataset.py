@@ -0,0 +1,272 @@
+import re
+import csv
+import json
+import zarr
+import torch
+import numpy as np
+import numpy.typing as npt
+
+from pathlib import Path
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from torch.utils.data import Dataset
+from torchvision.transforms import Resize
+
+from yogo.data.yogo_dataset import (
+    AREA_FILTER_THRESHOLD,
+    LabelIndex,
+    correct_label_idx,
+    labels_to_sparse_tensor,
+    labels_to_tensor,
+)
+
+
+"""
+Zarr datasets
+-------------
+
+Experiment runs are saved as zarr stores of frames - either one array of shape
+(H, W, num frames), or a group with an (H, W) array per frame, keyed by frame
+index (see `ZarrDataset` in `image_path_dataset.py`). `ZarrDetectionDataset`
+trains on labelled frames of a run directly, instead of on PNGs exported from it.
+Labels are either
+
+    a folder of label files, one per labelled frame, in the usual format. The
+    frame index is the number at the end of the file name, so `img_0042.txt`
+    (as named by `ZarrDataset`) is frame 42
+
+    a csv table of `frame_idx,class_idx,xc,yc,w,h` rows, with an optional
+    header. A row with just a frame index marks a labelled frame without any
+    objects
+
+Zarr datasets are referenced from a dataset definition with `zarr_path` and
+`label_path` (see `ZarrSpecification`).
+"""
+
+
+FRAME_IDX_PATTERN = re.compile(r"(\d+)$")
+
+
+def frame_idx_from_label_path(label_path: Path) -> int:
+    match = FRAME_IDX_PATTERN.search(label_path.stem)
+    if match is None:
+        raise ValueError(
+            f"can't find a frame index at the end of label file name {label_path.name}"
+        )
+    return int(match.group(1))
+
+
+def load_label_table(
+    label_table_path: Path,
+    classes: List[str],
+    notes_data: Optional[Dict[str, Any]] = None,
+) -> Tuple[npt.NDArray, npt.NDArray, npt.NDArray]:
+    """
+    loads a label table into (frame_idxs, labels, offsets), where frame_idxs are
+    sorted, and the labels of frame_idxs[i] are labels[offsets[i] : offsets[i + 1]],
+    as in `LabelIndex`. Labels are filtered by area, as in `load_labels`.
+    """
+    frame_labels: Dict[int, List[List[float]]] = {}
+    with open(label_table_path, "r", newline="") as f:
+        for i, row in enumerate(csv.reader(f)):
+            row = [v.strip() for v in row if v.strip() != ""]
+            if len(row) == 0 or (i == 0 and not row[0].isnumeric()):
+                # blank line or header
+                continue
+
+            frame_idx = int(row[0])
+            labels = frame_labels.setdefault(frame_idx, [])
+            if len(row) == 1:
+                continue
+            elif len(row) != 6:
+                raise ValueError(
+                    f"should have [frame_idx,class,xc,yc,w,h] - got length {len(row)} "
+                    f"{row} in {label_table_path}"
+                )
+
+            xc, yc, w, h = map(float, row[2:])
+            if w * h < AREA_FILTER_THRESHOLD:
+                continue
+
+            label_idx = correct_label_idx(row[1], classes, notes_data)
+            labels.append([float(label_idx), xc, yc, w, h])
+
+    frame_idxs = np.array(sorted(frame_labels), dtype=np.int64)
+    labels_arr = np.array(
+        [label for idx in frame_idxs for label in frame_labels[idx]], dtype=np.float32
+    ).reshape(-1, 5)
+    offsets = np.zeros(len(frame_idxs) + 1, dtype=np.int64)
+    np.cumsum([len(frame_labels[idx]) for idx in frame_idxs], out=offsets[1:])
+    return frame_idxs, labels_arr, offsets
+
+
+class ZarrDetectionDataset(Dataset):
+    """
+    The labelled frames of a zarr store. Samples are the same as
+    `ObjectDetectionDataset`'s.
+
+    Zarr arrays are compressed in chunks, and a chunk is decompressed whole even
+    if only one of its frames is read. So for arrays with chunks of several frames,
+    the last chunk_cache_size decompressed chunks are kept (per dataloader worker)
+    and frames of those chunks are read from memory. Hits need nearby frames to be
+    read close together, so this helps most when frames are read in order (e.g. for
+    validation and testing), and costs nothing for arrays of one frame per chunk.
+    """
+
+    def __init__(
+        self,
+        zarr_path: Path,
+        label_path: Path,
+        Sx: int,
+        Sy: int,
+        classes: List[str],
+        image_hw: Tuple[int, int] = (772, 1032),
+        rgb: bool = False,
+        normalize_images: bool = False,
+        sparse_labels: bool = False,
+        chunk_cache_size: int = 4,
+    ):
+        self.zarr_path = Path(zarr_path)
+        self.label_path = Path(label_path)
+        self.Sx = Sx
+        self.Sy = Sy
+        self.classes = classes
+        self.rgb = rgb
+        self.resize = Resize(image_hw, antialias=True)
+        self.normalize_images = normalize_images
+        self.sparse_labels = sparse_labels
+        self.chunk_cache_size = chunk_cache_size
+
+        self._store: Optional[Any] = None
+        self._chunks: "OrderedDict[int, npt.NDArray]" = OrderedDict()
+
+        notes_path = self.label_path.parent / "notes.json"
+        notes_data: Optional[Dict[str, Any]] = None
+        if notes_path.exists():
+            with open(notes_path, "r") as notes:
+                notes_data = json.load(notes)
+
+        self.label_index: LabelIndex
+        if self.label_path.is_dir():
+            label_paths = sorted(
+                (
+                    p
+                    for p in self.label_path.glob("*.txt")
+                    if not p.name.startswith(".")
+                ),
+                key=frame_idx_from_label_path,
+            )
+            self.frame_idxs = np.array(
+                [frame_idx_from_label_path(p) for p in label_paths], dtype=np.int64
+            )
+            self.label_index = LabelIndex.load_or_build(
+                self.label_path,
+                [str(p) for p in label_paths],
+                classes,
+                notes_data=notes_data,
+            )
+            self._label_rows = np.array(
+                [self.label_index.row(p) for p in label_paths], dtype=np.int64
+            )
+        else:
+            self.frame_idxs, labels, offsets = load_label_table(
+                self.label_path, classes, notes_data=notes_data
+            )
+            self.label_index = LabelIndex(
+                [str(i) for i in self.frame_idxs], labels=labels, offsets=offsets
+            )
+            self._label_rows = np.arange(len(self.frame_idxs), dtype=np.int64)
+
+        frame_idxs, counts = np.unique(self.frame_idxs, return_counts=True)
+        if (counts > 1).any():
+            raise ValueError(
+                f"{self.label_path} has several label files for frames "
+                f"{frame_idxs[counts > 1].tolist()}"
+            )
+        elif len(self.frame_idxs) > 0 and self.frame_idxs.max() >= self.num_frames:
+            raise ValueError(
+                f"{self.label_path} has labels for frame {self.frame_idxs.max()}, "
+                f"but {self.zarr_path} only has {self.num_frames} frames"
+            )
+
+    @property
+    def store(self) -> Any:
+        if self._store is None:
+            self._store = zarr.open(str(self.zarr_path), mode="r")
+        return self._store
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # reopen the store in each dataloader worker, and don't ship our chunks
+        state = self.__dict__.copy()
+        state["_store"], state["_chunks"] = None, OrderedDict()
+        return state
+
+    @property
+    def num_frames(self) -> int:
+        if isinstance(self.store, zarr.Array):
+            return self.store.shape[2]
+        return len(self.store)
+
+    def _read_frame(self, frame_idx: int) -> npt.NDArray:
+        if not isinstance(self.store, zarr.Array):
+            return self.store[str(frame_idx)][:]
+
+        frames_per_chunk = self.store.chunks[2]
+        if frames_per_chunk == 1 or self.chunk_cache_size < 1:
+            return self.store[:, :, frame_idx]
+
+        chunk_idx, offset = divmod(frame_idx, frames_per_chunk)
+        chunk = self._chunks.get(chunk_idx)
+        if chunk is None:
+            start = chunk_idx * frames_per_chunk
+            chunk = self.store[:, :, start : start + frames_per_chunk]
+            self._chunks[chunk_idx] = chunk
+            if len(self._chunks) > self.chunk_cache_size:
+                self._chunks.popitem(last=False)
+        else:
+            self._chunks.move_to_end(chunk_idx)
+        return chunk[:, :, offset]
+
+    def load_image(self, index: int) -> torch.Tensor:
+        "the resized uint8 image of the frame at index"
+        frame = self._read_frame(self.frame_idxs[index])
+        image = torch.from_numpy(np.ascontiguousarray(frame))[None, ...]
+        if self.rgb:
+            image = image.expand(3, -1, -1)
+        return self.resize(image)
+
+    def file_labels(self, index: int) -> npt.NDArray:
+        "the (N, 5) labels of the frame at index, as returned by `load_labels`"
+        return self.label_index.file_labels(self._label_rows[index])
+
+    def __getitem__(self, index: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        image = self.load_image(index)
+
+        file_labels = self.file_labels(index)
+        if self.sparse_labels:
+            labels = labels_to_sparse_tensor(file_labels)
+        else:
+            labels = labels_to_tensor(file_labels, self.Sx, self.Sy)
+
+        if self.normalize_images:
+            # turns our torch.uint8 tensor 'sample' into a torch.FloatTensor
+            image = image / 255
+
+        return image, labels
+
+    def __len__(self) -> int:
+        return len(self.frame_idxs)
+
+    def calc_class_counts(self) -> torch.Tensor:
+        """
+        returns a tensor of shape (num_classes,) where each index is the number of
+        times that class appears in the dataset
+        """
+        class_idxs = np.concatenate(
+            [np.zeros(0, dtype=np.float32)]
+            + [self.label_index.file_labels(row)[:, 0] for row in self._label_rows]
+        )
+        return torch.from_numpy(
+            np.bincount(class_idxs.astype(np.int64), minlength=len(self.classes))
+        )
@@ -1,39 +1,113 @@
 #! /usr/bin/env python3
 
+import os
 import json
+import time
+import queue
 import torch
 import signal
+import torchvision.ops as ops
 import datetime
 import warnings
 
 import numpy as np
+import numpy.typing as npt
 import matplotlib.pyplot as plt
 
 from tqdm import tqdm
 from pathlib import Path
-from typing import List, Union, Optional, Literal
+from functools import partial
+from dataclasses import dataclass, fields
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Sequence,
+    Tuple,
+    Union,
+    Optional,
+    Literal,
+    get_args,
+)
 
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Dataset, Subset
 from torchvision.transforms import CenterCrop
 
 from yogo.model import YOGO
 from yogo.utils.argparsers import infer_parser
-from yogo.data.image_path_dataset import ZarrDataset, get_dataset, collate_fn
+from yogo.utils.profiling import StepTracer
+from yogo.utils.infer_progress import InferenceProgress
+from yogo.utils.columnar_predictions import ColumnarPredictionWriter
+from yogo.utils.prediction_writer import ArchiveFormat, LabelFileWriter
+from yogo.utils.frame_counts import FrameCountWriter
+from yogo.utils.rendering import AnnotatedImageWriter
+from yogo.utils.tiling import (
+    iter_tiles,
+    merge_tile_predictions,
+    tile_to_image_boxes,
+)
+from yogo.data.image_path_dataset import (
+    ImageAndIdDataset,
+    ZarrDataset,
+    get_dataset,
+    collate_fn,
+)
 from yogo.data.yogo_dataloader import choose_dataloader_num_workers
+from yogo.data.data_transforms import hflip_grid, vflip_grid
 from yogo.utils import (
+    StageTimers,
     draw_yogo_prediction,
     format_preds,
+    format_preds_batched,
     choose_device,
     format_to_numpy,
 )
 
 
+# progress of a run is recorded in this subdirectory of output_dir
+PROGRESS_DIR_NAME = ".yogo_infer_progress"
+
+# how often a resumed run records its progress, if checkpoint_every isn't given
+DEFAULT_CHECKPOINT_EVERY = 10_000
+
+
 # lets us ctrl-c to exit while matplotlib is showing stuff
 signal.signal(signal.SIGINT, signal.SIG_DFL)
 
 
-def argmax(arr):
-    return max(range(len(arr)), key=arr.__getitem__)
+def format_label_strings(
+    batch_preds: torch.Tensor,
+    obj_thresh: float = 0.5,
+    iou_thresh: float = 0.5,
+    min_class_confidence_threshold: float = 0.0,
+) -> List[str]:
+    """
+    Format a batch of YOGO predictions as the contents of YOGO label files
+    ("class xc yc w h" per line), one string per image.
+
+    NMS is per-image, but everything after it is done once for the whole batch:
+    one copy to the host, one argmax, and one conversion to python floats. Floats
+    are written with their shortest repr, so they read back exactly through
+    `load_labels`.
+    """
+    per_image_preds = [
+        format_preds(
+            pred_slice,
+            obj_thresh=obj_thresh,
+            iou_thresh=iou_thresh,
+            min_class_confidence_threshold=min_class_confidence_threshold,
+        )
+        for pred_slice in batch_preds
+    ]
+    preds = torch.cat(per_image_preds).float().cpu().numpy()
+
+    classes = preds[:, 5:].argmax(axis=1).tolist()
+    boxes = preds[:, :4].tolist()
+    lines = [f"{c} {xc} {yc} {w} {h}" for c, (xc, yc, w, h) in zip(classes, boxes)]
+
+    offsets = np.cumsum([0] + [len(p) for p in per_image_preds])
+    return ["\n".join(lines[s:e]) for s, e in zip(offsets[:-1], offsets[1:])]
 
 
 def save_predictions(
@@ -41,20 +115,89 @@ def save_predictions(
     batch_preds,
     obj_thresh=0.5,
     iou_thresh=0.5,
+    stage_timers: Optional[StageTimers] = None,
+    writer: Optional[LabelFileWriter] = None,
+    min_class_confidence_threshold: float = 0.0,
 ):
-    for fname, pred_slice in zip(fnames, batch_preds):
-        preds = format_preds(
-            pred_slice,
+    """
+    write YOGO label files of batch_preds to fnames. If writer is given, the
+    files are handed to it to write in the background (or to an archive);
+    otherwise they are written before returning.
+    """
+    stage_timers = stage_timers or StageTimers(enabled=False)
+    with stage_timers.stage("format preds", num_items=len(fnames)):
+        pred_strings = format_label_strings(
+            batch_preds,
             obj_thresh=obj_thresh,
             iou_thresh=iou_thresh,
+            min_class_confidence_threshold=min_class_confidence_threshold,
         )
+    with stage_timers.stage("write preds", num_items=len(fnames)):
+        for fname, pred_string in zip(fnames, pred_strings):
+            if writer is not None:
+                writer.write(fname, pred_string)
+            else:
+                with open(fname, "w") as f:
+                    f.write(pred_string)
 
-        pred_string = "\n".join(
-            f"{argmax(pred[5:])} {pred[0]} {pred[1]} {pred[2]} {pred[3]}"
-            for pred in preds
-        )
-        with open(fname, "w") as f:
-            f.write(pred_string)
+
+def detections_per_frame(
+    batch_preds: torch.Tensor,
+    obj_thresh: float = 0.5,
+    iou_thresh: float = 0.5,
+    min_class_confidence_threshold: float = 0.0,
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    Returns the image index, class, and class confidence of every prediction
+    in the batch that survives thresholding and NMS, as three 1D tensors on the
+    device of batch_preds.
+
+    These are the same predictions that `format_preds` (followed by
+    `count_cells_for_formatted_preds`) keeps for each image, but thresholding
+    and NMS are done for the whole batch at once (see `format_preds_batched`),
+    and nothing is copied to the host.
+    """
+    image_idxs, preds = format_preds_batched(
+        batch_preds.float(),
+        obj_thresh=obj_thresh,
+        iou_thresh=iou_thresh,
+        min_class_confidence_threshold=min_class_confidence_threshold,
+    )
+
+    # count_cells_for_formatted_preds drops predictions with zero confidence
+    confidences, classes = preds[:, 5:].max(dim=1)
+    mask = confidences > min_class_confidence_threshold
+
+    return image_idxs[mask], classes[mask], confidences[mask]
+
+
+def _bincount_2d(
+    rows: torch.Tensor, cols: torch.Tensor, num_rows: int, num_cols: int
+) -> torch.Tensor:
+    return torch.bincount(rows * num_cols + cols, minlength=num_rows * num_cols).view(
+        num_rows, num_cols
+    )
+
+
+def count_predictions_per_frame(
+    batch_preds: torch.Tensor,
+    obj_thresh: float = 0.5,
+    iou_thresh: float = 0.5,
+    min_class_confidence_threshold: float = 0.0,
+) -> torch.Tensor:
+    """
+    Count the number of predictions of each class in each image of the batch,
+    returning a (batch size, num classes) tensor on the device of batch_preds.
+    See `detections_per_frame`.
+    """
+    bs, pred_dim, _, _ = batch_preds.shape
+    image_idxs, classes, _ = detections_per_frame(
+        batch_preds,
+        obj_thresh=obj_thresh,
+        iou_thresh=iou_thresh,
+        min_class_confidence_threshold=min_class_confidence_threshold,
+    )
+    return _bincount_2d(image_idxs, classes, bs, pred_dim - 5)
 
 
 def get_prediction_class_counts(
@@ -66,25 +209,16 @@ def get_prediction_class_counts(
     """
     Count the number of predictions of each class, by argmaxing the class predictions
     """
-    bs, pred_dim, Sy, Sx = batch_preds.shape
-    num_classes = pred_dim - 5
-    tot_class_sum = torch.zeros(num_classes, dtype=torch.long)
-
-    for pred_slice in batch_preds:
-        preds = format_preds(
-            pred_slice,
+    return (
+        count_predictions_per_frame(
+            batch_preds,
             obj_thresh=obj_thresh,
             iou_thresh=iou_thresh,
             min_class_confidence_threshold=min_class_confidence_threshold,
         )
-
-        if preds.numel() == 0:
-            continue  # ignore no predictions
-
-        classes = preds[:, 5:]
-        tot_class_sum += count_cells_for_formatted_preds(classes)
-
-    return tot_class_sum
+        .sum(dim=0)
+        .cpu()
+    )
 
 
 def count_cells_for_formatted_preds(
@@ -128,6 +262,17 @@ def get_model_name_from_pth(path_to_pth: Union[str, Path]) -> Optional[str]:
     return torch.load(Path(path_to_pth), map_location="cpu").get("model_name", None)
 
 
+def _run_name(
+    path_to_images: Optional[Path], path_to_zarr: Optional[Path]
+) -> Optional[str]:
+    """name of the .npy / columnar output files for a run"""
+    if path_to_images:
+        return Path(path_to_images).resolve().parent.stem
+    elif path_to_zarr:
+        return Path(path_to_zarr).resolve().stem
+    return None
+
+
 def write_metadata(metadata_path: Path, **kwargs):
     """
     very simply writes a json file with the kwargs
@@ -136,22 +281,1200 @@ def write_metadata(metadata_path: Path, **kwargs):
         json.dump(kwargs, f, indent=4)
 
 
+@dataclass(frozen=True)
+class _InferenceOptions:
+    """
+    options for `_predict_batches` that are fixed for the whole run. Kept in
+    one (picklable) place so that they can be handed to shard processes.
+    """
+
+    batch_size: int
+    device: torch.device
+    half: bool
+    draw_boxes: bool
+    save_preds: bool
+    save_npy: bool
+    save_columnar: bool
+    save_frame_counts: bool
+    confidence_bins: int
+    compress_level: int
+    count_predictions: bool
+    return_full_predictions: bool
+    output_dir: Optional[str]
+    output_img_ftype: str
+    obj_thresh: float
+    iou_thresh: float
+    min_class_confidence_threshold: float
+    class_names: Optional[List[str]]
+    images_are_normalized: bool
+    img_hw: Tuple[int, int]
+    output_shape: Tuple[int, ...]
+
+
+@dataclass
+class _PartialResults:
+    """results of `_predict_batches` over a contiguous range of the dataset"""
+
+    counts: Optional[torch.Tensor]
+    np_results: List[npt.NDArray]
+    full_predictions: Optional[torch.Tensor]
+    frame_counts: Optional[torch.Tensor] = None
+    confidence_histogram: Optional[torch.Tensor] = None
+
+    def to_numpy(self) -> Dict[str, Any]:
+        """fields of self, with tensors converted to numpy arrays"""
+        return {
+            f.name: (v.numpy() if isinstance(v, torch.Tensor) else v)
+            for f in fields(self)
+            for v in (getattr(self, f.name),)
+        }
+
+    @classmethod
+    def from_numpy(cls, values: Dict[str, Any]) -> "_PartialResults":
+        return cls(
+            **{
+                k: (torch.from_numpy(v) if isinstance(v, np.ndarray) else v)
+                for k, v in values.items()
+            }
+        )
+
+
+class _PredictionSink:
+    """
+    Consumes the predictions of one model, batch by batch, for
+    `_predict_batches`: label files and images are handed to `label_writer`
+    and `image_writer`, and npy rows and counts are gathered into a
+    `_PartialResults`.
+    """
+
+    def __init__(
+        self,
+        opts: _InferenceOptions,
+        num_images: int,
+        index_offset: int,
+        stage_timers: StageTimers,
+        label_writer: Optional[LabelFileWriter] = None,
+        image_writer: Optional[AnnotatedImageWriter] = None,
+    ):
+        self.opts = opts
+        self.index_offset = index_offset
+        self.stage_timers = stage_timers
+        self.label_writer = label_writer
+        self.image_writer = image_writer
+
+        device = opts.device
+        _, pred_dim, Sy, Sx = opts.output_shape
+        self.num_classes = pred_dim - 5
+
+        # this tensor can be really big, so only create it if we need it
+        self.results: Optional[torch.Tensor] = None
+        if opts.return_full_predictions:
+            self.results = torch.zeros((num_images, pred_dim, Sy, Sx))
+
+        self.np_results: List[npt.NDArray] = []
+
+        # counts stay on the device until the end of the loop
+        self.tot_counts: Optional[torch.Tensor] = None
+        if opts.count_predictions:
+            self.tot_counts = torch.zeros(
+                (self.num_classes,), dtype=torch.long, device=device
+            )
+
+        self.frame_counts: Optional[torch.Tensor] = None
+        self.confidence_histogram: Optional[torch.Tensor] = None
+        if opts.save_frame_counts:
+            self.frame_counts = torch.zeros(
+                (num_images, self.num_classes), dtype=torch.int32, device=device
+            )
+            self.confidence_histogram = torch.zeros(
+                (self.num_classes, opts.confidence_bins),
+                dtype=torch.long,
+                device=device,
+            )
+
+    def consume(
+        self,
+        i: int,
+        img_batch: torch.Tensor,
+        img_batch_device: torch.Tensor,
+        fnames: List[str],
+        res: torch.Tensor,
+    ) -> None:
+        """handle the predictions `res` of the i-th batch of the dataloader"""
+        opts, stage_timers = self.opts, self.stage_timers
+        img_h, img_w = opts.img_hw
+        num_classes = self.num_classes
+        batch_start = i * opts.batch_size
+        batch_stop = batch_start + res.shape[0]
+
+        if opts.draw_boxes and self.image_writer is not None:
+            assert opts.output_dir is not None
+            with stage_timers.stage("draw boxes", num_items=img_batch.shape[0]):
+                self.image_writer.write(
+                    img_batch_device,
+                    res,
+                    [
+                        Path(opts.output_dir)
+                        / Path(fname).with_suffix(opts.output_img_ftype).name
+                        for fname in fnames
+                    ],
+                    obj_thresh=opts.obj_thresh,
+                    iou_thresh=opts.iou_thresh,
+                    min_class_confidence_threshold=opts.min_class_confidence_threshold,
+                    labels=opts.class_names,
+                    images_are_normalized=opts.images_are_normalized,
+                )
+        elif opts.draw_boxes:
+            for img_idx in range(img_batch.shape[0]):
+                with stage_timers.stage("draw boxes", num_items=1):
+                    bbox_img = draw_yogo_prediction(
+                        img=img_batch[img_idx, ...],
+                        prediction=res[img_idx, ...],
+                        obj_thresh=opts.obj_thresh,
+                        iou_thresh=opts.iou_thresh,
+                        min_class_confidence_threshold=opts.min_class_confidence_threshold,
+                        labels=opts.class_names,
+                        images_are_normalized=opts.images_are_normalized,
+                    )
+                if opts.output_dir is not None:
+                    out_fname = (
+                        Path(opts.output_dir)
+                        / Path(fnames[img_idx]).with_suffix(opts.output_img_ftype).name
+                    )
+                    # don't need to compress these, we delete later
+                    # mypy thinks that you can't save a PIL Image which is false
+                    with stage_timers.stage("write images", num_items=1):
+                        bbox_img.save(out_fname, compress_level=1)  # type: ignore
+                else:
+                    fig, ax = plt.subplots()
+                    ax.set_axis_off()
+                    ax.imshow(bbox_img)
+                    plt.show()
+                    plt.clf()
+                    plt.close()
+        if opts.save_preds:
+            assert (
+                opts.output_dir is not None
+            ), "output_dir must not be None if save_preds is True"
+            out_fnames = [
+                Path(opts.output_dir) / Path(fname).with_suffix(".txt").name
+                for fname in fnames
+            ]
+            save_predictions(
+                out_fnames,
+                res,
+                obj_thresh=opts.obj_thresh,
+                iou_thresh=opts.iou_thresh,
+                stage_timers=stage_timers,
+                writer=self.label_writer,
+                min_class_confidence_threshold=opts.min_class_confidence_threshold,
+            )
+        if opts.save_npy or opts.save_columnar:
+            with stage_timers.stage("format npy", num_items=res.shape[0]):
+                res_np = res.cpu().numpy()
+
+                for j in range(res_np.shape[0]):
+                    img_index = self.index_offset + batch_start + j
+                    parsed = format_to_numpy(
+                        img_index,
+                        res_np[j, ...],
+                        img_h,
+                        img_w,
+                        obj_thresh=opts.obj_thresh,
+                        iou_thresh=opts.iou_thresh,
+                        min_class_confidence_threshold=opts.min_class_confidence_threshold,
+                    )
+                    self.np_results.append(parsed)
+
+        if self.tot_counts is not None or self.frame_counts is not None:
+            with stage_timers.stage("count", num_items=res.shape[0]):
+                image_idxs, classes, confidences = detections_per_frame(
+                    res,
+                    obj_thresh=opts.obj_thresh,
+                    iou_thresh=opts.iou_thresh,
+                    min_class_confidence_threshold=opts.min_class_confidence_threshold,
+                )
+                batch_frame_counts = _bincount_2d(
+                    image_idxs, classes, res.shape[0], num_classes
+                )
+
+                if self.tot_counts is not None:
+                    self.tot_counts += batch_frame_counts.sum(dim=0)
+
+                if (
+                    self.frame_counts is not None
+                    and self.confidence_histogram is not None
+                ):
+                    self.frame_counts[batch_start:batch_stop] = batch_frame_counts
+                    confidence_bins = (
+                        (confidences * opts.confidence_bins)
+                        .long()
+                        .clamp_(0, opts.confidence_bins - 1)
+                    )
+                    self.confidence_histogram += _bincount_2d(
+                        classes, confidence_bins, num_classes, opts.confidence_bins
+                    )
+
+        # sometimes we return a number of images less than the batch size,
+        # namely when len(image_dataset) % batch_size != 0
+        if self.results is not None:
+            self.results[batch_start:batch_stop, ...] = res.cpu()
+
+    def partial_results(self) -> _PartialResults:
+        return _PartialResults(
+            counts=self.tot_counts.cpu() if self.tot_counts is not None else None,
+            np_results=self.np_results,
+            full_predictions=self.results,
+            frame_counts=(
+                self.frame_counts.cpu() if self.frame_counts is not None else None
+            ),
+            confidence_histogram=(
+                self.confidence_histogram.cpu()
+                if self.confidence_histogram is not None
+                else None
+            ),
+        )
+
+
+def _run_batches(
+    models_and_sinks: Sequence[
+        Tuple[Callable[[torch.Tensor], torch.Tensor], _PredictionSink]
+    ],
+    dataloader: DataLoader,
+    opts: _InferenceOptions,
+    stage_timers: StageTimers,
+    on_batch: Callable[[int], None],
+) -> None:
+    """
+    Load each batch of the dataloader and move it to the device once, and run
+    every model on it, handing its predictions to its sink.
+    """
+    device = opts.device
+
+    file_iterator = enumerate(dataloader)
+    while True:
+        # attempting to be forgiving to malformed images, which sometimes occurs
+        # when exporting zip files
+        try:
+            with stage_timers.stage("load"):
+                i, (img_batch, fnames) = next(file_iterator)
+        except StopIteration:
+            break
+        except RuntimeError as e:
+            warnings.warn(f"got error {e}; continuing")
+            continue
+
+        with stage_timers.stage("host to device", num_items=img_batch.shape[0]):
+            img_batch_device = img_batch.to(device)
+
+        for model_jit, sink in models_and_sinks:
+            # gross! device-type is checked even if enabled=False, which means we
+            # have to just tell autocast that device type is always cuda.
+            with stage_timers.stage("forward", num_items=img_batch.shape[0]):
+                with torch.cuda.amp.autocast(
+                    enabled=opts.half and device.type == "cuda",
+                    dtype=torch.bfloat16,
+                ):
+                    res = model_jit(img_batch_device)
+
+            sink.consume(i, img_batch, img_batch_device, fnames, res)
+
+        on_batch(img_batch.shape[0])
+
+
+def _predict_batches(
+    model_jit: Callable[[torch.Tensor], torch.Tensor],
+    dataloader: DataLoader,
+    opts: _InferenceOptions,
+    index_offset: int,
+    stage_timers: StageTimers,
+    on_batch: Callable[[int], None],
+    label_writer: Optional[LabelFileWriter] = None,
+    image_writer: Optional[AnnotatedImageWriter] = None,
+) -> _PartialResults:
+    """
+    The inner loop of `predict`. `index_offset` is the index of the first image
+    of the dataloader in the full dataset, so image ids in the npy output are
+    global when we are only handed a shard of the dataset.
+
+    If `label_writer` is given, `--save-preds` files are handed to it, and if
+    `image_writer` is given, `--draw-boxes` images are handed to it. It is up to
+    the caller to flush them.
+    """
+    sink = _PredictionSink(
+        opts,
+        num_images=len(dataloader.dataset),  # type: ignore
+        index_offset=index_offset,
+        stage_timers=stage_timers,
+        label_writer=label_writer,
+        image_writer=image_writer,
+    )
+    _run_batches([(model_jit, sink)], dataloader, opts, stage_timers, on_batch)
+    return sink.partial_results()
+
+
+@dataclass
+class _TiledImage:
+    """detections of an image in tiled inference, gathered tile by tile"""
+
+    index: int
+    fname: str
+    hw: Tuple[int, int]
+    remaining_tiles: int
+    boxes: List[torch.Tensor]
+    preds: List[torch.Tensor]
+
+
+def _predict_tiled(
+    model_jit: Callable[[torch.Tensor], torch.Tensor],
+    dataset: Dataset,
+    opts: _InferenceOptions,
+    index_offset: int,
+    tile_overlap: int,
+    num_workers: int,
+    stage_timers: StageTimers,
+    on_images: Callable[[int], None],
+    on_step: Callable[[], None],
+    label_writer: Optional[LabelFileWriter] = None,
+) -> _PartialResults:
+    """
+    Like `_predict_batches`, but for images larger than the model's input: each
+    image is cut into overlapping tiles of the model's input size, and tiles
+    from consecutive images are run in batches of opts.batch_size. Once all of
+    an image's tiles have been run, its detections are mapped to image
+    coordinates, and duplicates from overlapping tiles are removed with NMS.
+
+    Only one image (plus one batch of tiles) is held at a time, so memory stays
+    bounded for very large images. Boxes in the outputs are relative to the
+    full image.
+
+    Batches of tiles don't line up with images, so `on_images` is called with
+    the number of images as they finish, and `on_step` after every batch of tiles.
+    """
+    device = opts.device
+    _, pred_dim, _, _ = opts.output_shape
+    num_classes = pred_dim - 5
+    tile_hw = opts.img_hw
+
+    np_results: List[npt.NDArray] = []
+    tot_counts = (
+        torch.zeros(num_classes, dtype=torch.long) if opts.count_predictions else None
+    )
+    frame_counts: Optional[torch.Tensor] = None
+    confidence_histogram: Optional[torch.Tensor] = None
+    if opts.save_frame_counts:
+        frame_counts = torch.zeros(
+            (len(dataset), num_classes), dtype=torch.int32  # type: ignore
+        )
+        confidence_histogram = torch.zeros(
+            (num_classes, opts.confidence_bins), dtype=torch.long
+        )
+
+    # batch_size=None yields unbatched images, which may differ in size
+    dataloader = DataLoader(
+        dataset, batch_size=None, shuffle=False, num_workers=num_workers
+    )
+
+    tiles: List[torch.Tensor] = []
+    tile_meta: List[Tuple[int, int, int]] = []
+    in_progress: Dict[int, _TiledImage] = {}
+
+    def finish_image(image: _TiledImage) -> None:
+        boxes = torch.cat(image.boxes) if image.boxes else torch.zeros((0, 4))
+        preds = torch.cat(image.preds) if image.preds else torch.zeros((0, pred_dim))
+        keep_idxs = merge_tile_predictions(boxes, preds, opts.iou_thresh)
+        boxes, preds = boxes[keep_idxs], preds[keep_idxs]
+
+        confidences, classes = preds[:, 5:].max(dim=1)
+        mask = confidences > opts.min_class_confidence_threshold
+        boxes, preds = boxes[mask], preds[mask]
+        confidences, classes = confidences[mask], classes[mask]
+
+        img_h, img_w = image.hw
+        if opts.save_preds:
+            assert opts.output_dir is not None
+            cxcywh = ops.box_convert(boxes, "xyxy", "cxcywh") / boxes.new_tensor(
+                [img_w, img_h, img_w, img_h]
+            )
+            pred_string = "\n".join(
+                f"{c} {xc} {yc} {w} {h}"
+                for c, (xc, yc, w, h) in zip(classes.tolist(), cxcywh.tolist())
+            )
+            out_fname = (
+                Path(opts.output_dir) / Path(image.fname).with_suffix(".txt").name
+            )
+            if label_writer is not None:
+                label_writer.write(out_fname, pred_string)
+            else:
+                with open(out_fname, "w") as f:
+                    f.write(pred_string)
+
+        if opts.save_npy or opts.save_columnar:
+            # same layout as `format_to_numpy`
+            n = len(preds)
+            np_results.append(
+                np.vstack(
+                    (
+                        np.full(n, index_offset + image.index, dtype=np.float32),
+                        boxes.T.numpy().astype(np.float32),
+                        preds[:, 4].numpy().astype(np.float32),
+                        classes.numpy().astype(np.float32),
+                        confidences.numpy().astype(np.float32),
+                        preds[:, 5:].T.numpy().astype(np.float32),
+                    )
+                )
+            )
+
+        image_counts = torch.bincount(classes, minlength=num_classes)
+        if tot_counts is not None:
+            tot_counts.add_(image_counts)
+        if frame_counts is not None and confidence_histogram is not None:
+            frame_counts[image.index] = image_counts
+            confidence_bins = (
+                (confidences * opts.confidence_bins)
+                .long()
+                .clamp_(0, opts.confidence_bins - 1)
+            )
+            confidence_histogram.add_(
+                _bincount_2d(
+                    classes, confidence_bins, num_classes, opts.confidence_bins
+                )
+            )
+
+    def run_tiles() -> None:
+        with stage_timers.stage("host to device", num_items=len(tiles)):
+            tile_batch = torch.stack(tiles).to(device)
+            meta = torch.tensor(tile_meta)
+
+        with stage_timers.stage("forward", num_items=len(tiles)):
+            with torch.cuda.amp.autocast(
+                enabled=opts.half and device.type == "cuda",
+                dtype=torch.bfloat16,
+            ):
+                res = model_jit(tile_batch)
+
+        with stage_timers.stage("merge tiles", num_items=len(tiles)):
+            tile_idxs, preds = format_preds_batched(
+                res.float(),
+                obj_thresh=opts.obj_thresh,
+                iou_thresh=opts.iou_thresh,
+                box_format="xyxy",
+                min_class_confidence_threshold=opts.min_class_confidence_threshold,
+            )
+            tile_idxs, preds = tile_idxs.cpu(), preds.cpu()
+
+            for image_index in meta[:, 0].unique().tolist():
+                image = in_progress[image_index]
+                image_tiles = meta[:, 0] == image_index
+                dets = image_tiles[tile_idxs]
+                image.boxes.append(
+                    tile_to_image_boxes(
+                        preds[dets, :4], meta[tile_idxs[dets], 1:], tile_hw, image.hw
+                    )
+                )
+                image.preds.append(preds[dets])
+                image.remaining_tiles -= int(image_tiles.sum())
+
+                if image.remaining_tiles == 0:
+                    finish_image(in_progress.pop(image_index))
+                    on_images(1)
+
+        tiles.clear()
+        tile_meta.clear()
+        on_step()
+
+    for i, (img, fname) in enumerate(dataloader):
+        _, img_h, img_w = img.shape
+        tile_positions = list(iter_tiles(img, tile_hw, tile_overlap))
+        in_progress[i] = _TiledImage(
+            index=i,
+            fname=fname,
+            hw=(img_h, img_w),
+            remaining_tiles=len(tile_positions),
+            boxes=[],
+            preds=[],
+        )
+        for tile, y0, x0 in tile_positions:
+            tiles.append(tile)
+            tile_meta.append((i, y0, x0))
+            if len(tiles) == opts.batch_size:
+                run_tiles()
+
+    if len(tiles) > 0:
+        run_tiles()
+
+    return _PartialResults(
+        counts=tot_counts,
+        np_results=np_results,
+        full_predictions=None,
+        frame_counts=frame_counts,
+        confidence_histogram=confidence_histogram,
+    )
+
+
+def _available_cores() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))  # type: ignore
+    return list(range(os.cpu_count() or 1))
+
+
+@torch.no_grad()
+def _predict_shard(
+    rank: int,
+    model: torch.nn.Module,
+    dataset_kwargs: Dict[str, Any],
+    index_range: Tuple[int, int],
+    cores: List[int],
+    opts: _InferenceOptions,
+    profile: bool,
+    progress,
+    result_queue,
+) -> None:
+    """
+    Entry point of each shard process of `_predict_sharded`. `model` arrives
+    with its weights in shared memory, so it is not copied per process.
+    """
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)  # type: ignore
+    torch.set_num_threads(len(cores))
+
+    stage_timers = StageTimers(enabled=profile)
+
+    dataset = Subset(
+        get_dataset(**dataset_kwargs, stage_timers=stage_timers),
+        range(*index_range),
+    )
+    dataloader = DataLoader(
+        dataset,
+        batch_size=opts.batch_size,
+        shuffle=False,
+        drop_last=False,
+        collate_fn=collate_fn,
+        num_workers=0,
+    )
+
+    def on_batch(num_images: int) -> None:
+        with progress.get_lock():
+            progress.value += num_images
+
+    label_writer: Optional[LabelFileWriter] = None
+    if opts.save_preds:
+        assert opts.output_dir is not None
+        label_writer = LabelFileWriter(opts.output_dir)
+    image_writer = (
+        # shards are daemonic, so they can't start a pool of their own
+        AnnotatedImageWriter(num_workers=0, compress_level=opts.compress_level)
+        if opts.draw_boxes
+        else None
+    )
+    try:
+        shard_results = _predict_batches(
+            model,
+            dataloader,
+            opts,
+            index_offset=index_range[0],
+            stage_timers=stage_timers,
+            on_batch=on_batch,
+            label_writer=label_writer,
+            image_writer=image_writer,
+        )
+    finally:
+        if label_writer is not None:
+            label_writer.close()
+        if image_writer is not None:
+            image_writer.close()
+
+    # tensors put on a torch.multiprocessing queue are shared, not copied, and
+    # must outlive the receiver's use of them. Send numpy arrays so that this
+    # process can exit as soon as it is done.
+    result_queue.put((rank, shard_results.to_numpy(), stage_timers))
+
+
+def _predict_sharded(
+    model: torch.nn.Module,
+    dataset_kwargs: Dict[str, Any],
+    index_range: Tuple[int, int],
+    procs: int,
+    opts: _InferenceOptions,
+    stage_timers: StageTimers,
+    pbar: tqdm,
+) -> List[_PartialResults]:
+    """
+    Split `index_range` into `procs` contiguous ranges, and run each in its
+    own process pinned to its own slice of cores. Results are returned in
+    index order, so they can be merged as if from a single process.
+    """
+    cores = _available_cores()
+    if procs > len(cores):
+        warnings.warn(
+            f"requested {procs} processes, but only {len(cores)} cores are "
+            f"available; using {len(cores)} processes"
+        )
+        procs = len(cores)
+
+    bounds = np.linspace(*index_range, procs + 1).astype(int)
+    index_ranges = [
+        (int(start), int(stop))
+        for start, stop in zip(bounds[:-1], bounds[1:])
+        if stop > start
+    ]
+    core_slices = [
+        [int(c) for c in core_slice]
+        for core_slice in np.array_split(cores, len(index_ranges))
+    ]
+
+    model.share_memory()
+
+    ctx = torch.multiprocessing.get_context("spawn")
+    progress = ctx.Value("q", 0)
+    result_queue = ctx.Queue()
+
+    processes = [
+        ctx.Process(
+            target=_predict_shard,
+            args=(
+                rank,
+                model,
+                dataset_kwargs,
+                index_range,
+                core_slice,
+                opts,
+                stage_timers.enabled,
+                progress,
+                result_queue,
+            ),
+            daemon=True,
+        )
+        for rank, (index_range, core_slice) in enumerate(zip(index_ranges, core_slices))
+    ]
+    for p in processes:
+        p.start()
+
+    partials: Dict[int, _PartialResults] = {}
+    try:
+        while len(partials) < len(processes):
+            try:
+                rank, shard_results, timers = result_queue.get(timeout=0.5)
+            except queue.Empty:
+                failed = [p for p in processes if p.exitcode not in (None, 0)]
+                if len(failed) > 0:
+                    raise RuntimeError(
+                        f"{len(failed)} inference process(es) failed "
+                        f"(exit codes {[p.exitcode for p in failed]})"
+                    )
+            else:
+                partials[rank] = _PartialResults.from_numpy(shard_results)
+                stage_timers.merge(timers)
+            finally:
+                pbar.update(progress.value - pbar.n)
+    finally:
+        for p in processes:
+            if len(partials) < len(processes):
+                p.terminate()
+            p.join()
+
+    return [partials[rank] for rank in sorted(partials)]
+
+
+class _ResizeInput(torch.nn.Module):
+    """resize a batch of images to `size` on their device, before the model"""
+
+    def __init__(self, size: Tuple[int, int]):
+        super().__init__()
+        self.size = size
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        if x.ndim == 3:
+            x = x.unsqueeze(0)
+        return torch.nn.functional.interpolate(
+            x.float(), size=self.size, mode="bilinear", antialias=True
+        )
+
+
+TTAFlip = Literal["h", "v", "hv"]
+
+
+class _FlipTTA(torch.nn.Module):
+    """
+    Flip test-time augmentation. The images and their flipped copies are
+    stacked into one batch for a single forward pass; the predictions of the
+    copies are un-flipped on the device and averaged with the predictions of
+    the originals, so that the result is formatted (and NMS'd) as usual.
+    """
+
+    _flip_dims = {"h": (3,), "v": (2,), "hv": (2, 3)}
+
+    def __init__(self, model: torch.nn.Module, flips: Sequence[TTAFlip]):
+        super().__init__()
+        for flip in flips:
+            if flip not in get_args(TTAFlip):
+                raise ValueError(
+                    f"invalid flip {flip}; valid flips are {get_args(TTAFlip)}"
+                )
+        self.model = model
+        self.flips = tuple(flips)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        if x.ndim == 3:
+            x = x.unsqueeze(0)
+
+        copies = [x] + [torch.flip(x, dims=self._flip_dims[f]) for f in self.flips]
+        preds = self.model(torch.cat(copies)).chunk(len(copies))
+
+        merged = preds[0]
+        for flip, flipped_preds in zip(self.flips, preds[1:]):
+            # predictions are (x, y, w, h, objectness, *classes)
+            if "h" in flip:
+                flipped_preds = hflip_grid(flipped_preds, x_channels=(0,))
+            if "v" in flip:
+                flipped_preds = vflip_grid(flipped_preds, y_channels=(1,))
+            merged = merged + flipped_preds
+
+        return merged / len(copies)
+
+
+class YOGOPredictor:
+    """
+    A YOGO model that is ready for inference: loaded from a pth file, resized
+    for `vertical_crop_height` and `scale_factor`, moved to `device`, and
+    compiled (on cuda).
+
+    With a scale_factor below 1, images are downsampled on the device before
+    the model, which is faster, at some cost in accuracy for small objects.
+    Predictions are still normalized to the (cropped) image, and `img_h` and
+    `img_w` are the size of the image before downsampling.
+
+    With `tta_flips`, predictions are averaged over flipped copies of each
+    image (see `_FlipTTA`), which costs a forward pass over 1 + len(tta_flips)
+    times as many images.
+
+    Loading and compiling is slow relative to inference on a small dataset,
+    so when running many datasets, create one predictor and pass it to
+    `predict` in place of the pth path.
+    """
+
+    @torch.no_grad()
+    def __init__(
+        self,
+        path_to_pth: Union[str, Path],
+        device: Optional[Union[str, torch.device]] = None,
+        vertical_crop_height: Optional[float] = None,
+        scale_factor: float = 1.0,
+        tta_flips: Sequence[TTAFlip] = (),
+    ):
+        self.path_to_pth = Path(path_to_pth)
+        self.device = torch.device(device or choose_device())
+        self.vertical_crop_height = vertical_crop_height
+        self.scale_factor = scale_factor
+        self.tta_flips = tuple(tta_flips)
+        self.model_name = get_model_name_from_pth(self.path_to_pth)
+
+        model, cfg = YOGO.from_pth(self.path_to_pth, inference=True)
+        model.eval()
+        model.to(self.device)
+
+        self.transforms: List[torch.nn.Module] = []
+
+        img_h, img_w = model.get_img_size()
+        if vertical_crop_height:
+            vertical_crop_height_px = (vertical_crop_height * img_h).round()
+            crop = CenterCrop((int(vertical_crop_height_px.item()), int(img_w.item())))
+            self.transforms.append(crop)
+            img_h = vertical_crop_height_px
+
+        self.img_h, self.img_w = int(img_h.item()), int(img_w.item())
+
+        if vertical_crop_height or scale_factor != 1:
+            model.resize_model(self.img_h, self.img_w, scale_factor=scale_factor)
+
+        # these three lines are correctly typed; dunno how to convince mypy
+        assert model.img_size.numel() == 2, f"YOGO model must be 2D, is {model.img_size}"  # type: ignore
+        img_in_h = int(model.img_size[0].item())  # type: ignore
+        img_in_w = int(model.img_size[1].item())  # type: ignore
+
+        # the model that inference runs, which takes images of size
+        # (img_h, img_w), and downsamples them if needed
+        self.inference_model: torch.nn.Module = model
+        if len(self.tta_flips) > 0:
+            self.inference_model = _FlipTTA(model, self.tta_flips)
+        if (img_in_h, img_in_w) != (self.img_h, self.img_w):
+            self.inference_model = torch.nn.Sequential(
+                _ResizeInput((img_in_h, img_in_w)), self.inference_model
+            )
+
+        dummy_input = torch.randint(
+            0, 256, (1, 1, self.img_h, self.img_w), device=self.device
+        )
+
+        self.model = model
+        if self.device.type == "cuda":
+            # TODO expand accepted device types!
+            self.model_jit = torch.compile(self.inference_model)
+        else:
+            self.model_jit = self.inference_model
+
+        self.output_shape = tuple(self.model_jit(dummy_input).shape)
+        self.num_classes = self.output_shape[1] - 5
+        self.normalize_images = bool(model.normalize_images)
+
+
+def uncertain_frames(
+    batch_preds: torch.Tensor,
+    obj_thresh: float = 0.5,
+    objectness_margin: float = 0.2,
+    min_class_confidence: float = 0.9,
+) -> torch.Tensor:
+    """
+    returns a (batch size,) bool tensor of the images of batch_preds that have
+    a cell with borderline objectness (within objectness_margin of
+    obj_thresh), or a cell over obj_thresh whose top class confidence is
+    below min_class_confidence
+    """
+    objectness = batch_preds[:, 4]
+    class_confidence = batch_preds[:, 5:].max(dim=1).values
+    borderline = (objectness - obj_thresh).abs() < objectness_margin
+    unsure_class = (objectness > obj_thresh) & (class_confidence < min_class_confidence)
+    return (borderline | unsure_class).flatten(start_dim=1).any(dim=1)
+
+
+class _CascadeModel:
+    """
+    Cascade inference: `fast_model` runs on every image, and only the images
+    that it is uncertain about (see `uncertain_frames`) are run again through
+    `escalation_model`, whose predictions replace the fast model's. Both
+    models must have the same output shape.
+
+    To report on the cascade, the class counts of both models on escalated
+    images are kept on the device.
+    """
+
+    def __init__(
+        self,
+        fast_model: Callable[[torch.Tensor], torch.Tensor],
+        escalation_model: Callable[[torch.Tensor], torch.Tensor],
+        num_classes: int,
+        device: torch.device,
+        obj_thresh: float = 0.5,
+        iou_thresh: float = 0.5,
+        min_class_confidence_threshold: float = 0.0,
+        objectness_margin: float = 0.2,
+        min_class_confidence: float = 0.9,
+    ):
+        self.fast_model = fast_model
+        self.escalation_model = escalation_model
+        self.obj_thresh = obj_thresh
+        self.iou_thresh = iou_thresh
+        self.min_class_confidence_threshold = min_class_confidence_threshold
+        self.objectness_margin = objectness_margin
+        self.min_class_confidence = min_class_confidence
+
+        self.num_images = 0
+        self.num_escalated = 0
+        self.fast_counts = torch.zeros(num_classes, dtype=torch.long, device=device)
+        self.escalated_counts = torch.zeros(
+            num_classes, dtype=torch.long, device=device
+        )
+
+    def _counts(self, batch_preds: torch.Tensor) -> torch.Tensor:
+        return count_predictions_per_frame(
+            batch_preds.float(),
+            obj_thresh=self.obj_thresh,
+            iou_thresh=self.iou_thresh,
+            min_class_confidence_threshold=self.min_class_confidence_threshold,
+        ).sum(dim=0)
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        preds = self.fast_model(x)
+
+        idxs = torch.nonzero(
+            uncertain_frames(
+                preds,
+                obj_thresh=self.obj_thresh,
+                objectness_margin=self.objectness_margin,
+                min_class_confidence=self.min_class_confidence,
+            )
+        ).squeeze(1)
+
+        self.num_images += len(preds)
+        self.num_escalated += len(idxs)
+
+        if len(idxs) > 0:
+            escalated_preds = self.escalation_model(x[idxs]).to(preds.dtype)
+            self.fast_counts += self._counts(preds[idxs])
+            self.escalated_counts += self._counts(escalated_preds)
+            preds = preds.index_copy(0, idxs, escalated_preds)
+
+        return preds
+
+    def report(self) -> Dict[str, Any]:
+        """
+        the fraction of images that were escalated, and how well the fast
+        model's class counts on those images agreed with the escalation
+        model's: 1 - |fast - escalated| / escalated, per class
+        """
+        fast_counts = self.fast_counts.cpu()
+        escalated_counts = self.escalated_counts.cpu()
+        count_diff = (fast_counts - escalated_counts).abs()
+        agreement = 1 - count_diff / escalated_counts.clamp(min=1)
+        return {
+            "num_images": self.num_images,
+            "num_escalated": self.num_escalated,
+            "escalated_fraction": self.num_escalated / max(self.num_images, 1),
+            "fast_counts_on_escalated": fast_counts.tolist(),
+            "escalation_counts_on_escalated": escalated_counts.tolist(),
+            "count_agreement_on_escalated": agreement.tolist(),
+        }
+
+
+def _get_predictor(
+    path_to_pth: Union[str, Path, YOGOPredictor],
+    device: torch.device,
+    **predictor_kwargs: Any,
+) -> YOGOPredictor:
+    """
+    load a YOGOPredictor, or check that an already loaded one was loaded with
+    predictor_kwargs
+    """
+    if not isinstance(path_to_pth, YOGOPredictor):
+        return YOGOPredictor(path_to_pth, device=device, **predictor_kwargs)
+
+    predictor = path_to_pth
+    for name, value in predictor_kwargs.items():
+        if getattr(predictor, name) != value:
+            raise ValueError(
+                f"predictor was loaded with {name}={getattr(predictor, name)}, "
+                f"but {name}={value} was requested"
+            )
+    return predictor
+
+
+def _write_npy(
+    fp: Path,
+    pred_tensors: npt.NDArray,
+    predictor: YOGOPredictor,
+    obj_thresh: float,
+    iou_thresh: float,
+    stage_timers: StageTimers,
+) -> None:
+    """save `--save-npy` results to fp, with a json of metadata next to it"""
+    with stage_timers.stage("write npy"):
+        np.save(fp, pred_tensors)
+
+    write_metadata(
+        fp.with_suffix(".json"),
+        run_name=fp.with_suffix("").name,
+        model_name=predictor.model_name,
+        obj_thresh=obj_thresh,
+        iou_thresh=iou_thresh,
+        vertical_crop_height_px=predictor.img_h,
+        write_date=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    )
+
+
+def _model_output_names(predictors: Sequence[YOGOPredictor]) -> List[str]:
+    """
+    names of the output subdirectories of several models: the model name
+    (or the pth file's stem, if the model has no name), prefixed with the
+    index of the model if the names aren't unique
+    """
+    names = [p.model_name or p.path_to_pth.stem for p in predictors]
+    if len(set(names)) < len(names):
+        names = [f"{i}_{name}" for i, name in enumerate(names)]
+    return names
+
+
+@torch.no_grad()
+def _predict_multi_model(
+    paths_to_pth: Sequence[Union[str, Path, YOGOPredictor]],
+    *,
+    path_to_images: Optional[Path],
+    path_to_zarr: Optional[Path],
+    image_dataset: Optional[ImageAndIdDataset],
+    output_dir: Optional[str],
+    save_preds: bool,
+    save_npy: bool,
+    count_predictions: bool,
+    class_names: Optional[List[str]],
+    batch_size: int,
+    obj_thresh: float,
+    iou_thresh: float,
+    min_class_confidence_threshold: float,
+    half: bool,
+    use_tqdm: bool,
+    device: torch.device,
+    requested_num_workers: Optional[int],
+    predictor_kwargs: Dict[str, Any],
+    stage_timers: StageTimers,
+) -> None:
+    """
+    `predict` for several models on the same images. Each batch is loaded and
+    moved to the device once, and every model is run on it. The outputs of
+    each model go to their own subdirectory of output_dir (see
+    `_model_output_names`).
+    """
+    predictors = [_get_predictor(p, device, **predictor_kwargs) for p in paths_to_pth]
+
+    first = predictors[0]
+    for predictor in predictors[1:]:
+        if (predictor.img_h, predictor.img_w) != (first.img_h, first.img_w) or (
+            predictor.normalize_images != first.normalize_images
+        ):
+            raise ValueError(
+                f"{predictor.path_to_pth} and {first.path_to_pth} take different "
+                "images (size or normalization), so they can't share a data loader"
+            )
+        elif class_names is not None and predictor.num_classes != len(class_names):
+            raise ValueError(
+                f"expected {predictor.num_classes} class names for "
+                f"{predictor.path_to_pth}, got {len(class_names)}"
+            )
+
+    model_names = _model_output_names(predictors)
+    model_output_dirs: List[Optional[Path]] = [None for _ in predictors]
+    if output_dir is not None:
+        for i, name in enumerate(model_names):
+            model_dir = Path(output_dir) / name
+            model_dir.mkdir(exist_ok=True)
+            model_output_dirs[i] = model_dir
+
+    if image_dataset is None:
+        image_dataset = get_dataset(
+            path_to_images=path_to_images,
+            path_to_zarr=path_to_zarr,
+            image_transforms=first.transforms,
+            normalize_images=first.normalize_images,
+            stage_timers=stage_timers,
+        )
+
+    num_workers = (
+        0
+        if isinstance(image_dataset, ZarrDataset)
+        else choose_dataloader_num_workers(
+            len(image_dataset), requested_num_workers=requested_num_workers
+        )
+    )
+
+    label_writers: List[Optional[LabelFileWriter]] = [
+        LabelFileWriter(model_output_dir) if save_preds and model_output_dir else None
+        for model_output_dir in model_output_dirs
+    ]
+
+    sinks: List[_PredictionSink] = []
+    for predictor, model_output_dir, label_writer in zip(
+        predictors, model_output_dirs, label_writers
+    ):
+        opts = _InferenceOptions(
+            batch_size=batch_size,
+            device=device,
+            half=half,
+            draw_boxes=False,
+            save_preds=save_preds,
+            save_npy=save_npy,
+            save_columnar=False,
+            save_frame_counts=False,
+            confidence_bins=0,
+            compress_level=1,
+            count_predictions=count_predictions,
+            return_full_predictions=False,
+            output_dir=str(model_output_dir) if model_output_dir else None,
+            output_img_ftype=".png",
+            obj_thresh=obj_thresh,
+            iou_thresh=iou_thresh,
+            min_class_confidence_threshold=min_class_confidence_threshold,
+            class_names=class_names,
+            images_are_normalized=predictor.normalize_images,
+            img_hw=(predictor.img_h, predictor.img_w),
+            output_shape=tuple(predictor.output_shape),
+        )
+        sinks.append(
+            _PredictionSink(
+                opts,
+                num_images=len(image_dataset),
+                index_offset=0,
+                stage_timers=stage_timers,
+                label_writer=label_writer,
+            )
+        )
+
+    dataloader = DataLoader(
+        image_dataset,
+        batch_size=batch_size,
+        shuffle=False,
+        drop_last=False,
+        pin_memory=True,
+        collate_fn=collate_fn,
+        num_workers=num_workers,
+    )
+
+    pbar = tqdm(disable=not use_tqdm, unit="images", total=len(image_dataset))
+    try:
+        _run_batches(
+            [(predictor.model_jit, sink) for predictor, sink in zip(predictors, sinks)],
+            dataloader,
+            sinks[0].opts,
+            stage_timers,
+            on_batch=pbar.update,
+        )
+    finally:
+        for label_writer in label_writers:
+            if label_writer is not None:
+                label_writer.close()
+        pbar.close()
+
+    run_name = _run_name(path_to_images, path_to_zarr)
+    for predictor, name, model_output_dir, sink in zip(
+        predictors, model_names, model_output_dirs, sinks
+    ):
+        results = sink.partial_results()
+
+        if results.counts is not None:
+            counts = zip(class_names or range(predictor.num_classes), results.counts)
+            print(f"{name}: {[(c, int(n)) for c, n in counts]}")
+
+        if save_npy:
+            npy_dir = model_output_dir or Path.cwd() / name
+            npy_dir.mkdir(exist_ok=True)
+            _write_npy(
+                npy_dir.resolve() / f"{run_name or name}.npy",
+                np.hstack(results.np_results),
+                predictor,
+                obj_thresh,
+                iou_thresh,
+                stage_timers,
+            )
+
+
 @torch.no_grad()
 def predict(
-    path_to_pth: str,
+    path_to_pth: Union[
+        str, Path, YOGOPredictor, Sequence[Union[str, Path, YOGOPredictor]]
+    ],
     *,
     path_to_images: Optional[Path] = None,
     path_to_zarr: Optional[Path] = None,
+    image_dataset: Optional[ImageAndIdDataset] = None,
     output_dir: Optional[str] = None,
     draw_boxes: bool = False,
     save_preds: bool = False,
     save_npy: bool = False,
+    save_columnar: bool = False,
+    preds_archive: Optional[ArchiveFormat] = None,
+    draw_boxes_compress_level: int = 1,
+    render_workers: Optional[int] = None,
+    save_frame_counts: bool = False,
+    count_window: Optional[int] = None,
+    confidence_bins: int = 20,
     class_names: Optional[List[str]] = None,
     count_predictions: bool = False,
     batch_size: int = 64,
     obj_thresh: float = 0.5,
     iou_thresh: float = 0.5,
-    vertical_crop_height: Optional[int] = None,
+    vertical_crop_height: Optional[float] = None,
+    scale_factor: float = 1.0,
+    tta_flips: Sequence[TTAFlip] = (),
+    cascade_pth: Optional[Union[str, Path, YOGOPredictor]] = None,
+    cascade_objectness_margin: float = 0.2,
+    cascade_class_confidence: float = 0.9,
     use_tqdm: bool = False,
     device: Optional[Union[str, torch.device]] = None,
     output_img_ftype: Literal[".png", ".tif", ".tiff"] = ".png",
@@ -159,6 +1482,12 @@ def predict(
     min_class_confidence_threshold: float = 0.0,
     half: bool = False,
     return_full_predictions: bool = False,
+    profile: bool = False,
+    trace_steps: Optional[Tuple[int, int]] = None,
+    procs: int = 1,
+    tile_overlap: Optional[int] = None,
+    resume: bool = False,
+    checkpoint_every: Optional[int] = None,
 ) -> Optional[torch.Tensor]:
     """
     This is a bit of a gargantuan function. It handles `yogo infer` as well as
@@ -168,20 +1497,52 @@ def predict(
     Mostly, see `yogo infer --help` for the help. Here is a recapitulation (plus
     some extras):
 
-        path_to_pth: path to .pth file defining the model
+        path_to_pth: path to .pth file defining the model, or a YOGOPredictor that is already loaded.
+                     A list of several models runs all of them on each batch, so that images are
+                     loaded once; the outputs of each model go to OUTPUT_DIR/<model name>. Only
+                     save_preds, save_npy, and count_predictions are supported for several models
         path_to_images: path to image or images; if path_to_images is not None, path_to_zarr must be None
         path_to_zarr: path to zarr file; if path_to_zarr is not None, path_to_images must be None
+        image_dataset: dataset for path_to_images / path_to_zarr, if it has already been created
+                       (e.g. prefetched); it must use the predictor's transforms
         output_dir: directory to save predictions or draw-boxes in YOGO format
         output_img_ftype: output image filetype for bounding boxes
         draw_boxes: whether to draw boxes in YOGO format
+        draw_boxes_compress_level: png compression level (0-9) of draw_boxes images
+        render_workers: number of processes that encode draw_boxes images; defaults to the
+                        number of cpus, up to 8. 0 (and procs > 1) encodes images in the
+                        process that runs the model
         save_preds: whether to save predictions in YOGO format
         save_npy: whether to save predictions in .npy format
+        preds_archive: "tar" or "zip" to write save_preds label files into one archive in
+                       output_dir instead of one file per image
+        save_frame_counts: whether to save the class counts of every image, computed on the device,
+                           to a zarr group in output_dir (see yogo.utils.frame_counts)
+        count_window: if given with save_frame_counts, also save counts over the trailing
+                      `count_window` images, ending at each image
+        confidence_bins: number of bins of the per-class confidence histogram saved with
+                         save_frame_counts
+        save_columnar: whether to save predictions as typed columns in one zarr group, with
+                       per-image offsets for random access (see yogo.utils.columnar_predictions)
         class_names: list of class names
         count_predictions: whether to count the number of predictions
         batch_size: batch size
         obj_thresh: object threshold
         iou_thresh: iou threshold
-        vertical_crop_height: vertical crop height
+        vertical_crop_height: crop images vertically to this fraction (in (0, 1]) of their height
+        scale_factor: downsample images by this factor (in (0, 1]) on the device before the model,
+                      trading accuracy for speed; see `yogo eval-scales` to pick one
+        tta_flips: flips ("h", "v", and/or "hv") of each image to average predictions over, in the
+                   same forward pass as the image. Each flip adds a batch_size worth of images to
+                   every forward pass
+        cascade_pth: path to .pth file (or loaded YOGOPredictor) of a larger model to cascade to.
+                     path_to_pth screens every image, and images that it is uncertain about are
+                     run again through the cascade model, whose predictions are used instead.
+                     A report of the escalated fraction is printed, and written to output_dir
+        cascade_objectness_margin: escalate images with a cell whose objectness is within this
+                                   margin of obj_thresh
+        cascade_class_confidence: escalate images with a prediction whose top class confidence is
+                                  below this
         use_tqdm: whether to use tqdm
         device: device to run infer on
         requested_num_workers: number of workers to use
@@ -189,57 +1550,173 @@ def predict(
         half: whether to use half precision
         return_full_predictions: whether to return full predictions; useful for getting YOGO predictions
                                  from python
+        profile: whether to time each stage of inference; prints a summary and writes a json report
+                 to output_dir (or the current directory)
+        trace_steps: (start, stop) range of batches to capture with torch.profiler; the trace is
+                     written to output_dir (or the current directory)
+        procs: number of processes to split inference across (cpu only). Each process is pinned
+               to a slice of the available cores and reads the model weights from shared memory
+        tile_overlap: if given, images larger than the model's input are cut into model-sized tiles
+                      that overlap by at least this many pixels. Detections are mapped back to the
+                      full image, and duplicates from overlapping tiles are removed with NMS
+        resume: continue an interrupted run from the progress recorded in output_dir, instead of
+                starting over
+        checkpoint_every: when output_dir is given, record progress after every `checkpoint_every`
+                          images, so that the run can be resumed. If None, progress is only
+                          recorded when resuming (every DEFAULT_CHECKPOINT_EVERY images), and
+                          other runs go through the images in one pass
     """
     if save_preds and draw_boxes:
         raise ValueError(
             "cannot save predictions in YOGO format and draw_boxes at the same time"
         )
-    elif output_dir is not None and not (save_preds or draw_boxes or save_npy):
+    elif output_dir is not None and not (
+        save_preds or draw_boxes or save_npy or save_columnar or save_frame_counts
+    ):
         warnings.warn(
             f"output dir is not None (is {output_dir}), but it will not be used "
             "since save_preds and draw_boxes are both false"
         )
     elif output_dir is not None:
         Path(output_dir).mkdir(exist_ok=True, parents=False)
-    elif save_preds:
-        raise ValueError("output_dir must not be None if save_preds is True")
+    elif save_preds or save_columnar or save_frame_counts:
+        raise ValueError(
+            "output_dir must not be None if save_preds, save_columnar, or "
+            "save_frame_counts is True"
+        )
     elif output_img_ftype not in [".png", ".tif", ".tiff"]:
         raise ValueError(
             "only .png, .tif, and .tiff are supported for output img "
             "filetype; got {output_img_ftype}"
         )
 
-    device = torch.device(device or choose_device())
+    if resume and output_dir is None:
+        raise ValueError("resume requires an output_dir to record progress in")
+    elif resume and return_full_predictions:
+        raise ValueError("can't resume a run with return_full_predictions")
+
+    if tile_overlap is not None:
+        if vertical_crop_height is not None:
+            raise ValueError("can't crop images (vertical_crop_height) when tiling")
+        elif draw_boxes:
+            raise ValueError("draw_boxes is not supported when tiling")
+        elif return_full_predictions:
+            raise ValueError(
+                "return_full_predictions is not supported when tiling, since "
+                "images are not the model's input size"
+            )
+        elif procs > 1:
+            raise ValueError("procs > 1 is not supported when tiling")
+
+    if cascade_pth is not None and procs > 1:
+        raise ValueError("procs > 1 is not supported with cascade_pth")
+
+    if preds_archive is not None:
+        if not save_preds:
+            raise ValueError("preds_archive requires save_preds")
+        elif procs > 1:
+            raise ValueError("preds_archive is not supported with procs > 1")
+        elif resume and preds_archive == "zip":
+            raise ValueError("can't resume into a zip archive; use a tar archive")
+
+    paths_to_pth = list(path_to_pth) if isinstance(path_to_pth, (list, tuple)) else None
+    if paths_to_pth is not None:
+        unsupported = {
+            "draw_boxes": draw_boxes,
+            "save_columnar": save_columnar,
+            "save_frame_counts": save_frame_counts,
+            "preds_archive": preds_archive is not None,
+            "return_full_predictions": return_full_predictions,
+            "tile_overlap": tile_overlap is not None,
+            "procs > 1": procs > 1,
+            "resume": resume,
+            "cascade_pth": cascade_pth is not None,
+            "trace_steps": trace_steps is not None,
+        }
+        if any(unsupported.values()):
+            raise ValueError(
+                f"{', '.join(k for k, v in unsupported.items() if v)} "
+                "not supported when predicting with several models"
+            )
+        elif len(paths_to_pth) == 0:
+            raise ValueError("no models given")
 
-    model, cfg = YOGO.from_pth(Path(path_to_pth), inference=True)
-    model.eval()
-    model.to(device)
+    first_pth = paths_to_pth[0] if paths_to_pth is not None else path_to_pth
+    if isinstance(first_pth, YOGOPredictor):
+        device = first_pth.device
+    else:
+        device = torch.device(device or choose_device())
 
-    transforms: List[torch.nn.Module] = []
+    if procs > 1:
+        if device.type != "cpu":
+            raise ValueError(f"procs > 1 is only supported on cpu; device is {device}")
+        elif draw_boxes and output_dir is None:
+            raise ValueError(
+                "cannot show images (draw_boxes without output_dir) with procs > 1"
+            )
+        elif trace_steps is not None:
+            warnings.warn("trace_steps is ignored when procs > 1")
 
-    img_h, img_w = model.get_img_size()
-    if vertical_crop_height:
-        vertical_crop_height_px = (vertical_crop_height * img_h).round()
-        crop = CenterCrop((int(vertical_crop_height_px.item()), int(img_w.item())))
-        transforms.append(crop)
-        model.resize_model(int(vertical_crop_height_px.item()))
-        img_h = vertical_crop_height_px
+    stage_timers = StageTimers(enabled=profile, device=device)
 
-    # these three lines are correctly typed; dunno how to convince mypy
-    assert model.img_size.numel() == 2, f"YOGO model must be 2D, is {model.img_size}"  # type: ignore
-    img_in_h = int(model.img_size[0].item())  # type: ignore
-    img_in_w = int(model.img_size[1].item())  # type: ignore
+    predictor_kwargs: Dict[str, Any] = dict(
+        vertical_crop_height=vertical_crop_height,
+        scale_factor=scale_factor,
+        tta_flips=tuple(tta_flips),
+    )
 
-    dummy_input = torch.randint(0, 256, (1, 1, img_in_h, img_in_w), device=device)
+    if paths_to_pth is not None:
+        _predict_multi_model(
+            paths_to_pth,
+            path_to_images=path_to_images,
+            path_to_zarr=path_to_zarr,
+            image_dataset=image_dataset,
+            output_dir=output_dir,
+            save_preds=save_preds,
+            save_npy=save_npy,
+            count_predictions=count_predictions,
+            class_names=class_names,
+            batch_size=batch_size,
+            obj_thresh=obj_thresh,
+            iou_thresh=iou_thresh,
+            min_class_confidence_threshold=min_class_confidence_threshold,
+            half=half,
+            use_tqdm=use_tqdm,
+            device=device,
+            requested_num_workers=requested_num_workers,
+            predictor_kwargs=predictor_kwargs,
+            stage_timers=stage_timers,
+        )
+        if profile:
+            print(stage_timers.summary())
+        return None
 
-    if device.type == "cuda":
-        # TODO expand accepted device types!
-        model_jit = torch.compile(model)
-    else:
-        model_jit = model
+    predictor = _get_predictor(path_to_pth, device, **predictor_kwargs)  # type: ignore
+
+    model, model_jit = predictor.inference_model, predictor.model_jit
+    output_shape, num_classes = predictor.output_shape, predictor.num_classes
 
-    output_shape = model_jit(dummy_input).shape
-    num_classes = output_shape[1] - 5
+    cascade: Optional[_CascadeModel] = None
+    escalation_predictor: Optional[YOGOPredictor] = None
+    if cascade_pth is not None:
+        escalation_predictor = _get_predictor(cascade_pth, device, **predictor_kwargs)
+        if escalation_predictor.output_shape != output_shape:
+            raise ValueError(
+                f"cascade model has output shape {escalation_predictor.output_shape}, "
+                f"but the model has output shape {output_shape}"
+            )
+        cascade = _CascadeModel(
+            model_jit,
+            escalation_predictor.model_jit,
+            num_classes=num_classes,
+            device=device,
+            obj_thresh=obj_thresh,
+            iou_thresh=iou_thresh,
+            min_class_confidence_threshold=min_class_confidence_threshold,
+            objectness_margin=cascade_objectness_margin,
+            min_class_confidence=cascade_class_confidence,
+        )
+        model_jit = cascade
 
     if class_names is not None:
         if len(class_names) != num_classes:
@@ -247,14 +1724,19 @@ def predict(
                 f"expected {num_classes} class names, got {len(class_names)}"
             )
 
-    image_dataset = get_dataset(
+    dataset_kwargs: Dict[str, Any] = dict(
         path_to_images=path_to_images,
         path_to_zarr=path_to_zarr,
-        image_transforms=transforms,
-        normalize_images=bool(model.normalize_images),
+        image_transforms=predictor.transforms,
+        normalize_images=predictor.normalize_images,
     )
+    if image_dataset is None:
+        image_dataset = get_dataset(**dataset_kwargs, stage_timers=stage_timers)
 
-    if isinstance(image_dataset, ZarrDataset):
+    if procs > 1:
+        # each shard reads its own images, so there is no need for dataloader workers
+        num_workers = 0
+    elif isinstance(image_dataset, ZarrDataset):
         warnings.warn(
             "There is some bug with multiprocessed reading "
             "of a zarr array that hasn't yet been squashed. "
@@ -268,14 +1750,28 @@ def predict(
             len(image_dataset), requested_num_workers=requested_num_workers
         )
 
-    image_dataloader = DataLoader(
-        image_dataset,
+    opts = _InferenceOptions(
         batch_size=batch_size,
-        shuffle=False,
-        drop_last=False,
-        pin_memory=True,
-        collate_fn=collate_fn,
-        num_workers=num_workers,
+        device=device,
+        half=half,
+        draw_boxes=draw_boxes,
+        save_preds=save_preds,
+        save_npy=save_npy,
+        save_columnar=save_columnar,
+        save_frame_counts=save_frame_counts,
+        confidence_bins=confidence_bins,
+        compress_level=draw_boxes_compress_level,
+        count_predictions=count_predictions,
+        return_full_predictions=return_full_predictions,
+        output_dir=output_dir,
+        output_img_ftype=output_img_ftype,
+        obj_thresh=obj_thresh,
+        iou_thresh=iou_thresh,
+        min_class_confidence_threshold=min_class_confidence_threshold,
+        class_names=class_names,
+        images_are_normalized=predictor.normalize_images,
+        img_hw=(predictor.img_h, predictor.img_w),
+        output_shape=tuple(output_shape),
     )
 
     pbar = tqdm(
@@ -284,137 +1780,368 @@ def predict(
         total=len(image_dataset),
     )
 
-    # this tensor can be really big, so only create it if we need it
-    if return_full_predictions:
-        results = torch.zeros(
-            (len(image_dataset), output_shape[1], output_shape[2], output_shape[3]),
+    # full predictions are only kept in memory, so there is nothing to resume
+    progress: Optional[InferenceProgress] = None
+    if (
+        (resume or checkpoint_every is not None)
+        and output_dir is not None
+        and (
+            save_preds
+            or save_npy
+            or save_columnar
+            or save_frame_counts
+            or draw_boxes
+            or count_predictions
+        )
+        and not return_full_predictions
+    ):
+        progress = InferenceProgress(
+            Path(output_dir) / PROGRESS_DIR_NAME,
+            run_config=dict(
+                path_to_pth=str(Path(predictor.path_to_pth).resolve()),
+                path_to_images=str(path_to_images),
+                path_to_zarr=str(path_to_zarr),
+                num_images=len(image_dataset),
+                vertical_crop_height=vertical_crop_height,
+                scale_factor=scale_factor,
+                tta_flips=list(tta_flips),
+                cascade_pth=(
+                    str(Path(escalation_predictor.path_to_pth).resolve())
+                    if escalation_predictor is not None
+                    else None
+                ),
+                cascade_objectness_margin=cascade_objectness_margin,
+                cascade_class_confidence=cascade_class_confidence,
+                obj_thresh=obj_thresh,
+                iou_thresh=iou_thresh,
+                min_class_confidence_threshold=min_class_confidence_threshold,
+                draw_boxes=draw_boxes,
+                save_preds=save_preds,
+                save_npy=save_npy,
+                save_columnar=save_columnar,
+                save_frame_counts=save_frame_counts,
+                confidence_bins=confidence_bins,
+                count_predictions=count_predictions,
+                tile_overlap=tile_overlap,
+            ),
+            resume=resume,
+        )
+        index_ranges = progress.remaining(
+            len(image_dataset),
+            chunk_size=max(checkpoint_every or DEFAULT_CHECKPOINT_EVERY, batch_size),
+        )
+        if progress.num_completed > 0:
+            print(
+                f"resuming: {progress.num_completed} of {len(image_dataset)} images "
+                "already done"
+            )
+            pbar.update(progress.num_completed)
+    else:
+        index_ranges = [(0, len(image_dataset))]
+
+    columnar_writer: Optional[ColumnarPredictionWriter] = None
+    if save_columnar:
+        assert output_dir is not None
+        columnar_writer = ColumnarPredictionWriter(
+            Path(output_dir) / f"{_run_name(path_to_images, path_to_zarr)}.preds.zarr",
+            num_images=len(image_dataset),
+            num_classes=num_classes,
+            completed_ranges=(
+                progress.completed_ranges() if resume and progress is not None else None
+            ),
         )
 
-    if save_npy:
-        np_results = []
+    frame_count_writer: Optional[FrameCountWriter] = None
+    if save_frame_counts:
+        assert output_dir is not None
+        frame_count_writer = FrameCountWriter(
+            Path(output_dir) / f"{_run_name(path_to_images, path_to_zarr)}.counts.zarr",
+            num_frames=len(image_dataset),
+            num_classes=num_classes,
+            max_count_per_frame=(
+                output_shape[2] * output_shape[3]
+                if tile_overlap is None
+                else np.iinfo(np.uint32).max
+            ),
+            class_names=class_names,
+            resume=resume,
+        )
 
-    if count_predictions:
-        tot_counts = torch.zeros((num_classes,))
+    # shard processes write their own label files and images. Without an
+    # output_dir, images are shown one at a time instead.
+    image_writer: Optional[AnnotatedImageWriter] = None
+    if draw_boxes and output_dir is not None and procs == 1:
+        image_writer = AnnotatedImageWriter(
+            num_workers=render_workers, compress_level=draw_boxes_compress_level
+        )
 
-    file_iterator = enumerate(image_dataloader)
-    while True:
-        # attempting to be forgiving to malformed images, which sometimes occurs
-        # when exporting zip files
-        try:
-            i, (img_batch, fnames) = next(file_iterator)
-        except StopIteration:
-            break
-        except RuntimeError as e:
-            warnings.warn(f"got error {e}; continuing")
-            continue
+    label_writer: Optional[LabelFileWriter] = None
+    if save_preds and procs == 1:
+        assert output_dir is not None
+        label_writer = LabelFileWriter(
+            output_dir,
+            archive=preds_archive,
+            archive_name=f"{_run_name(path_to_images, path_to_zarr)}_preds",
+            append=resume,
+        )
 
-        # gross! device-type is checked even if enabled=False, which means we
-        # have to just tell autocast that device type is always cuda.
-        with torch.cuda.amp.autocast(
-            enabled=half and device.type == "cuda",
-            dtype=torch.bfloat16,
-        ):
-            res = model_jit(img_batch.to(device))
+    run_start_time = time.perf_counter()
 
-        if draw_boxes:
-            for img_idx in range(img_batch.shape[0]):
-                bbox_img = draw_yogo_prediction(
-                    img=img_batch[img_idx, ...],
-                    prediction=res[img_idx, ...],
-                    obj_thresh=obj_thresh,
-                    iou_thresh=iou_thresh,
-                    min_class_confidence_threshold=min_class_confidence_threshold,
-                    labels=class_names,
-                    images_are_normalized=model.normalize_images,
+    tracer = StepTracer(
+        trace_steps if procs == 1 else None,
+        output_dir=Path(output_dir or Path.cwd()),
+        name="infer",
+    )
+
+    def on_batch(num_images: int) -> None:
+        pbar.update(num_images)
+        tracer.step()
+
+    partials: List[_PartialResults] = []
+    with tracer:
+        for index_range in index_ranges:
+            if procs > 1:
+                chunk_partials = _predict_sharded(
+                    model,
+                    dataset_kwargs,
+                    index_range,
+                    procs,
+                    opts,
+                    stage_timers,
+                    pbar,
                 )
-                if output_dir is not None:
-                    out_fname = (
-                        Path(output_dir)
-                        / Path(fnames[img_idx]).with_suffix(output_img_ftype).name
+            elif tile_overlap is not None:
+                chunk_partials = [
+                    _predict_tiled(
+                        model_jit,
+                        (
+                            image_dataset
+                            if index_range == (0, len(image_dataset))
+                            else Subset(image_dataset, range(*index_range))
+                        ),
+                        opts,
+                        index_offset=index_range[0],
+                        tile_overlap=tile_overlap,
+                        num_workers=num_workers,
+                        stage_timers=stage_timers,
+                        on_images=pbar.update,
+                        on_step=tracer.step,
+                        label_writer=label_writer,
                     )
-                    # don't need to compress these, we delete later
-                    # mypy thinks that you can't save a PIL Image which is false
-                    bbox_img.save(out_fname, compress_level=1)  # type: ignore
-                else:
-                    fig, ax = plt.subplots()
-                    ax.set_axis_off()
-                    ax.imshow(bbox_img)
-                    plt.show()
+                ]
+            else:
+                image_dataloader = DataLoader(
+                    (
+                        image_dataset
+                        if index_range == (0, len(image_dataset))
+                        else Subset(image_dataset, range(*index_range))
+                    ),
+                    batch_size=batch_size,
+                    shuffle=False,
+                    drop_last=False,
+                    pin_memory=True,
+                    collate_fn=collate_fn,
+                    num_workers=num_workers,
+                )
+                chunk_partials = [
+                    _predict_batches(
+                        model_jit,
+                        image_dataloader,
+                        opts,
+                        index_offset=index_range[0],
+                        stage_timers=stage_timers,
+                        on_batch=on_batch,
+                        label_writer=label_writer,
+                        image_writer=image_writer,
+                    )
+                ]
+
+            # files must be written before the chunk is recorded as done
+            if label_writer is not None:
+                with stage_timers.stage("write preds"):
+                    label_writer.flush()
+            if image_writer is not None:
+                with stage_timers.stage("write images"):
+                    image_writer.flush()
+
+            chunk_np_results = [arr for p in chunk_partials for arr in p.np_results]
+            chunk_np_result = (
+                np.hstack(chunk_np_results) if len(chunk_np_results) > 0 else None
+            )
 
-                plt.clf()
-                plt.close()
-        if save_preds:
-            assert (
-                output_dir is not None
-            ), "output_dir must not be None if save_preds is True"
-            out_fnames = [
-                Path(output_dir) / Path(fname).with_suffix(".txt").name
-                for fname in fnames
+            chunk_histograms = [
+                p.confidence_histogram
+                for p in chunk_partials
+                if p.confidence_histogram is not None
             ]
-            save_predictions(
-                out_fnames,
-                res,
-                obj_thresh=obj_thresh,
-                iou_thresh=iou_thresh,
-            )
-        if save_npy:
-            res = res.cpu().numpy()
-
-            for j in range(res.shape[0]):
-                img_index = (i * batch_size) + j
-                parsed = format_to_numpy(
-                    img_index,
-                    res[j, ...],
-                    int(img_h.item()),
-                    int(img_w.item()),
+            if frame_count_writer is not None:
+                # written before the chunk is recorded as done
+                with stage_timers.stage("write frame counts"):
+                    frame_count_writer.write(
+                        index_range[0],
+                        torch.cat(
+                            [
+                                p.frame_counts
+                                for p in chunk_partials
+                                if p.frame_counts is not None
+                            ]
+                        ).numpy(),
+                    )
+
+            record_progress: Optional[Callable[[], None]] = None
+            if progress is not None:
+                chunk_counts = [
+                    p.counts for p in chunk_partials if p.counts is not None
+                ]
+                record_progress = partial(
+                    progress.record,
+                    index_range,
+                    counts=(
+                        torch.stack(chunk_counts).sum(dim=0).numpy()
+                        if len(chunk_counts) > 0
+                        else None
+                    ),
+                    np_result=chunk_np_result if save_npy else None,
+                    confidence_histogram=(
+                        torch.stack(chunk_histograms).sum(dim=0).numpy()
+                        if len(chunk_histograms) > 0
+                        else None
+                    ),
                 )
-                np_results.append(parsed)
+            else:
+                partials.extend(chunk_partials)
 
-        if count_predictions:
-            tot_counts += get_prediction_class_counts(
-                res.cpu(),
-                obj_thresh=obj_thresh,
-                iou_thresh=iou_thresh,
-                min_class_confidence_threshold=min_class_confidence_threshold,
-            )
+            if columnar_writer is not None:
+                # progress is recorded by the writer thread once the rows are on disk
+                columnar_writer.write(chunk_np_result, on_written=record_progress)
+            elif record_progress is not None:
+                record_progress()
 
-        # sometimes we return a number of images less than the batch size,
-        # namely when len(image_dataset) % batch_size != 0
-        if return_full_predictions:
-            results[i * batch_size : i * batch_size + res.shape[0], ...] = res
+    if columnar_writer is not None:
+        with stage_timers.stage("write columnar"):
+            columnar_writer.close()
+
+    if label_writer is not None:
+        label_writer.close()
 
-        pbar.update(res.shape[0])
+    if image_writer is not None:
+        image_writer.close()
 
     pbar.close()
 
+    if progress is not None:
+        # every chunk, including ones from before a resume, is on disk
+        recorded_counts = progress.counts()
+        recorded_histogram = progress.confidence_histogram()
+        partials = [
+            _PartialResults(
+                counts=(
+                    torch.from_numpy(recorded_counts)
+                    if recorded_counts is not None
+                    else None
+                ),
+                np_results=progress.np_results(),
+                full_predictions=None,
+                confidence_histogram=(
+                    torch.from_numpy(recorded_histogram)
+                    if recorded_histogram is not None
+                    else None
+                ),
+            )
+        ]
+
+    if frame_count_writer is not None:
+        histograms = [
+            p.confidence_histogram
+            for p in partials
+            if p.confidence_histogram is not None
+        ]
+        frame_count_writer.close(
+            confidence_histogram=(
+                torch.stack(histograms).sum(dim=0).numpy()
+                if len(histograms) > 0
+                else None
+            ),
+            window=count_window,
+        )
+
+    if count_predictions:
+        tot_counts = torch.stack(
+            [p.counts for p in partials if p.counts is not None]
+        ).sum(dim=0)
+
+    if save_npy:
+        np_results = [arr for p in partials for arr in p.np_results]
+
+    if return_full_predictions:
+        results = torch.cat(
+            [p.full_predictions for p in partials if p.full_predictions is not None]
+        )
+
+    run_duration = time.perf_counter() - run_start_time
+
     if count_predictions:
         print(list(zip(class_names or range(num_classes), map(int, tot_counts))))
 
+    if cascade is not None:
+        cascade_report = cascade.report()
+        print(
+            f"cascade: escalated {cascade_report['num_escalated']} of "
+            f"{cascade_report['num_images']} images "
+            f"({cascade_report['escalated_fraction']:.1%})"
+        )
+        agreement = ", ".join(
+            f"{name} {agreement:.1%}"
+            for name, agreement in zip(
+                class_names or range(num_classes),
+                cascade_report["count_agreement_on_escalated"],
+            )
+        )
+        print(f"count agreement of the fast model on escalated images: {agreement}")
+        if output_dir is not None:
+            cascade_report["class_names"] = class_names or [
+                str(i) for i in range(num_classes)
+            ]
+            with open(Path(output_dir) / "cascade_report.json", "w") as f:
+                json.dump(cascade_report, f, indent=4)
+
     # Save the numpy array
     if save_npy:
         pred_tensors = np.hstack(np_results)
 
-        if path_to_images:
-            filename = Path(path_to_images).resolve().parent.stem
-        elif path_to_zarr:
-            filename = Path(path_to_zarr).resolve().stem
+        # as with several models, a dataset given without a path is named after the model
+        filename = (
+            _run_name(path_to_images, path_to_zarr) or Path(predictor.path_to_pth).stem
+        )
 
         if output_dir is not None:
             fp = Path(output_dir).resolve() / Path(filename).with_suffix(".npy")
         else:
             fp = Path.cwd().resolve() / Path(filename).with_suffix(".npy")
 
-        np.save(fp, pred_tensors)
+        _write_npy(fp, pred_tensors, predictor, obj_thresh, iou_thresh, stage_timers)
 
-        write_metadata(
-            fp.with_suffix(".json"),
-            run_name=fp.with_suffix("").name,
-            model_name=get_model_name_from_pth(path_to_pth),
-            obj_thresh=obj_thresh,
-            iou_thresh=iou_thresh,
-            vertical_crop_height_px=img_h.item(),
-            write_date=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    if profile:
+        print(stage_timers.summary())
+        print(
+            f"{len(image_dataset)} images in {run_duration:.3f} s "
+            f"({len(image_dataset) / run_duration:.1f} images / s)"
         )
+        profile_path = Path(output_dir or Path.cwd()) / "yogo_infer_profile.json"
+        profile_path.parent.mkdir(exist_ok=True, parents=True)
+        stage_timers.write_json(
+            profile_path,
+            num_images=len(image_dataset),
+            batch_size=batch_size,
+            num_workers=num_workers,
+            procs=procs,
+            device=str(device),
+            run_duration_s=run_duration,
+        )
+        print(f"wrote profile to {profile_path}")
+
+    if progress is not None:
+        progress.clear()
 
     if return_full_predictions:
         return results
@@ -424,13 +2151,19 @@ def predict(
 
 def do_infer(args):
     predict(
-        args.pth_path,
+        args.pth_path[0] if len(args.pth_path) == 1 else args.pth_path,
         path_to_images=args.path_to_images,
         path_to_zarr=args.path_to_zarr,
         output_dir=args.output_dir,
         draw_boxes=args.draw_boxes,
         save_preds=args.save_preds,
         save_npy=args.save_npy,
+        save_columnar=args.save_columnar,
+        preds_archive=args.preds_archive,
+        draw_boxes_compress_level=args.compress_level,
+        render_workers=args.render_workers,
+        save_frame_counts=args.save_frame_counts,
+        count_window=args.count_window,
         class_names=args.class_names,
         obj_thresh=args.obj_thresh,
         iou_thresh=args.iou_thresh,
@@ -438,10 +2171,21 @@ def do_infer(args):
         device=args.device,
         use_tqdm=args.use_tqdm,
         vertical_crop_height=args.crop_height,
+        scale_factor=args.scale_factor,
+        tta_flips=args.tta_flips,
+        cascade_pth=args.cascade_pth,
+        cascade_objectness_margin=args.cascade_objectness_margin,
+        cascade_class_confidence=args.cascade_class_confidence,
         count_predictions=args.count,
         output_img_ftype=args.output_img_filetype,
         min_class_confidence_threshold=args.min_class_confidence_threshold,
         half=args.half,
+        profile=args.profile,
+        trace_steps=args.trace_steps,
+        procs=args.procs,
+        tile_overlap=args.tile_overlap,
+        resume=args.resume,
+        checkpoint_every=args.checkpoint_every,
     )
 
 
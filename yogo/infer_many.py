@@ -0,0 +1,305 @@
+#! /usr/bin/env python3
+
+import json
+import time
+import sqlite3
+import hashlib
+import datetime
+import traceback
+
+from pathlib import Path
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from yogo.infer import TTAFlip, YOGOPredictor, predict
+from yogo.utils.argparsers import infer_many_parser
+from yogo.data.image_path_dataset import ImageAndIdDataset, get_dataset
+
+
+"""
+`yogo infer-many` runs `predict` over a manifest of image directories and zarr
+files with one warm model. The manifest is a text file with one input path per
+line (blank lines and lines starting with '#' are ignored). Paths ending in
+`.zarr` or `.zip` are read as zarr files, anything else is a path to images.
+
+The status of every input is kept in a sqlite database (by default in the
+output directory), so an interrupted job can just be started again - inputs
+that finished are skipped.
+"""
+
+
+ZARR_SUFFIXES = (".zarr", ".zip")
+
+
+class ProgressDB:
+    """
+    a tiny sqlite table of inputs, keyed by input path. Status is one of
+    'pending', 'running', 'done', or 'failed'.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.conn = sqlite3.connect(str(self.db_path))
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS runs (
+                input_path TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                output_dir TEXT,
+                num_images INTEGER,
+                load_s REAL,
+                duration_s REAL,
+                error TEXT,
+                updated_at TEXT
+            )
+            """
+        )
+        self.conn.commit()
+
+    def _now(self) -> str:
+        return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def register(self, input_paths: List[Path]) -> None:
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO runs (input_path, status, updated_at) VALUES (?, 'pending', ?)",
+            [(str(p), self._now()) for p in input_paths],
+        )
+        self.conn.commit()
+
+    def status(self, input_path: Path) -> Optional[str]:
+        row = self.conn.execute(
+            "SELECT status FROM runs WHERE input_path = ?", (str(input_path),)
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def mark_running(self, input_path: Path, output_dir: Path) -> None:
+        self.conn.execute(
+            "UPDATE runs SET status = 'running', attempts = attempts + 1, "
+            "output_dir = ?, error = NULL, updated_at = ? WHERE input_path = ?",
+            (str(output_dir), self._now(), str(input_path)),
+        )
+        self.conn.commit()
+
+    def mark_done(
+        self, input_path: Path, num_images: int, load_s: float, duration_s: float
+    ) -> None:
+        self.conn.execute(
+            "UPDATE runs SET status = 'done', num_images = ?, load_s = ?, "
+            "duration_s = ?, updated_at = ? WHERE input_path = ?",
+            (num_images, load_s, duration_s, self._now(), str(input_path)),
+        )
+        self.conn.commit()
+
+    def mark_failed(self, input_path: Path, error: str) -> None:
+        self.conn.execute(
+            "UPDATE runs SET status = 'failed', error = ?, updated_at = ? WHERE input_path = ?",
+            (error, self._now(), str(input_path)),
+        )
+        self.conn.commit()
+
+    def failures(self) -> List[Tuple[str, int, str]]:
+        return self.conn.execute(
+            "SELECT input_path, attempts, error FROM runs WHERE status = 'failed' ORDER BY input_path"
+        ).fetchall()
+
+    def counts_by_status(self) -> Dict[str, int]:
+        return dict(
+            self.conn.execute(
+                "SELECT status, COUNT(*) FROM runs GROUP BY status"
+            ).fetchall()
+        )
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def load_manifest(manifest_path: Path) -> List[Path]:
+    with open(manifest_path, "r") as f:
+        lines = [line.strip() for line in f]
+
+    input_paths = [Path(line) for line in lines if line and not line.startswith("#")]
+
+    if len(set(input_paths)) != len(input_paths):
+        raise ValueError(f"manifest {manifest_path} has duplicate input paths")
+
+    return input_paths
+
+
+def output_names(input_paths: List[Path]) -> Dict[Path, str]:
+    """
+    name each input's output directory after the input's stem, disambiguating
+    inputs with the same stem (e.g. `run_1/images` and `run_2/images`) with a
+    short hash of the full path, so names are stable across restarts
+    """
+    stems: Dict[str, int] = {}
+    for p in input_paths:
+        stems[p.stem] = stems.get(p.stem, 0) + 1
+
+    return {
+        p: (
+            p.stem
+            if stems[p.stem] == 1
+            else f"{p.stem}_{hashlib.sha1(str(p).encode()).hexdigest()[:8]}"
+        )
+        for p in input_paths
+    }
+
+
+def _is_zarr(input_path: Path) -> bool:
+    return input_path.suffix in ZARR_SUFFIXES
+
+
+def _load_dataset(
+    input_path: Path, predictor: YOGOPredictor
+) -> Tuple[ImageAndIdDataset, float]:
+    t0 = time.perf_counter()
+    dataset = get_dataset(
+        path_to_images=None if _is_zarr(input_path) else input_path,
+        path_to_zarr=input_path if _is_zarr(input_path) else None,
+        image_transforms=predictor.transforms,
+        normalize_images=predictor.normalize_images,
+    )
+    return dataset, time.perf_counter() - t0
+
+
+def infer_many(
+    path_to_pth: Path,
+    manifest_path: Path,
+    output_dir: Path,
+    db_path: Optional[Path] = None,
+    retries: int = 1,
+    device: Optional[str] = None,
+    vertical_crop_height: Optional[float] = None,
+    scale_factor: float = 1.0,
+    tta_flips: Sequence[TTAFlip] = (),
+    **predict_kwargs: Any,
+) -> List[Tuple[str, int, str]]:
+    """
+    Run `predict` on every input of the manifest that isn't already done,
+    retrying each failed input up to `retries` times. Returns the list of
+    (input path, attempts, error) for inputs that failed.
+
+    While an input is running, the dataset of the next input is created in a
+    background thread, so directory listing / zarr opening overlaps with
+    inference.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(exist_ok=True, parents=True)
+
+    input_paths = load_manifest(manifest_path)
+    names = output_names(input_paths)
+
+    db = ProgressDB(db_path or output_dir / "infer_many.sqlite")
+    db.register(input_paths)
+
+    todo = [p for p in input_paths if db.status(p) != "done"]
+    print(f"{len(input_paths) - len(todo)} of {len(input_paths)} inputs already done")
+
+    predictor = YOGOPredictor(
+        path_to_pth,
+        device=device,
+        vertical_crop_height=vertical_crop_height,
+        scale_factor=scale_factor,
+        tta_flips=tta_flips,
+    )
+
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        next_dataset: Optional[Future] = (
+            prefetcher.submit(_load_dataset, todo[0], predictor) if todo else None
+        )
+
+        for i, input_path in enumerate(todo):
+            assert next_dataset is not None
+            dataset_future = next_dataset
+            next_dataset = (
+                prefetcher.submit(_load_dataset, todo[i + 1], predictor)
+                if i + 1 < len(todo)
+                else None
+            )
+
+            input_output_dir = output_dir / names[input_path]
+            input_output_dir.mkdir(exist_ok=True)
+
+            # a previous attempt may have recorded partial progress
+            previously_attempted = db.status(input_path) in ("running", "failed")
+
+            for attempt in range(retries + 1):
+                db.mark_running(input_path, input_output_dir)
+                t0 = time.perf_counter()
+                try:
+                    if attempt == 0:
+                        dataset, load_s = dataset_future.result()
+                    else:
+                        dataset, load_s = _load_dataset(input_path, predictor)
+
+                    predict(
+                        predictor,
+                        path_to_images=None if _is_zarr(input_path) else input_path,
+                        path_to_zarr=input_path if _is_zarr(input_path) else None,
+                        image_dataset=dataset,
+                        output_dir=str(input_output_dir),
+                        vertical_crop_height=vertical_crop_height,
+                        scale_factor=scale_factor,
+                        tta_flips=tta_flips,
+                        resume=previously_attempted or attempt > 0,
+                        **predict_kwargs,
+                    )
+                except Exception:
+                    error = traceback.format_exc()
+                    print(
+                        f"{input_path} failed (attempt {attempt + 1} of {retries + 1}):\n{error}"
+                    )
+                    db.mark_failed(input_path, error)
+                else:
+                    db.mark_done(
+                        input_path,
+                        num_images=len(dataset),
+                        load_s=load_s,
+                        duration_s=time.perf_counter() - t0,
+                    )
+                    break
+
+    failures = db.failures()
+
+    print(json.dumps(db.counts_by_status(), indent=4))
+    if len(failures) > 0:
+        print(f"{len(failures)} input(s) failed:")
+        for failed_path, attempts, error in failures:
+            last_line = error.strip().splitlines()[-1] if error else ""
+            print(f"  {failed_path} ({attempts} attempts): {last_line}")
+
+    db.close()
+    return failures
+
+
+def do_infer_many(args):
+    failures = infer_many(
+        args.pth_path,
+        args.manifest,
+        args.output_dir,
+        db_path=args.db_path,
+        retries=args.retries,
+        device=args.device,
+        vertical_crop_height=args.crop_height,
+        scale_factor=args.scale_factor,
+        tta_flips=args.tta_flips,
+        save_preds=args.save_preds,
+        save_npy=args.save_npy,
+        count_predictions=args.count,
+        class_names=args.class_names,
+        batch_size=args.batch_size,
+        obj_thresh=args.obj_thresh,
+        iou_thresh=args.iou_thresh,
+        min_class_confidence_threshold=args.min_class_confidence_threshold,
+        half=args.half,
+        use_tqdm=args.use_tqdm,
+    )
+    if len(failures) > 0:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = infer_many_parser()
+    args = parser.parse_args()
+    do_infer_many(args)
@@ -233,7 +233,10 @@ class YOGO(nn.Module):
         return int(Sx), int(Sy)
 
     def resize_model(
-        self, img_height: Optional[int] = None, img_width: Optional[int] = None
+        self,
+        img_height: Optional[int] = None,
+        img_width: Optional[int] = None,
+        scale_factor: float = 1.0,
     ) -> None:
         """
         for YOGO's specific application of counting cells as they flow
@@ -241,9 +244,21 @@ class YOGO(nn.Module):
         to reduce double-counting cells. This function resizes the
         model to a certain image height - 193 px is about a quarter
         of the full 772 pixel height, and is standard for our uses.
+
+        img_height and img_width are in native pixels. If scale_factor is
+        not 1, the (cropped) images are expected to be resized by it before
+        they reach the model (e.g. 0.5 for half resolution), so the grid is
+        computed for the resized input. Boxes are still normalized to the
+        image, so they do not change with scale_factor.
         """
+        if not (0 < scale_factor <= 1):
+            raise ValueError(f"scale_factor must be in (0, 1]; got {scale_factor}")
+
         org_img_height, org_img_width = (int(d) for d in self.get_img_size())
-        crop_size = (img_height or org_img_height, img_width or org_img_width)
+        crop_size = (
+            round((img_height or org_img_height) * scale_factor),
+            round((img_width or org_img_width) * scale_factor),
+        )
         Sx, Sy = self.get_grid_size(crop_size)
         self.Sx, self.Sy = Sx, Sy
         _Cxs = torch.linspace(0, 1 - 1 / Sx, Sx, device=self.device).expand(Sy, -1)
@@ -20,11 +20,13 @@ from torch.nn.parallel import DistributedDataParallel as DDP
 
 from yogo.model import YOGO
 from yogo.metrics import Metrics
+from yogo.data.yogo_dataset import densify_labels
 from yogo.data.yogo_dataloader import get_dataloader
 from yogo.data.dataset_definition_file import DatasetDefinition
 from yogo.yogo_loss import YOGOLoss
 from yogo.model_defns import get_model_func
 from yogo.utils.argparsers import train_parser
+from yogo.utils.profiling import StepTracer
 from yogo.utils.default_hyperparams import DefaultHyperparams as df
 from yogo.utils import (
     draw_yogo_prediction,
@@ -173,6 +175,9 @@ class Trainer:
             rgb=self.config["rgb"],
             normalize_images=self.config["normalize_images"],
             split_fraction_override=self.config["dataset_split_override"],
+            sparse_labels=self.config.get("sparse_labels", False),
+            image_cache_bytes=int(self.config.get("image_cache_gb", 0) * 1e9),
+            image_cache_dir=self.config.get("image_cache_dir", None),
         )
 
         train_dataloader = dataloaders["train"]
@@ -300,48 +305,63 @@ class Trainer:
 
         device = self.device
 
-        for epoch in range(self.config["epochs"]):
-            self.epoch = epoch
-            # mypy thinks that self.train_dataloader has type Iterable[Any]?
-            self.train_dataloader.sampler.set_epoch(epoch)  # type: ignore
-
-            self.net.train()
-            for imgs, labels in self.train_dataloader:
-                imgs = imgs.to(device, non_blocking=True)
-                labels = labels.to(device, non_blocking=True)
-
-                self.optimizer.zero_grad(set_to_none=True)
-
-                with torch.cuda.amp.autocast(
-                    dtype=torch.float16,
-                    enabled=self.config["half"],
-                ):
-                    outputs = self.net(imgs)
-                    loss, loss_components = self.Y_loss(outputs, labels)
-
-                loss.backward()
-
-                self.optimizer.step()
-                self.scheduler.step()
-
-                self.global_step += 1
-
-                if self._rank == 0:
-                    wandb.log(
-                        {
-                            "train loss": loss.item(),
-                            "epoch": epoch,
-                            "LR": self.scheduler.get_last_lr()[0],
-                            **loss_components,
-                        },
-                        commit=self.global_step % 100 == 0,
-                        step=self.global_step,
-                    )
+        model_save_dir = Path(self._store.get("model_save_dir").decode("utf-8"))
 
-            if epoch % 4 == 0:
-                self._validate()
+        # steps are counted from the start of this call to `train`, not
+        # from global_step, so traces are comparable across fine-tuning runs
+        tracer = StepTracer(
+            self.config.get("trace_steps", None),
+            output_dir=model_save_dir / "traces",
+            name=f"train_rank_{self._rank}",
+        )
 
-        model_save_dir = Path(self._store.get("model_save_dir").decode("utf-8"))
+        with tracer:
+            for epoch in range(self.config["epochs"]):
+                self.epoch = epoch
+                # mypy thinks that self.train_dataloader has type Iterable[Any]?
+                # tar shard datasets have no sampler, and shuffle by themselves
+                if hasattr(self.train_dataloader.sampler, "set_epoch"):  # type: ignore
+                    self.train_dataloader.sampler.set_epoch(epoch)  # type: ignore
+
+                self.net.train()
+                for imgs, labels in self.train_dataloader:
+                    imgs = imgs.to(device, non_blocking=True)
+                    labels = labels.to(device, non_blocking=True)
+
+                    self.optimizer.zero_grad(set_to_none=True)
+
+                    with torch.cuda.amp.autocast(
+                        dtype=torch.float16,
+                        enabled=self.config["half"],
+                    ):
+                        outputs = self.net(imgs)
+                        bs, _, Sy, Sx = outputs.shape
+                        labels = densify_labels(labels, bs, Sx, Sy)
+                        loss, loss_components = self.Y_loss(outputs, labels)
+
+                    loss.backward()
+
+                    self.optimizer.step()
+                    self.scheduler.step()
+
+                    self.global_step += 1
+
+                    if self._rank == 0:
+                        wandb.log(
+                            {
+                                "train loss": loss.item(),
+                                "epoch": epoch,
+                                "LR": self.scheduler.get_last_lr()[0],
+                                **loss_components,
+                            },
+                            commit=self.global_step % 100 == 0,
+                            step=self.global_step,
+                        )
+
+                    tracer.step()
+
+                if epoch % 4 == 0:
+                    self._validate()
 
         if (model_save_dir / "best.pth").exists():
             model_checkpoint = torch.load(
@@ -391,6 +411,8 @@ class Trainer:
                 enabled=self.config["half"],
             ):
                 outputs = self.net(imgs)
+                bs, _, Sy, Sx = outputs.shape
+                labels = densify_labels(labels, bs, Sx, Sy)
                 loss, _ = self.Y_loss(outputs, labels)
 
             val_loss += loss
@@ -487,6 +509,8 @@ class Trainer:
                 enabled=config["half"],
             ):
                 outputs = net(imgs)
+                bs, _, Sy, Sx = outputs.shape
+                labels = densify_labels(labels, bs, Sx, Sy)
                 loss, _ = Y_loss(outputs, labels)
 
             test_loss += loss
@@ -640,6 +664,10 @@ def do_training(args) -> None:
         "tags": args.tags,
         "wandb_entity": args.wandb_entity,
         "wandb_project": args.wandb_project,
+        "trace_steps": args.trace_steps,
+        "sparse_labels": args.sparse_labels,
+        "image_cache_gb": args.image_cache_gb,
+        "image_cache_dir": args.image_cache_dir,
     }
 
     world_size = torch.cuda.device_count()
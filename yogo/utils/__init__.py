@@ -1,5 +1,6 @@
 from .utils import (
     Timer,
+    StageTimers,
     get_wandb_roc,
     get_free_port,
     iter_in_chunks,
@@ -10,6 +11,7 @@ from .utils import (
 
 from .prediction_formatting import (
     format_preds,
+    format_preds_batched,
     format_preds_and_labels,
     format_preds_and_labels_v2,
     format_to_numpy,
@@ -18,12 +20,14 @@ from .prediction_formatting import (
 
 __all__ = (
     "Timer",
+    "StageTimers",
     "get_wandb_roc",
     "get_free_port",
     "get_wandb_confusion",
     "iter_in_chunks",
     "draw_yogo_prediction",
     "format_preds",
+    "format_preds_batched",
     "format_preds_and_labels",
     "format_preds_and_labels_v2",
     "choose_device",
@@ -2,6 +2,7 @@ import os
 import argparse
 
 from pathlib import Path
+from typing import Tuple
 
 from yogo.data.split_fractions import SplitFractions
 
@@ -60,6 +61,21 @@ def unitary_float(val: float):
     return v
 
 
+def step_range(val: str) -> Tuple[int, int]:
+    "parses 'a:b' into the half-open range of steps [a, b)"
+    try:
+        start, stop = (int(v) for v in val.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"{val} is not a step range of the form 'start:stop' (e.g. '10:15')"
+        )
+
+    if not (0 <= start < stop):
+        raise argparse.ArgumentTypeError(f"{val} must satisfy 0 <= start < stop")
+
+    return start, stop
+
+
 class SplitFractionsAction(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
         try:
@@ -92,6 +108,27 @@ def global_parser():
             "infer", help="infer images using a model", allow_abbrev=False
         )
     )
+    infer_many_parser(
+        parser=subparsers.add_parser(
+            "infer-many",
+            help="infer many image directories / zarr files using one model",
+            allow_abbrev=False,
+        )
+    )
+    eval_scales_parser(
+        parser=subparsers.add_parser(
+            "eval-scales",
+            help="compare accuracy and speed of a model at several scale factors",
+            allow_abbrev=False,
+        )
+    )
+    pack_parser(
+        parser=subparsers.add_parser(
+            "pack",
+            help="pack a dataset definition's images and labels into a few large shards",
+            allow_abbrev=False,
+        )
+    )
     return parser
 
 
@@ -255,6 +292,41 @@ def train_parser(parser=None):
         default=os.getenv("wandb_project"),
         help="wandb entity - defaults to the environment variable WANDB_PROJECT",
     )
+    parser.add_argument(
+        "--trace-steps",
+        type=step_range,
+        default=None,
+        help=(
+            "capture a torch.profiler trace of steps [start, stop) (e.g. '--trace-steps 10:15') "
+            "and write it, along with a table of the most expensive ops, to the run directory"
+        ),
+    )
+    parser.add_argument(
+        "--sparse-labels",
+        default=False,
+        action=boolean_action,
+        help=(
+            "pass labels from the dataloader as lists of boxes, and build the label grids on the "
+            "device - reduces dataloader worker IPC and host-to-device copies (default: False)"
+        ),
+    )
+    parser.add_argument(
+        "--image-cache-gb",
+        type=unsigned_float,
+        default=0,
+        help=(
+            "cache up to this many GB of decoded and resized images across epochs, shared by "
+            "dataloader workers and ranks on a node. Cache files are kept for later runs, "
+            "and unused ones in --image-cache-dir are deleted, least recently used first, to "
+            "keep all of them within this budget (default: 0, no cache)"
+        ),
+    )
+    parser.add_argument(
+        "--image-cache-dir",
+        type=Path,
+        default=None,
+        help="directory for the image cache (default: /dev/shm if it exists, else the temp directory)",
+    )
     return parser
 
 
@@ -360,32 +432,8 @@ def export_parser(parser=None):
     return parser
 
 
-def infer_parser(parser=None):
-    if parser is None:
-        parser = argparse.ArgumentParser(
-            description="infer on image data", allow_abbrev=False
-        )
-
-    parser.add_argument(
-        "pth_path", type=Path, help="path to .pth file defining the model"
-    )
-    data_source = parser.add_mutually_exclusive_group(required=True)
-    data_source.add_argument(
-        "--path-to-images",
-        "--path-to-image",
-        type=Path,
-        default=None,
-        help="path to image or images",
-    )
-    data_source.add_argument(
-        "--path-to-zarr", type=Path, default=None, help="path to zarr file"
-    )
-    parser.add_argument(
-        "--draw-boxes",
-        help="plot and either save (if --output-dir is set) or show each image",
-        action=boolean_action,
-        default=False,
-    )
+def _add_prediction_output_args(parser):
+    "output arguments shared by infer and infer-many"
     parser.add_argument(
         "--save-preds",
         help=(
@@ -410,12 +458,6 @@ def infer_parser(parser=None):
         default=False,
         help="display the final predicted counts per-class",
     )
-    parser.add_argument(
-        "--output-dir",
-        type=Path,
-        default=None,
-        help="path to directory for results, either --draw-boxes or --save-preds",
-    )
     parser.add_argument(
         "--class-names",
         help="list of class names - will default to integers if not provided",
@@ -423,6 +465,10 @@ def infer_parser(parser=None):
         nargs="*",
         default=None,
     )
+
+
+def _add_inference_args(parser):
+    "model and threshold arguments shared by infer and infer-many"
     parser.add_argument(
         "--batch-size",
         type=uint,
@@ -447,11 +493,26 @@ def infer_parser(parser=None):
         help="crop image verically - '-c 0.25' will crop images to (round(0.25 * height), width)",
     )
     parser.add_argument(
-        "--output-img-filetype",
+        "--scale-factor",
+        type=unitary_float,
+        default=1.0,
+        help=(
+            "downsample images by this factor on the device before the model - e.g. 0.5 runs "
+            "the model at half resolution, which is faster but less accurate for small "
+            "objects. See `yogo eval-scales` (default: 1.0)"
+        ),
+    )
+    parser.add_argument(
+        "--tta-flips",
         type=str,
-        choices=[".png", ".tif", ".tiff"],
-        default=".png",
-        help="filetype for output images (default: .png)",
+        nargs="+",
+        choices=["h", "v", "hv"],
+        default=[],
+        help=(
+            "average predictions over these flips of each image (horizontal, vertical, or "
+            "both), which are run in the same forward pass - each flip adds BATCH_SIZE "
+            "images to every forward pass"
+        ),
     )
     parser.add_argument(
         "--obj-thresh",
@@ -474,6 +535,147 @@ def infer_parser(parser=None):
             "max confidence must be greater than this value (default: 0.0)"
         ),
     )
+    parser.add_argument(
+        "--use-tqdm",
+        action=boolean_action,
+        default=True,
+        help="use tqdm progress bar",
+    )
+
+
+def infer_parser(parser=None):
+    if parser is None:
+        parser = argparse.ArgumentParser(
+            description="infer on image data", allow_abbrev=False
+        )
+
+    parser.add_argument(
+        "pth_path",
+        type=Path,
+        nargs="+",
+        help=(
+            "path to .pth file defining the model. If several are given, each model is run "
+            "on every batch, so images are only loaded once, and the outputs of each model "
+            "go to OUTPUT_DIR/<model name> (only --save-preds, --save-npy, and --count are "
+            "supported for several models)"
+        ),
+    )
+    data_source = parser.add_mutually_exclusive_group(required=True)
+    data_source.add_argument(
+        "--path-to-images",
+        "--path-to-image",
+        type=Path,
+        default=None,
+        help="path to image or images",
+    )
+    data_source.add_argument(
+        "--path-to-zarr", type=Path, default=None, help="path to zarr file"
+    )
+    parser.add_argument(
+        "--draw-boxes",
+        help="plot and either save (if --output-dir is set) or show each image",
+        action=boolean_action,
+        default=False,
+    )
+    parser.add_argument(
+        "--compress-level",
+        type=uint,
+        choices=range(10),
+        metavar="{0-9}",
+        default=1,
+        help="png compression level of --draw-boxes images (default: 1)",
+    )
+    parser.add_argument(
+        "--render-workers",
+        type=uint,
+        default=None,
+        help=(
+            "number of processes that encode --draw-boxes images - 0, or --procs > 1, "
+            "encodes them in the process that runs the model (default: number of cpus, "
+            "up to 8)"
+        ),
+    )
+    parser.add_argument(
+        "--save-frame-counts",
+        action=boolean_action,
+        default=False,
+        help=(
+            "save the class counts of every image, along with per-class totals and "
+            "confidence histograms, to a zarr group in `--output-dir`"
+        ),
+    )
+    parser.add_argument(
+        "--count-window",
+        type=uint,
+        default=None,
+        help=(
+            "with --save-frame-counts, also save counts over the trailing N images, "
+            "ending at each image"
+        ),
+    )
+    parser.add_argument(
+        "--preds-archive",
+        choices=["tar", "zip"],
+        default=None,
+        help=(
+            "with --save-preds, write all label files into one tar or zip archive in "
+            "`--output-dir` instead of one file per image"
+        ),
+    )
+    parser.add_argument(
+        "--save-columnar",
+        help=(
+            "save predictions as typed columns (image id, boxes, objectness, class, probabilities) "
+            "in one zarr group with per-image offsets, instead of a file per image - requires "
+            "`--output-dir` to be set"
+        ),
+        action=boolean_action,
+        default=False,
+    )
+    _add_prediction_output_args(parser)
+    parser.add_argument(
+        "--output-dir",
+        type=Path,
+        default=None,
+        help="path to directory for results, either --draw-boxes or --save-preds",
+    )
+    parser.add_argument(
+        "--cascade-pth",
+        type=Path,
+        default=None,
+        help=(
+            "path to the .pth file of a larger model to cascade to - PTH_PATH screens every "
+            "image, and only images that it is uncertain about are run through this model. "
+            "A report of the fraction of escalated images is printed (and written to "
+            "OUTPUT_DIR/cascade_report.json)"
+        ),
+    )
+    parser.add_argument(
+        "--cascade-objectness-margin",
+        type=unitary_float,
+        default=0.2,
+        help=(
+            "escalate images with a cell whose objectness is within this margin of "
+            "--obj-thresh (default: 0.2)"
+        ),
+    )
+    parser.add_argument(
+        "--cascade-class-confidence",
+        type=unitary_float,
+        default=0.9,
+        help=(
+            "escalate images with a prediction whose top class confidence is below this "
+            "(default: 0.9)"
+        ),
+    )
+    parser.add_argument(
+        "--output-img-filetype",
+        type=str,
+        choices=[".png", ".tif", ".tiff"],
+        default=".png",
+        help="filetype for output images (default: .png)",
+    )
+    _add_inference_args(parser)
     parser.add_argument(
         "--heatmap-mask-path",
         type=Path,
@@ -481,9 +683,224 @@ def infer_parser(parser=None):
         help="path to heatmap mask for the run (default: None)",
     )
     parser.add_argument(
-        "--use-tqdm",
+        "--procs",
+        type=uint,
+        default=1,
+        help=(
+            "number of processes to split inference across (cpu only). Each process "
+            "runs on its own slice of cores, sharing one copy of the model weights "
+            "(default: 1)"
+        ),
+    )
+    parser.add_argument(
+        "--tile-overlap",
+        type=uint,
+        default=None,
+        help=(
+            "run images that are larger than the model's input size as overlapping, "
+            "model-sized tiles, which overlap by at least this many pixels. Detections "
+            "are mapped back to the full image, and duplicates in overlaps are removed"
+        ),
+    )
+    parser.add_argument(
+        "--profile",
         action=boolean_action,
-        default=True,
-        help="use tqdm progress bar",
+        default=False,
+        help=(
+            "time each stage of inference (loading, host to device, forward, "
+            "formatting, writing), print a summary and write a json report to "
+            "--output-dir (or the current directory)"
+        ),
+    )
+    parser.add_argument(
+        "--resume",
+        action=boolean_action,
+        default=False,
+        help=(
+            "resume an interrupted run from the progress recorded in --output-dir, "
+            "instead of starting over"
+        ),
+    )
+    parser.add_argument(
+        "--checkpoint-every",
+        type=uint,
+        default=None,
+        help=(
+            "record progress in --output-dir every N images, so that an interrupted "
+            "run can be resumed with --resume (default: only record progress when "
+            "resuming, every 10000 images)"
+        ),
+    )
+    parser.add_argument(
+        "--trace-steps",
+        type=step_range,
+        default=None,
+        help=(
+            "capture a torch.profiler trace of steps [start, stop) (e.g. '--trace-steps 10:15') "
+            "and write it, along with a table of the most expensive ops, to --output-dir (or the current directory)"
+        ),
+    )
+    return parser
+
+
+def infer_many_parser(parser=None):
+    if parser is None:
+        parser = argparse.ArgumentParser(
+            description="infer on many image directories or zarr files",
+            allow_abbrev=False,
+        )
+
+    parser.add_argument(
+        "pth_path", type=Path, help="path to .pth file defining the model"
+    )
+    parser.add_argument(
+        "manifest",
+        type=Path,
+        help=(
+            "text file with one input per line - paths ending in .zarr or .zip are "
+            "read as zarr files, other paths as image directories"
+        ),
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=Path,
+        required=True,
+        help="directory for results - each input gets its own subdirectory",
+    )
+    parser.add_argument(
+        "--db-path",
+        type=Path,
+        default=None,
+        help="path to the sqlite progress database (default: OUTPUT_DIR/infer_many.sqlite)",
+    )
+    parser.add_argument(
+        "--retries",
+        type=uint,
+        default=1,
+        help="number of times to retry a failed input (default: 1)",
+    )
+    _add_prediction_output_args(parser)
+    _add_inference_args(parser)
+    return parser
+
+
+def eval_scales_parser(parser=None):
+    if parser is None:
+        parser = argparse.ArgumentParser(
+            description="evaluate a model on its test set at several scale factors",
+            allow_abbrev=False,
+        )
+
+    parser.add_argument(
+        "pth_path", type=Path, help="path to .pth file defining the model"
+    )
+    parser.add_argument(
+        "dataset_defn_path", type=Path, help="path to yml dataset definition file"
+    )
+    parser.add_argument(
+        "--scale-factors",
+        type=unitary_float,
+        nargs="+",
+        default=[1.0, 0.75, 0.667, 0.5],
+        help=(
+            "scale factors to evaluate (see `yogo infer --scale-factor`) "
+            "(default: 1.0 0.75 0.667 0.5)"
+        ),
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=uint,
+        help="batch size (default: 64)",
+        default=64,
+    )
+    parser.add_argument(
+        "--device",
+        type=str,
+        nargs="?",
+        help="set a device for the run - if not specified, we will try to use 'cuda', and fallback on 'cpu'",
+    )
+    parser.add_argument(
+        "--half",
+        default=False,
+        action=boolean_action,
+        help="half precision (i.e. fp16) inference",
+    )
+    parser.add_argument(
+        "--obj-thresh",
+        type=unsigned_float,
+        default=0.5,
+        help="objectness threshold for counting predictions (default: 0.5)",
+    )
+    parser.add_argument(
+        "--iou-thresh",
+        type=unsigned_float,
+        default=0.5,
+        help="intersection over union threshold for counting predictions (default: 0.5)",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=None,
+        help="also write the reports to this json file",
+    )
+    return parser
+
+
+def pack_parser(parser=None):
+    if parser is None:
+        parser = argparse.ArgumentParser(
+            description="pack a dataset definition into shards for training",
+            allow_abbrev=False,
+        )
+
+    parser.add_argument(
+        "dataset_defn_path", type=Path, help="path to yml dataset definition file"
+    )
+    parser.add_argument(
+        "output_dir",
+        type=Path,
+        help=(
+            "directory for the shards, and a dataset definition file for them "
+            "(dataset_defn.yml) to use in place of the original"
+        ),
+    )
+    parser.add_argument(
+        "--image-hw",
+        default=(772, 1032),
+        nargs=2,
+        type=int,
+        help="height and width to resize images to - must match `yogo train --image-hw` (default: 772 1032)",
+    )
+    parser.add_argument(
+        "--rgb-images",
+        default=False,
+        action=boolean_action,
+        help="pack RGB images instead of grayscale - must match `yogo train --rgb-images` (defaults to grayscale)",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["npy", "tar"],
+        default="npy",
+        help=(
+            "'npy' for memory-mapped shards of resized images, read by random access, or 'tar' "
+            "for tar shards of the original image files, read sequentially - better for network "
+            "storage and hard drives. Tar datasets are split into train / val / test per shard "
+            "(default: npy)"
+        ),
+    )
+    parser.add_argument(
+        "--images-per-shard",
+        type=uint,
+        default=10_000,
+        help=(
+            "maximum number of images in each shard - for tar shards, use enough shards for every "
+            "dataloader worker of every GPU to read its own (default: 10000)"
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=uint,
+        default=None,
+        help="number of threads for reading and resizing images (default: a few per cpu)",
     )
     return parser
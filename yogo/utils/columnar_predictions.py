@@ -0,0 +1,194 @@
+import zarr
+import queue
+import threading
+
+import numpy as np
+import numpy.typing as npt
+
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+
+"""
+Columnar prediction output for `yogo infer --save-columnar`.
+
+Predictions for a whole run are stored in one zarr group with a typed array
+per column, rather than one text file per image:
+
+    image_id    uint32  (N,)            index of the image in the dataset
+    boxes       float32 (N, 4)          top left x, top left y, bottom right x,
+                                        bottom right y, in pixels
+    objectness  float16 (N,)
+    class_id    uint8   (N,)            argmax of probs
+    probs       float16 (N, num_classes)
+    offsets     uint64  (num_images + 1,)
+
+where N is the number of predictions over the whole dataset. The predictions
+for image i are rows offsets[i]:offsets[i + 1] of every column, so a single
+image can be read without reading the rest (see `ColumnarPredictions`).
+"""
+
+
+ROWS_PER_CHUNK = 1 << 16
+
+
+COLUMNS = {
+    "image_id": np.uint32,
+    "boxes": np.float32,
+    "objectness": np.float16,
+    "class_id": np.uint8,
+    "probs": np.float16,
+}
+
+
+class ColumnarPredictionWriter:
+    """
+    Appends predictions to a columnar zarr group from a background thread, so
+    compression and disk writes overlap with inference. Predictions are
+    handed over in the (15 x N) layout of `format_to_numpy`.
+
+    Offsets are computed in `close`; until then the group is marked
+    incomplete.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        num_images: int,
+        num_classes: int,
+        completed_ranges: Optional[List[Tuple[int, int]]] = None,
+        max_queued: int = 4,
+    ):
+        """
+        If completed_ranges is given, an existing group at path is reopened
+        (e.g. when resuming), and rows for images outside of completed_ranges
+        are dropped, since they come from unfinished work.
+        """
+        if num_classes > np.iinfo(np.uint8).max + 1:
+            raise ValueError(
+                f"class ids are stored as uint8, but there are {num_classes} classes"
+            )
+
+        self.path = Path(path)
+        self.num_images = num_images
+        self.num_classes = num_classes
+
+        if completed_ranges is not None and self.path.exists():
+            self.root = zarr.open_group(str(self.path), mode="a")
+            self._drop_rows_outside(completed_ranges)
+        else:
+            self.root = zarr.open_group(str(self.path), mode="w")
+            for name, dtype in COLUMNS.items():
+                width = {"boxes": 4, "probs": num_classes}.get(name)
+                shape = (0,) if width is None else (0, width)
+                chunks = (ROWS_PER_CHUNK,) if width is None else (ROWS_PER_CHUNK, width)
+                self.root.create_dataset(name, shape=shape, chunks=chunks, dtype=dtype)
+
+        self.root.attrs.update(
+            num_images=num_images, num_classes=num_classes, complete=False
+        )
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queued)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def _drop_rows_outside(self, completed_ranges: List[Tuple[int, int]]) -> None:
+        image_ids = self.root["image_id"][:]
+        keep = np.zeros(len(image_ids), dtype=bool)
+        for start, stop in completed_ranges:
+            keep |= (start <= image_ids) & (image_ids < stop)
+
+        if keep.all():
+            return
+
+        for name in COLUMNS:
+            kept = self.root[name][:][keep]
+            self.root[name].resize(kept.shape)
+            self.root[name][:] = kept
+
+    def _write_loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            rows, on_written = item
+            try:
+                if rows is not None:
+                    self._append(rows)
+                if on_written is not None:
+                    on_written()
+            except BaseException as e:
+                self._error = e
+                return
+
+    def _append(self, rows: npt.NDArray) -> None:
+        self.root["image_id"].append(rows[0].astype(np.uint32))
+        self.root["boxes"].append(rows[1:5].T.astype(np.float32))
+        self.root["objectness"].append(rows[5].astype(np.float16))
+        self.root["class_id"].append(rows[6].astype(np.uint8))
+        self.root["probs"].append(rows[8:].T.astype(np.float16))
+
+    def _raise_if_failed(self) -> None:
+        if self._error is not None:
+            raise RuntimeError(
+                f"writing predictions to {self.path} failed"
+            ) from self._error
+
+    def write(
+        self,
+        rows: Optional[npt.NDArray],
+        on_written: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """
+        queue rows to be appended. on_written is called from the writer
+        thread once the rows are written, e.g. to record progress.
+        """
+        self._raise_if_failed()
+        self._queue.put((rows, on_written))
+
+    def close(self) -> None:
+        """wait for queued rows to be written, and write the per-image offsets"""
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_if_failed()
+
+        image_ids = self.root["image_id"][:]
+        if np.any(np.diff(image_ids.astype(np.int64)) < 0):
+            # only happens when resuming a run with gaps; keep rows grouped by image
+            order = np.argsort(image_ids, kind="stable")
+            for name in COLUMNS:
+                self.root[name][:] = self.root[name][:][order]
+            image_ids = image_ids[order]
+
+        offsets = np.searchsorted(image_ids, np.arange(self.num_images + 1))
+        self.root.array("offsets", offsets.astype(np.uint64), overwrite=True)
+        self.root.attrs["complete"] = True
+
+
+class ColumnarPredictions:
+    """
+    Random access to a group written by `ColumnarPredictionWriter`;
+    `preds[i]` is a dict of column name to the predictions for image i.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.root = zarr.open_group(str(self.path), mode="r")
+        if not self.root.attrs.get("complete", False):
+            raise ValueError(f"{self.path} is incomplete - its run did not finish")
+        self.offsets = self.root["offsets"][:]
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx: int) -> Dict[str, npt.NDArray]:
+        if not (-len(self) <= idx < len(self)):
+            raise IndexError(f"image index {idx} out of range for {len(self)} images")
+        idx %= len(self)
+        start, stop = int(self.offsets[idx]), int(self.offsets[idx + 1])
+        return {name: self.root[name][start:stop] for name in COLUMNS}
+
+    @property
+    def num_predictions(self) -> int:
+        return int(self.offsets[-1])
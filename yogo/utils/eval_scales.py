@@ -0,0 +1,236 @@
+#! /usr/bin/env python3
+
+import json
+import time
+import torch
+import argparse
+
+from pathlib import Path
+from dataclasses import asdict, dataclass
+from typing import List, Optional, Sequence, Union
+
+from torch.utils.data import DataLoader
+
+from yogo.model import YOGO
+from yogo.metrics import Metrics
+from yogo.infer import YOGOPredictor, count_predictions_per_frame
+from yogo.data.utils import collate_batch_robust
+from yogo.data.dataset_definition_file import DatasetDefinition
+from yogo.data.yogo_dataloader import (
+    get_dataloader,
+    choose_dataloader_num_workers,
+)
+from yogo.utils import choose_device
+
+
+"""
+`yogo eval-scales`: evaluate a model on the test set of a dataset definition
+at several values of `yogo infer --scale-factor`, to pick an operating point
+between speed and accuracy.
+"""
+
+
+@dataclass
+class ScaleReport:
+    scale_factor: float
+    grid_size: List[int]  # [Sy, Sx]
+    mAP: float
+    # per class, (predicted count - true count) / true count over the test set
+    count_error: List[float]
+    # per class, the mean absolute difference of predicted and true counts per image
+    frame_count_mae: List[float]
+    images_per_s: float
+
+
+def label_counts_per_frame(labels: torch.Tensor, num_classes: int) -> torch.Tensor:
+    """
+    count the labelled objects of each class in each image of a batch of
+    grid-formatted labels (mask, x, y, x, y, class), returning a
+    (batch size, num classes) tensor
+    """
+    mask = labels[:, 0].bool()
+    classes = labels[:, 5][mask].long()
+    image_idxs = torch.nonzero(mask)[:, 0]
+    counts = torch.zeros(
+        (labels.shape[0], num_classes), dtype=torch.long, device=labels.device
+    )
+    counts.index_put_((image_idxs, classes), torch.ones_like(classes), accumulate=True)
+    return counts
+
+
+@torch.no_grad()
+def evaluate_scale(
+    path_to_pth: Union[str, Path],
+    test_dataloader: DataLoader,
+    scale_factor: float,
+    class_names: List[str],
+    device: torch.device,
+    obj_thresh: float = 0.5,
+    iou_thresh: float = 0.5,
+    half: bool = False,
+) -> ScaleReport:
+    """
+    The first batch is not timed, since it includes compilation (on cuda).
+    Throughput is of the model alone, excluding data loading.
+    """
+    predictor = YOGOPredictor(path_to_pth, device=device, scale_factor=scale_factor)
+    if predictor.num_classes != len(class_names):
+        raise ValueError(
+            f"model has {predictor.num_classes} classes, but the dataset definition "
+            f"has {len(class_names)}"
+        )
+
+    metrics = Metrics(
+        classes=class_names,
+        device=str(device),
+        include_mAP=True,
+        include_background=False,
+    )
+
+    num_classes = predictor.num_classes
+    pred_counts = torch.zeros(num_classes, dtype=torch.long, device=device)
+    true_counts = torch.zeros(num_classes, dtype=torch.long, device=device)
+    frame_abs_error = torch.zeros(num_classes, dtype=torch.long, device=device)
+
+    num_images, num_timed_images, model_time = 0, 0, 0.0
+    for i, (imgs, labels) in enumerate(test_dataloader):
+        imgs = imgs.to(device)
+        labels = labels.to(device)
+
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        t0 = time.perf_counter()
+        with torch.cuda.amp.autocast(enabled=half and device.type == "cuda"):
+            preds = predictor.model_jit(imgs).float()
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        if i > 0:
+            model_time += time.perf_counter() - t0
+            num_timed_images += len(imgs)
+        num_images += len(imgs)
+
+        frame_preds = count_predictions_per_frame(
+            preds, obj_thresh=obj_thresh, iou_thresh=iou_thresh
+        )
+        frame_labels = label_counts_per_frame(labels, num_classes)
+        pred_counts += frame_preds.sum(dim=0)
+        true_counts += frame_labels.sum(dim=0)
+        frame_abs_error += (frame_preds - frame_labels).abs().sum(dim=0)
+
+        metrics.update(preds, labels)
+
+    mAP_metrics, *_ = metrics.compute()
+
+    return ScaleReport(
+        scale_factor=scale_factor,
+        grid_size=list(predictor.output_shape[2:]),
+        mAP=float(mAP_metrics["map"]),
+        count_error=((pred_counts - true_counts) / true_counts.clamp(min=1)).tolist(),
+        frame_count_mae=(frame_abs_error / max(num_images, 1)).tolist(),
+        images_per_s=num_timed_images / model_time if model_time > 0 else float("nan"),
+    )
+
+
+def format_reports(reports: Sequence[ScaleReport], class_names: List[str]) -> str:
+    lines = [
+        f"{'scale':>6} {'grid':>9} {'mAP':>7} {'images/s':>10}  count error by class",
+    ]
+    for r in reports:
+        count_errors = ", ".join(
+            f"{name} {err:+.1%}" for name, err in zip(class_names, r.count_error)
+        )
+        lines.append(
+            f"{r.scale_factor:>6.3g} {r.grid_size[0]:>4}x{r.grid_size[1]:<4} "
+            f"{r.mAP:>7.4f} {r.images_per_s:>10.1f}  {count_errors}"
+        )
+    return "\n".join(lines)
+
+
+def eval_scales(
+    path_to_pth: Union[str, Path],
+    data_defn: DatasetDefinition,
+    scale_factors: Sequence[float],
+    batch_size: int = 64,
+    device: Optional[Union[str, torch.device]] = None,
+    obj_thresh: float = 0.5,
+    iou_thresh: float = 0.5,
+    half: bool = False,
+) -> List[ScaleReport]:
+    device = torch.device(device or choose_device())
+
+    # labels are loaded once, at the model's native grid size; matching
+    # predictions to labels is by IoU, so it does not depend on the grid
+    y, cfg = YOGO.from_pth(path_to_pth, inference=True)
+    Sx, Sy = y.get_grid_size()
+    img_h, img_w = (int(d) for d in y.get_img_size())
+    del y
+
+    dataloaders = get_dataloader(
+        data_defn,
+        batch_size,
+        Sx,
+        Sy,
+        training=False,
+        image_hw=(img_h, img_w),
+        normalize_images=cfg["normalize_images"],
+    )
+    if "test" not in dataloaders:
+        raise ValueError("dataset definition has no test data")
+
+    test_dataset = dataloaders["test"].dataset
+    num_workers = choose_dataloader_num_workers(len(test_dataset))  # type: ignore
+    test_dataloader = DataLoader(
+        test_dataset,
+        shuffle=False,
+        drop_last=False,
+        pin_memory=True,
+        batch_size=batch_size,
+        num_workers=num_workers,
+        persistent_workers=num_workers > 0,
+        collate_fn=collate_batch_robust,
+        multiprocessing_context="spawn" if num_workers > 0 else None,
+    )
+
+    return [
+        evaluate_scale(
+            path_to_pth,
+            test_dataloader,
+            scale_factor,
+            class_names=data_defn.classes,
+            device=device,
+            obj_thresh=obj_thresh,
+            iou_thresh=iou_thresh,
+            half=half,
+        )
+        for scale_factor in scale_factors
+    ]
+
+
+def do_eval_scales(args: argparse.Namespace) -> None:
+    data_defn = DatasetDefinition.from_yaml(args.dataset_defn_path)
+
+    reports = eval_scales(
+        args.pth_path,
+        data_defn,
+        args.scale_factors,
+        batch_size=args.batch_size,
+        device=args.device,
+        obj_thresh=args.obj_thresh,
+        iou_thresh=args.iou_thresh,
+        half=args.half,
+    )
+
+    print(format_reports(reports, data_defn.classes))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "pth_path": str(args.pth_path),
+                    "dataset_defn_path": str(args.dataset_defn_path),
+                    "class_names": data_defn.classes,
+                    "reports": [asdict(r) for r in reports],
+                },
+                f,
+                indent=4,
+            )
@@ -0,0 +1,122 @@
+import zarr
+
+import numpy as np
+import numpy.typing as npt
+
+from pathlib import Path
+from typing import List, Optional, Union
+
+
+"""
+Per-frame class counts for `yogo infer --save-frame-counts`.
+
+Counts are computed on the device during inference (see
+`yogo.infer.detections_per_frame`), and written here, one progress chunk at a
+time, into a zarr group:
+
+    frame_counts            uint16 or uint32 (num_frames, num_classes)
+    window_counts           uint32 (num_frames, num_classes), optional: counts
+                            over the trailing `window` frames, ending at each frame
+    confidence_histogram    uint64 (num_classes, num_bins): histogram of the class
+                            confidence of each counted prediction, by class
+
+with the per-class totals, class names, and histogram bin edges in the group's
+attrs.
+"""
+
+
+def trailing_window_sums(frame_counts: npt.NDArray, window: int) -> npt.NDArray:
+    """
+    sums of frame_counts over the trailing `window` frames, ending at each frame.
+    The first window - 1 frames are summed over the frames available.
+    """
+    if window < 1:
+        raise ValueError(f"window must be at least 1; got {window}")
+
+    cumulative = np.cumsum(frame_counts, axis=0, dtype=np.uint64)
+    cumulative = np.concatenate(
+        [np.zeros((1, frame_counts.shape[1]), dtype=np.uint64), cumulative]
+    )
+    starts = np.maximum(np.arange(1, len(frame_counts) + 1) - window, 0)
+    return cumulative[1:] - cumulative[starts]
+
+
+class FrameCountWriter:
+    def __init__(
+        self,
+        path: Union[str, Path],
+        num_frames: int,
+        num_classes: int,
+        max_count_per_frame: int,
+        class_names: Optional[List[str]] = None,
+        resume: bool = False,
+    ):
+        """
+        max_count_per_frame bounds the number of predictions in a frame (the
+        number of grid cells), so that counts are stored as uint16 when they
+        fit. If resume is True, an existing group at path is reused - its rows
+        for finished frames are kept, and the rest are overwritten.
+        """
+        self.path = Path(path)
+        self.num_frames = num_frames
+        self.num_classes = num_classes
+
+        dtype = (
+            np.uint16 if max_count_per_frame <= np.iinfo(np.uint16).max else np.uint32
+        )
+
+        if resume and self.path.exists():
+            self.root = zarr.open_group(str(self.path), mode="a")
+            if self.root["frame_counts"].shape != (num_frames, num_classes):
+                raise ValueError(
+                    f"can't resume {self.path}: it has frame counts of shape "
+                    f"{self.root['frame_counts'].shape}, expected {(num_frames, num_classes)}"
+                )
+        else:
+            self.root = zarr.open_group(str(self.path), mode="w")
+            self.root.zeros(
+                "frame_counts",
+                shape=(num_frames, num_classes),
+                chunks=(1 << 16, num_classes),
+                dtype=dtype,
+            )
+
+        self.root.attrs.update(
+            class_names=class_names or [str(i) for i in range(num_classes)],
+            complete=False,
+        )
+
+    def write(self, start: int, frame_counts: npt.NDArray) -> None:
+        """write counts for frames [start, start + len(frame_counts))"""
+        self.root["frame_counts"][start : start + len(frame_counts)] = frame_counts
+
+    def close(
+        self,
+        confidence_histogram: Optional[npt.NDArray] = None,
+        window: Optional[int] = None,
+    ) -> None:
+        frame_counts = self.root["frame_counts"][:]
+
+        self.root.attrs["totals"] = [int(c) for c in frame_counts.sum(axis=0)]
+
+        if window is not None:
+            self.root.array(
+                "window_counts",
+                trailing_window_sums(frame_counts, window).astype(np.uint32),
+                chunks=(1 << 16, self.num_classes),
+                overwrite=True,
+            )
+            self.root.attrs["window"] = window
+
+        if confidence_histogram is not None:
+            num_bins = confidence_histogram.shape[1]
+            self.root.array(
+                "confidence_histogram",
+                confidence_histogram.astype(np.uint64),
+                overwrite=True,
+            )
+            self.root.attrs["confidence_bin_edges"] = np.linspace(
+                0, 1, num_bins + 1
+            ).tolist()
+
+        self.root.attrs["complete"] = True
@@ -0,0 +1,167 @@
+import os
+import json
+import shutil
+
+import numpy as np
+import numpy.typing as npt
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+
+"""
+Checkpointed progress for long `yogo infer` runs.
+
+Inference is run over contiguous chunks of the dataset. After each chunk
+finishes, its index range is appended to `progress.json` in the progress
+directory, along with its class counts, and its `--save-npy` rows are written
+to their own .npy file. `--save-preds` and `--draw-boxes` outputs are written
+per-image anyways, so they need no extra bookkeeping.
+
+On `--resume`, only the index ranges that are not recorded are run, and the
+recorded chunks are merged back in with the new ones.
+"""
+
+
+PROGRESS_FILE = "progress.json"
+
+
+IndexRange = Tuple[int, int]
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class InferenceProgress:
+    def __init__(
+        self, progress_dir: Path, run_config: Dict[str, Any], resume: bool = False
+    ):
+        """
+        `run_config` holds the settings that change the outputs (model,
+        thresholds, dataset size, ...). Resuming progress that was recorded
+        with a different config raises a ValueError, since the outputs
+        would be a mix of two different runs.
+
+        If `resume` is False, any existing progress is discarded.
+        """
+        self.progress_dir = Path(progress_dir)
+        self.run_config = json.loads(json.dumps(run_config))
+
+        self.chunks: List[Dict[str, Any]] = []
+
+        progress_file = self.progress_dir / PROGRESS_FILE
+        if resume and progress_file.exists():
+            with open(progress_file, "r") as f:
+                progress = json.load(f)
+
+            if progress["run_config"] != self.run_config:
+                mismatched = sorted(
+                    k
+                    for k in set(progress["run_config"]) | set(self.run_config)
+                    if progress["run_config"].get(k) != self.run_config.get(k)
+                )
+                raise ValueError(
+                    f"can't resume from {progress_file}: it was recorded with different "
+                    f"settings ({', '.join(mismatched)})"
+                )
+
+            self.chunks = progress["chunks"]
+        elif self.progress_dir.exists():
+            shutil.rmtree(self.progress_dir)
+
+        self.progress_dir.mkdir(exist_ok=True, parents=True)
+
+    @property
+    def num_completed(self) -> int:
+        return sum(stop - start for start, stop in self.completed_ranges())
+
+    def completed_ranges(self) -> List[IndexRange]:
+        return sorted((chunk["start"], chunk["stop"]) for chunk in self.chunks)
+
+    def remaining(self, num_images: int, chunk_size: int) -> List[IndexRange]:
+        """
+        index ranges of [0, num_images) that have not been completed, split
+        into chunks of at most chunk_size images
+        """
+        gaps: List[IndexRange] = []
+        prev_stop = 0
+        for start, stop in self.completed_ranges() + [(num_images, num_images)]:
+            if start > prev_stop:
+                gaps.append((prev_stop, start))
+            prev_stop = max(prev_stop, stop)
+
+        return [
+            (chunk_start, min(chunk_start + chunk_size, stop))
+            for start, stop in gaps
+            for chunk_start in range(start, stop, chunk_size)
+        ]
+
+    def record(
+        self,
+        index_range: IndexRange,
+        counts: Optional[npt.NDArray],
+        np_result: Optional[npt.NDArray],
+        confidence_histogram: Optional[npt.NDArray] = None,
+    ) -> None:
+        """
+        mark index_range as complete. The npy rows are written before the
+        progress file, so a crash in between only costs the chunk.
+        """
+        start, stop = index_range
+        chunk: Dict[str, Any] = {"start": start, "stop": stop}
+
+        if counts is not None:
+            chunk["counts"] = [int(c) for c in counts]
+
+        if confidence_histogram is not None:
+            chunk["confidence_histogram"] = confidence_histogram.astype(int).tolist()
+
+        if np_result is not None:
+            npy_name = f"chunk_{start}_{stop}.npy"
+            tmp_path = self.progress_dir / (npy_name + ".tmp")
+            with open(tmp_path, "wb") as f:
+                np.save(f, np_result)
+            os.replace(tmp_path, self.progress_dir / npy_name)
+            chunk["npy"] = npy_name
+
+        self.chunks.append(chunk)
+
+        _write_atomic(
+            self.progress_dir / PROGRESS_FILE,
+            json.dumps(
+                {"run_config": self.run_config, "chunks": self.chunks}, indent=4
+            ).encode(),
+        )
+
+    def counts(self) -> Optional[npt.NDArray]:
+        chunk_counts = [chunk["counts"] for chunk in self.chunks if "counts" in chunk]
+        if len(chunk_counts) == 0:
+            return None
+        return np.sum(chunk_counts, axis=0)
+
+    def confidence_histogram(self) -> Optional[npt.NDArray]:
+        histograms = [
+            chunk["confidence_histogram"]
+            for chunk in self.chunks
+            if "confidence_histogram" in chunk
+        ]
+        if len(histograms) == 0:
+            return None
+        return np.sum(histograms, axis=0)
+
+    def np_results(self) -> List[npt.NDArray]:
+        """the recorded npy rows of every chunk, in index order"""
+        return [
+            np.load(self.progress_dir / chunk["npy"])
+            for chunk in sorted(self.chunks, key=lambda c: c["start"])
+            if "npy" in chunk
+        ]
+
+    def clear(self) -> None:
+        shutil.rmtree(self.progress_dir, ignore_errors=True)
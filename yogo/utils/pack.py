@@ -0,0 +1,286 @@
+#! /usr/bin/env python3
+
+import io
+import os
+import json
+import shutil
+import tarfile
+import argparse
+import numpy as np
+
+from tqdm import tqdm
+from pathlib import Path
+from ruamel.yaml import YAML
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Literal, Optional, Tuple
+
+from yogo.data.yogo_dataset import ObjectDetectionDataset
+from yogo.data.tar_dataset import TAR_VERSION, tar_index_path
+from yogo.data.packed_dataset import PACKED_VERSION, PACKED_MANIFEST_NAME
+from yogo.data.dataset_definition_file import (
+    DatasetDefinition,
+    DatasetSpecification,
+    LiteralSpecification,
+    PackedSpecification,
+    TarSpecification,
+)
+
+
+"""
+`yogo pack`: convert the image and label folders of a dataset definition into a
+few large shards (see `yogo/data/packed_dataset.py` and `yogo/data/tar_dataset.py`),
+and write a dataset definition for the shards that can be used in place of the
+original.
+"""
+
+
+Sample = Tuple[ObjectDetectionDataset, int]
+ShardFormat = Literal["npy", "tar"]
+
+
+def pack_shard(
+    shard_path: Path,
+    samples: List[Sample],
+    classes: List[str],
+    image_hw: Tuple[int, int],
+    rgb: bool = False,
+    num_workers: Optional[int] = None,
+) -> None:
+    """
+    pack the (dataset, index) samples into a shard at shard_path. The shard is
+    written to a temporary directory first, so an interrupted pack never leaves
+    a partial shard behind.
+    """
+    tmp_path = shard_path.with_name(f"{shard_path.name}.{os.getpid()}.tmp")
+    if tmp_path.exists():
+        shutil.rmtree(tmp_path)
+    tmp_path.mkdir(parents=True)
+
+    images = np.lib.format.open_memmap(
+        tmp_path / "images.npy",
+        mode="w+",
+        dtype=np.uint8,
+        shape=(len(samples), 3 if rgb else 1, *image_hw),
+    )
+
+    def load_image(i: int) -> Optional[np.ndarray]:
+        dataset, index = samples[i]
+        image = dataset.load_image(index)
+        return image.numpy() if image is not None else None
+
+    # image decoding and resizing release the GIL, so threads are enough
+    readable: List[bool] = []
+    with ThreadPoolExecutor(num_workers or None) as executor:
+        for i, image in enumerate(
+            tqdm(
+                executor.map(load_image, range(len(samples))),
+                total=len(samples),
+                desc=f"packing {shard_path.name}",
+            )
+        ):
+            if image is not None:
+                images[i] = image
+            readable.append(image is not None)
+    images.flush()
+    del images
+
+    file_labels = [dataset.file_labels(index) for dataset, index in samples]
+    offsets = np.zeros(len(samples) + 1, dtype=np.int64)
+    np.cumsum([len(ls) for ls in file_labels], out=offsets[1:])
+    np.save(
+        tmp_path / "labels.npy",
+        np.concatenate([np.zeros((0, 5), dtype=np.float32), *file_labels]),
+    )
+    np.save(tmp_path / "offsets.npy", offsets)
+
+    manifest = {
+        "version": PACKED_VERSION,
+        "classes": classes,
+        "image_hw": list(image_hw),
+        "rgb": rgb,
+        "image_paths": [str(dataset._image_paths[index]) for dataset, index in samples],
+        "label_paths": [str(dataset._label_paths[index]) for dataset, index in samples],
+        "unreadable": [i for i, ok in enumerate(readable) if not ok],
+    }
+    with open(tmp_path / PACKED_MANIFEST_NAME, "w") as f:
+        json.dump(manifest, f)
+
+    if shard_path.exists():
+        shutil.rmtree(shard_path)
+    os.replace(tmp_path, shard_path)
+
+
+def pack_tar_shard(shard_path: Path, samples: List[Sample], classes: List[str]) -> None:
+    """
+    write the (dataset, index) samples into a tar shard at shard_path, along with
+    its index (see `yogo/data/tar_dataset.py`). Images are copied as-is.
+    """
+    tmp_path = shard_path.with_name(f"{shard_path.name}.{os.getpid()}.tmp")
+    with tarfile.open(tmp_path, "w") as tar:
+        for i, (dataset, index) in enumerate(
+            tqdm(samples, desc=f"packing {shard_path.name}")
+        ):
+            key = f"{i:06d}"
+            image_path = Path(dataset._image_paths[index])
+            tar.add(image_path, arcname=f"{key}{image_path.suffix}")
+
+            label_bytes = "".join(
+                f"{int(row[0])} {' '.join(repr(float(v)) for v in row[1:])}\n"
+                for row in dataset.file_labels(index)
+            ).encode()
+            label_info = tarfile.TarInfo(f"{key}.txt")
+            label_info.size = len(label_bytes)
+            tar.addfile(label_info, io.BytesIO(label_bytes))
+
+    index = {
+        "version": TAR_VERSION,
+        "classes": classes,
+        "num_samples": len(samples),
+        "image_paths": [str(dataset._image_paths[index]) for dataset, index in samples],
+    }
+    with open(tar_index_path(shard_path), "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, shard_path)
+
+
+def pack_specs(
+    specs: List[DatasetSpecification],
+    output_dir: Path,
+    shard_prefix: str,
+    classes: List[str],
+    image_hw: Tuple[int, int],
+    rgb: bool = False,
+    images_per_shard: int = 10_000,
+    num_workers: Optional[int] = None,
+    shard_format: ShardFormat = "npy",
+) -> List[DatasetSpecification]:
+    """
+    packs the samples of the literal specifications into shards of at most
+    images_per_shard images, named {shard_prefix}_000, {shard_prefix}_001, ...
+    Specifications that are already packed in shard_format are passed through
+    as-is.
+
+    Tar shards are read as streams, so their samples are shuffled across shards,
+    and the dataset is split into train / val / test per shard.
+    """
+    packed_type = PackedSpecification if shard_format == "npy" else TarSpecification
+
+    packed_specs: List[DatasetSpecification] = []
+    samples: List[Sample] = []
+    for spec in sorted(specs, key=str):
+        if isinstance(spec, packed_type):
+            packed_specs.append(spec)
+            continue
+        elif not isinstance(spec, LiteralSpecification):
+            raise ValueError(f"can't repack {spec} as {shard_format} shards")
+
+        # Sx and Sy are irrelevant, since we only read the raw labels
+        dataset = ObjectDetectionDataset(
+            spec.image_path,
+            spec.label_path,
+            Sx=1,
+            Sy=1,
+            classes=classes,
+            image_hw=image_hw,
+            rgb=rgb,
+        )
+        samples.extend((dataset, i) for i in range(len(dataset)))
+
+    if shard_format == "tar":
+        order = np.random.default_rng(7271978).permutation(len(samples))
+        samples = [samples[i] for i in order]
+
+    for shard_idx, start in enumerate(range(0, len(samples), images_per_shard)):
+        shard_samples = samples[start : start + images_per_shard]
+        if shard_format == "npy":
+            shard_path = output_dir / f"{shard_prefix}_{shard_idx:03d}"
+            pack_shard(
+                shard_path,
+                shard_samples,
+                classes,
+                image_hw,
+                rgb=rgb,
+                num_workers=num_workers,
+            )
+            packed_specs.append(PackedSpecification(Path(shard_path.name)))
+        else:
+            shard_path = output_dir / f"{shard_prefix}_{shard_idx:03d}.tar"
+            pack_tar_shard(shard_path, shard_samples, classes)
+            packed_specs.append(TarSpecification(Path(shard_path.name)))
+
+    return packed_specs
+
+
+def pack_dataset_definition(
+    dataset_defn_path: Path,
+    output_dir: Path,
+    image_hw: Tuple[int, int] = (772, 1032),
+    rgb: bool = False,
+    images_per_shard: int = 10_000,
+    num_workers: Optional[int] = None,
+    shard_format: ShardFormat = "npy",
+) -> Path:
+    """
+    packs the dataset definition at dataset_defn_path into output_dir, returning
+    the path of the packed dataset definition. Shards are referenced relative to
+    the packed definition, so output_dir can be moved as a whole.
+
+    shard_format is "npy" for memory-mapped shards of resized images (see
+    `packed_dataset.py`), or "tar" for tar shards of the original image files,
+    which are read sequentially (see `tar_dataset.py`).
+    """
+    if images_per_shard < 1:
+        raise ValueError(f"images_per_shard must be at least 1; got {images_per_shard}")
+
+    dataset_definition = DatasetDefinition.from_yaml(dataset_defn_path)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    def pack(specs: List[DatasetSpecification], prefix: str) -> Dict[str, Any]:
+        return {
+            f"{prefix}_{i:03d}": spec.to_dict()
+            for i, spec in enumerate(
+                pack_specs(
+                    specs,
+                    output_dir,
+                    prefix,
+                    dataset_definition.classes,
+                    image_hw,
+                    rgb=rgb,
+                    images_per_shard=images_per_shard,
+                    num_workers=num_workers,
+                    shard_format=shard_format,
+                )
+            )
+        }
+
+    packed_defn: Dict[str, Any] = {
+        "class_names": dataset_definition.classes,
+        "dataset_paths": pack(dataset_definition.dataset_paths, "train"),
+        "dataset_split_fractions": dataset_definition.split_fractions.to_dict(),
+    }
+    if len(dataset_definition.test_dataset_paths) > 0:
+        packed_defn["test_paths"] = pack(dataset_definition.test_dataset_paths, "test")
+    if dataset_definition.thumbnail_augmentation is not None:
+        packed_defn["thumbnail_augmentation"] = {
+            k: [str(p) for p in v] if isinstance(v, list) else str(v)
+            for k, v in dataset_definition.thumbnail_augmentation.items()
+        }
+
+    packed_defn_path = output_dir / "dataset_defn.yml"
+    yaml = YAML()
+    yaml.default_flow_style = False
+    yaml.dump(packed_defn, packed_defn_path)
+    return packed_defn_path
+
+
+def do_pack(args: argparse.Namespace) -> None:
+    packed_defn_path = pack_dataset_definition(
+        args.dataset_defn_path,
+        args.output_dir,
+        image_hw=args.image_hw,
+        rgb=args.rgb_images,
+        images_per_shard=args.images_per_shard,
+        num_workers=args.workers,
+        shard_format=args.format,
+    )
+    print(f"packed dataset definition written to {packed_defn_path}")
@@ -93,12 +93,77 @@ def format_preds(
     return preds
 
 
+def format_preds_batched(
+    batch_pred: torch.Tensor,
+    obj_thresh: float = 0.5,
+    iou_thresh: float = 0.5,
+    box_format: BoxFormat = "cxcywh",
+    min_class_confidence_threshold: float = 0.0,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    `format_preds` for a whole batch at once. Returns (image_idxs, preds), where
+    preds is [N,pred_shape] for every prediction in the batch, and image_idxs is
+    [N], the index of the image in the batch that each prediction belongs to.
+
+    NMS is batched by image, so predictions in different images never suppress
+    each other. Everything stays on the device of batch_pred.
+
+    Parameters
+    ----------
+    batch_pred: torch.Tensor
+        Raw YOGO output (batched), of shape (batch size, pred_shape, Sy, Sx)
+    see `format_preds` for the rest
+    """
+    if len(batch_pred.shape) != 4:
+        raise ValueError(
+            "argument to format_preds_batched should be a batched result - "
+            f"shape should be (batch size, pred_shape, Sy, Sx), got {batch_pred.shape}"
+        )
+    elif box_format not in get_args(BoxFormat):
+        raise ValueError(
+            f"invalid box format {box_format}; valid box formats are {get_args(BoxFormat)}"
+        )
+
+    bs, pred_shape, Sy, Sx = batch_pred.shape
+
+    reformatted_preds = batch_pred.reshape(bs, pred_shape, Sy * Sx).transpose(1, 2)
+
+    image_idxs, cell_idxs = torch.nonzero(
+        reformatted_preds[..., 4] > obj_thresh, as_tuple=True
+    )
+    preds = reformatted_preds[image_idxs, cell_idxs]
+
+    xyxy_boxes = ops.box_convert(preds[:, :4], "cxcywh", "xyxy")
+
+    if iou_thresh > 0:
+        keep_idxs = ops.batched_nms(
+            xyxy_boxes,
+            torch.max(preds[:, 5:], dim=1).values * preds[:, 4],
+            image_idxs,
+            iou_threshold=iou_thresh,
+        )
+        preds, image_idxs = preds[keep_idxs], image_idxs[keep_idxs]
+        xyxy_boxes = xyxy_boxes[keep_idxs]
+
+    if box_format == "xyxy":
+        preds[:, :4] = xyxy_boxes
+
+    if min_class_confidence_threshold > 0:
+        keep_idxs = preds[:, 5:].max(dim=1).values > min_class_confidence_threshold
+        preds, image_idxs = preds[keep_idxs], image_idxs[keep_idxs]
+
+    return image_idxs, preds
+
+
 def format_to_numpy(
     img_id: int,
     prediction_tensor: np.ndarray,
     img_h: int,
     img_w: int,
     np_dtype=np.float32,
+    obj_thresh: float = 0.5,
+    iou_thresh: float = 0.5,
+    min_class_confidence_threshold: float = 0.0,
 ) -> npt.NDArray:
     """Function to parse a prediction tensor and save it in a numpy format
 
@@ -109,6 +174,8 @@ def format_to_numpy(
     img_h: int
     img_w: int
     np_dtype: np.dtype
+    obj_thresh, iou_thresh, min_class_confidence_threshold: float
+        see `format_preds`
 
     Returns
     -------
@@ -130,7 +197,10 @@ def format_to_numpy(
     filtered_pred = (
         format_preds(
             torch.from_numpy(prediction_tensor),
+            obj_thresh=obj_thresh,
+            iou_thresh=iou_thresh,
             box_format="xyxy",
+            min_class_confidence_threshold=min_class_confidence_threshold,
         )
         .numpy()
         .T
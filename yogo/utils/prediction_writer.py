@@ -0,0 +1,110 @@
+import io
+import time
+import tarfile
+import zipfile
+
+from pathlib import Path
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Literal, Optional, Union, get_args
+
+
+ArchiveFormat = Literal["tar", "zip"]
+
+
+class LabelFileWriter:
+    """
+    Writes `--save-preds` label files from a thread pool, so that file
+    creation (slow on network filesystems) overlaps with inference.
+
+    If `archive` is given, the files are instead added to a single
+    OUTPUT_DIR/<archive_name>.<archive> file, which avoids creating one inode
+    per image. Archives are written from one thread, since neither tarfile
+    nor zipfile is thread safe.
+    """
+
+    def __init__(
+        self,
+        output_dir: Union[str, Path],
+        archive: Optional[ArchiveFormat] = None,
+        archive_name: str = "preds",
+        append: bool = False,
+        max_workers: int = 8,
+    ):
+        if archive is not None and archive not in get_args(ArchiveFormat):
+            raise ValueError(
+                f"invalid archive format {archive}; valid formats are {get_args(ArchiveFormat)}"
+            )
+
+        self.output_dir = Path(output_dir)
+        self.archive_path: Optional[Path] = None
+        self._archive: Optional[Union[tarfile.TarFile, zipfile.ZipFile]] = None
+
+        if archive is not None:
+            self.archive_path = self.output_dir / f"{archive_name}.{archive}"
+            mode: Literal["w", "a"] = (
+                "a" if append and self.archive_path.exists() else "w"
+            )
+            if archive == "tar":
+                self._archive = tarfile.open(self.archive_path, mode)
+            else:
+                if mode == "a":
+                    raise ValueError(
+                        f"can't append to zip archive {self.archive_path}, since zip "
+                        "files can't hold replacement entries; use a tar archive"
+                    )
+                self._archive = zipfile.ZipFile(
+                    self.archive_path, mode, compression=zipfile.ZIP_STORED
+                )
+            max_workers = 1
+
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._pending: List[Future] = []
+
+    def _write_file(self, path: Path, text: str) -> None:
+        with open(path, "w") as f:
+            f.write(text)
+
+    def _write_member(self, path: Path, text: str) -> None:
+        name, data = path.name, text.encode()
+        if isinstance(self._archive, tarfile.TarFile):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            self._archive.addfile(info, io.BytesIO(data))
+        elif isinstance(self._archive, zipfile.ZipFile):
+            self._archive.writestr(name, data)
+
+    def write(self, path: Union[str, Path], text: str) -> None:
+        """
+        queue `text` to be written to `path`; if writing to an archive, the
+        member is named path.name
+        """
+        # surface errors from earlier writes instead of letting them pile up
+        still_pending = []
+        for f in self._pending:
+            if f.done():
+                f.result()
+            else:
+                still_pending.append(f)
+        self._pending = still_pending
+
+        write = self._write_file if self._archive is None else self._write_member
+        self._pending.append(self._pool.submit(write, Path(path), text))
+
+    def flush(self) -> None:
+        """wait for all queued writes"""
+        pending, self._pending = self._pending, []
+        for f in pending:
+            f.result()
+        if isinstance(self._archive, tarfile.TarFile):
+            fileobj = self._archive.fileobj
+            if isinstance(fileobj, io.IOBase):
+                fileobj.flush()
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            self._pool.shutdown()
+            if self._archive is not None:
+                self._archive.close()
@@ -0,0 +1,98 @@
+import torch
+import warnings
+
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+from torch.profiler import ProfilerActivity
+
+
+class StepTracer:
+    """Captures a torch.profiler trace of steps [start, stop) of a loop.
+
+    Call `step` once at the end of every iteration of the loop. Steps before
+    `start` are skipped (with up to `warmup` steps of profiler warmup right
+    before `start`), steps in [start, stop) are recorded. When the recording
+    finishes, we write
+
+        <output_dir>/<name>.pt.trace.json   - open with chrome://tracing,
+                                              perfetto, or TensorBoard
+        <output_dir>/<name>_top_ops.txt     - table of the most expensive ops
+
+    If `steps` is None, this is a no-op, so it can be left in the loop.
+    CUDA activity is only recorded if cuda is available, so this works on
+    CPU-only machines too.
+    """
+
+    def __init__(
+        self,
+        steps: Optional[Tuple[int, int]],
+        output_dir: Union[str, Path],
+        name: str = "trace",
+        warmup: int = 1,
+        row_limit: int = 30,
+    ):
+        self.steps = steps
+        self.output_dir = Path(output_dir)
+        self.name = name
+        self.row_limit = row_limit
+        self.trace_written = False
+        self.profiler: Optional[torch.profiler.profile] = None
+
+        if steps is None:
+            return
+
+        start, stop = steps
+        if not (0 <= start < stop):
+            raise ValueError(f"trace steps must satisfy 0 <= start < stop; got {steps}")
+
+        warmup = min(warmup, start)
+
+        self.activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            self.activities.append(ProfilerActivity.CUDA)
+
+        self.profiler = torch.profiler.profile(
+            activities=self.activities,
+            schedule=torch.profiler.schedule(
+                wait=start - warmup, warmup=warmup, active=stop - start, repeat=1
+            ),
+            on_trace_ready=self._on_trace_ready,
+            record_shapes=True,
+        )
+
+    def _on_trace_ready(self, prof: torch.profiler.profile) -> None:
+        self.output_dir.mkdir(exist_ok=True, parents=True)
+
+        trace_path = self.output_dir / f"{self.name}.pt.trace.json"
+        prof.export_chrome_trace(str(trace_path))
+
+        sort_by = (
+            "self_cuda_time_total"
+            if ProfilerActivity.CUDA in self.activities
+            else "self_cpu_time_total"
+        )
+        table = prof.key_averages().table(sort_by=sort_by, row_limit=self.row_limit)
+        with open(self.output_dir / f"{self.name}_top_ops.txt", "w") as f:
+            f.write(table)
+
+        self.trace_written = True
+        print(f"wrote trace of steps {self.steps} to {trace_path}")
+
+    def __enter__(self) -> "StepTracer":
+        if self.profiler is not None:
+            self.profiler.__enter__()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self.profiler is not None:
+            self.profiler.__exit__(*exc)
+            if not self.trace_written:
+                warnings.warn(
+                    f"loop ended before trace steps {self.steps} were recorded; "
+                    "no trace was written"
+                )
+
+    def step(self) -> None:
+        if self.profiler is not None:
+            self.profiler.step()
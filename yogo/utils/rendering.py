@@ -0,0 +1,234 @@
+import os
+import torch
+import multiprocessing as mp
+
+import numpy as np
+import numpy.typing as npt
+
+from PIL import Image, ImageDraw
+
+from pathlib import Path
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Deque, List, Optional, Tuple
+
+from yogo.utils.utils import bbox_colour
+from yogo.utils.prediction_formatting import format_preds_batched
+
+
+"""
+Batched rendering for `yogo infer --draw-boxes`.
+
+Box outlines for a whole batch are drawn at once, in tensor space, on the
+device that ran inference. Only the label text (which needs a font) and the
+image encoding are done per image, in a pool of worker processes.
+"""
+
+
+LabelText = Tuple[int, int, str]
+
+
+def _edge_pixels(
+    starts: torch.Tensor, stops: torch.Tensor
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    for N segments [starts[i], stops[i]], returns (owners, positions): the
+    index of the segment, and the position, of every pixel of every segment
+    """
+    lengths = (stops - starts + 1).clamp(min=0)
+    owners = torch.repeat_interleave(
+        torch.arange(len(starts), device=starts.device), lengths
+    )
+    segment_offsets = torch.cumsum(lengths, dim=0) - lengths
+    positions = (
+        starts[owners]
+        + torch.arange(len(owners), device=starts.device)
+        - segment_offsets[owners]
+    )
+    return owners, positions
+
+
+def draw_box_outlines(
+    imgs: torch.Tensor,
+    image_idxs: torch.Tensor,
+    boxes: torch.Tensor,
+    colours: torch.Tensor,
+) -> torch.Tensor:
+    """
+    Draw 1 px outlines of N boxes onto a batch of images, in place.
+
+    imgs: (B, C, H, W) uint8
+    image_idxs: (N,) index of the image of each box
+    boxes: (N, 4) integer xyxy pixel coordinates
+    colours: (N, C) uint8 colour of each box
+    """
+    _, _, img_h, img_w = imgs.shape
+    x0 = boxes[:, 0].clamp(0, img_w - 1)
+    x1 = boxes[:, 2].clamp(0, img_w - 1)
+    y0 = boxes[:, 1].clamp(0, img_h - 1)
+    y1 = boxes[:, 3].clamp(0, img_h - 1)
+
+    # top and bottom edges
+    owners, xs = _edge_pixels(x0, x1)
+    for ys in (y0[owners], y1[owners]):
+        imgs[image_idxs[owners], :, ys, xs] = colours[owners]
+
+    # left and right edges
+    owners, ys = _edge_pixels(y0, y1)
+    for xs in (x0[owners], x1[owners]):
+        imgs[image_idxs[owners], :, ys, xs] = colours[owners]
+
+    return imgs
+
+
+def draw_yogo_predictions_batched(
+    imgs: torch.Tensor,
+    batch_preds: torch.Tensor,
+    obj_thresh: float = 0.5,
+    iou_thresh: float = 0.5,
+    min_class_confidence_threshold: float = 0.0,
+    labels: Optional[List[str]] = None,
+    images_are_normalized: bool = False,
+) -> Tuple[torch.Tensor, List[List[LabelText]]]:
+    """
+    Draw the bounding boxes of batch_preds onto imgs. Returns the (B, 3, H, W)
+    uint8 RGB images, on the device of batch_preds, and for each image a list
+    of (x, y, text) labels to draw at the top left corner of each box (see
+    `encode_annotated_image`).
+
+    imgs: (B, 1, H, W) or (B, 3, H, W)
+    batch_preds: (B, pred_dim, Sy, Sx)
+    """
+    if imgs.ndim != 4 or imgs.shape[1] not in (1, 3):
+        raise ValueError(
+            f"imgs must be batched, with 1 or 3 channels - got shape {imgs.shape}"
+        )
+
+    device = batch_preds.device
+    bs, pred_dim, _, _ = batch_preds.shape
+    num_classes = pred_dim - 5
+    _, _, img_h, img_w = imgs.shape
+
+    imgs = imgs.to(device)
+    if images_are_normalized:
+        imgs = imgs * 255
+    imgs = imgs.to(torch.uint8).expand(-1, 3, -1, -1).contiguous()
+
+    image_idxs, preds = format_preds_batched(
+        batch_preds.float(),
+        obj_thresh=obj_thresh,
+        iou_thresh=iou_thresh,
+        box_format="xyxy",
+        min_class_confidence_threshold=min_class_confidence_threshold,
+    )
+
+    boxes = preds[:, :4] * torch.tensor([img_w, img_h, img_w, img_h], device=device)
+    boxes = boxes.round().long()
+    classes = preds[:, 5:].argmax(dim=1)
+
+    palette = torch.tensor(
+        [bbox_colour(c, num_classes=num_classes)[:3] for c in range(num_classes)],
+        dtype=torch.uint8,
+        device=device,
+    )
+    draw_box_outlines(imgs, image_idxs, boxes, palette[classes])
+
+    label_texts: List[List[LabelText]] = [[] for _ in range(bs)]
+    for image_idx, (x, y, *_), class_idx in zip(
+        image_idxs.tolist(), boxes.tolist(), classes.tolist()
+    ):
+        label = labels[class_idx] if labels is not None else str(class_idx)
+        label_texts[image_idx].append((x, y, label))
+
+    return imgs, label_texts
+
+
+def encode_annotated_image(
+    img: npt.NDArray,
+    label_texts: List[LabelText],
+    out_path: Path,
+    compress_level: int = 1,
+) -> None:
+    """draw label text onto an (H, W, 3) uint8 image and save it to out_path"""
+    pil_img = Image.fromarray(img)
+    draw = ImageDraw.Draw(pil_img)
+    for x, y, text in label_texts:
+        draw.text((x, y), text, (0, 0, 0), font_size=16)
+    pil_img.save(out_path, compress_level=compress_level)
+
+
+class AnnotatedImageWriter:
+    """
+    Draws batches of predictions with `draw_yogo_predictions_batched`, and
+    hands label drawing and encoding to a pool of worker processes. At most
+    `max_pending` images are queued at a time, which bounds memory use.
+
+    With `num_workers=0`, images are encoded in the calling process instead,
+    e.g. in daemonic processes, which can't start a pool.
+    """
+
+    def __init__(
+        self,
+        num_workers: Optional[int] = None,
+        compress_level: int = 1,
+        max_pending: Optional[int] = None,
+    ):
+        if not (0 <= compress_level <= 9):
+            raise ValueError(f"compress_level must be in [0, 9]; got {compress_level}")
+
+        self.num_workers = (
+            min(8, os.cpu_count() or 1) if num_workers is None else num_workers
+        )
+        self.compress_level = compress_level
+        self.max_pending = max_pending or 8 * max(self.num_workers, 1)
+
+        # workers only need PIL, so spawn rather than fork a process that may
+        # hold a CUDA context
+        self._pool: Optional[ProcessPoolExecutor] = None
+        if self.num_workers > 0:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.num_workers, mp_context=mp.get_context("spawn")
+            )
+        self._pending: Deque[Future] = deque()
+
+    def write(
+        self,
+        imgs: torch.Tensor,
+        batch_preds: torch.Tensor,
+        out_paths: List[Path],
+        **draw_kwargs,
+    ) -> None:
+        drawn, label_texts = draw_yogo_predictions_batched(
+            imgs, batch_preds, **draw_kwargs
+        )
+        drawn_np = drawn.permute(0, 2, 3, 1).cpu().numpy()
+
+        for img, texts, out_path in zip(drawn_np, label_texts, out_paths):
+            if self._pool is None:
+                encode_annotated_image(
+                    np.ascontiguousarray(img), texts, out_path, self.compress_level
+                )
+                continue
+
+            while len(self._pending) >= self.max_pending:
+                self._pending.popleft().result()
+            self._pending.append(
+                self._pool.submit(
+                    encode_annotated_image,
+                    np.ascontiguousarray(img),
+                    texts,
+                    out_path,
+                    self.compress_level,
+                )
+            )
+
+    def flush(self) -> None:
+        while len(self._pending) > 0:
+            self._pending.popleft().result()
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
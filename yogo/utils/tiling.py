@@ -0,0 +1,87 @@
+import torch
+import torchvision.ops as ops
+
+from typing import Generator, List, Tuple
+
+
+"""
+Helpers for tiled inference (`yogo infer --tile-overlap`), i.e. running YOGO
+on images that are larger than the model's input size by cutting them into
+overlapping, model-sized tiles.
+"""
+
+
+def tile_starts(length: int, tile_size: int, overlap: int) -> List[int]:
+    """
+    start positions of tiles of tile_size that cover [0, length), where
+    neighbouring tiles overlap by at least `overlap` pixels. The last tile is
+    aligned to the end, so it can overlap its neighbour by more.
+    """
+    if not (0 <= overlap < tile_size):
+        raise ValueError(
+            f"overlap must be in [0, tile_size) (tile_size is {tile_size}); got {overlap}"
+        )
+
+    if length <= tile_size:
+        return [0]
+
+    stride = tile_size - overlap
+    starts = list(range(0, length - tile_size, stride))
+    starts.append(length - tile_size)
+    return starts
+
+
+def iter_tiles(
+    img: torch.Tensor, tile_hw: Tuple[int, int], overlap: int
+) -> Generator[Tuple[torch.Tensor, int, int], None, None]:
+    """
+    yields (tile, y0, x0) for overlapping tiles of img, which is (C, H, W).
+    Tiles are views of img, except for images smaller than a tile, which are
+    zero-padded at the bottom and right.
+    """
+    _, img_h, img_w = img.shape
+    tile_h, tile_w = tile_hw
+
+    for y0 in tile_starts(img_h, tile_h, overlap):
+        for x0 in tile_starts(img_w, tile_w, overlap):
+            tile = img[:, y0 : y0 + tile_h, x0 : x0 + tile_w]
+            _, h, w = tile.shape
+            if (h, w) != (tile_h, tile_w):
+                tile = torch.nn.functional.pad(tile, (0, tile_w - w, 0, tile_h - h))
+            yield tile, y0, x0
+
+
+def tile_to_image_boxes(
+    boxes: torch.Tensor,
+    tile_offsets: torch.Tensor,
+    tile_hw: Tuple[int, int],
+    img_hw: Tuple[int, int],
+) -> torch.Tensor:
+    """
+    convert (N, 4) xyxy boxes, normalized to their tile, to pixel xyxy boxes in
+    the full image. tile_offsets is (N, 2), the (y0, x0) of each box's tile.
+    Boxes are clipped to the image, which matters for zero-padded tiles.
+    """
+    tile_h, tile_w = tile_hw
+    img_h, img_w = img_hw
+    scale = boxes.new_tensor([tile_w, tile_h, tile_w, tile_h])
+    offsets = tile_offsets[:, [1, 0, 1, 0]].to(boxes.dtype)
+    return ops.clip_boxes_to_image(boxes * scale + offsets, (img_h, img_w))
+
+
+def merge_tile_predictions(
+    boxes: torch.Tensor, preds: torch.Tensor, iou_thresh: float
+) -> torch.Tensor:
+    """
+    cross-tile NMS: returns the indices of predictions to keep, after removing
+    duplicates of objects that were found in more than one tile. boxes are the
+    xyxy boxes of preds in full image coordinates.
+    """
+    if iou_thresh <= 0:
+        return torch.arange(len(boxes), device=boxes.device)
+
+    return ops.nms(
+        boxes.float(),
+        torch.max(preds[:, 5:], dim=1).values * preds[:, 4],
+        iou_threshold=iou_thresh,
+    )
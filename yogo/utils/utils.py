@@ -1,16 +1,23 @@
 #! /usr/bin/env python3
 
+import json
 import time
 import torch
 import socket
 import colorsys
+import threading
 
-from contextlib import contextmanager
+from pathlib import Path
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
 
 import PIL
 import torchvision.transforms as transforms
 
 from typing import (
+    Any,
+    ContextManager,
+    Dict,
     Optional,
     Sequence,
     Generator,
@@ -47,6 +54,164 @@ def Timer(description: str, precision: int = 5, post_print: bool = False):
         )
 
 
+class StageTimers:
+    """Accumulates wall time and call counts for named stages of a pipeline.
+
+    Use `stage` as a context manager around each part of a loop that you want
+    to measure. When `enabled` is False, `stage` returns a shared no-op context
+    manager, so leaving the instrumentation in hot loops costs ~nothing.
+
+    If `device` is a cuda device, we synchronize before reading the clock so
+    that asynchronous kernels are attributed to the stage that launched them.
+
+    Stages can be nested (e.g. "decode" runs inside "load" when the dataloader
+    has no workers). A nested stage is reported under the stage it first ran
+    in, and isn't counted again in the total that percentages are taken of.
+
+    >>> timers = StageTimers()
+    >>> with timers.stage("forward"):
+    ...     model(x)
+    >>> print(timers.summary())
+    """
+
+    _null_context = nullcontext()
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        device: Optional[Union[str, torch.device]] = None,
+    ):
+        self.enabled = enabled
+        self.sync_cuda = device is not None and torch.device(device).type == "cuda"
+        self.totals: Dict[str, float] = defaultdict(float)
+        self.counts: Dict[str, int] = defaultdict(int)
+        self.items: Dict[str, int] = defaultdict(int)
+        self.parents: Dict[str, Optional[str]] = {}
+        # the stages that are running, per thread
+        self._local = threading.local()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        del state["_local"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def stage(self, name: str, num_items: int = 0) -> ContextManager:
+        if not self.enabled:
+            return self._null_context
+        return self._timed_stage(name, num_items)
+
+    @contextmanager
+    def _timed_stage(self, name: str, num_items: int):
+        running: List[str] = self._local.__dict__.setdefault("running", [])
+        parent = running[-1] if len(running) > 0 else None
+        running.append(name)
+        if self.sync_cuda:
+            torch.cuda.synchronize()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.sync_cuda:
+                torch.cuda.synchronize()
+            running.pop()
+            self.add(
+                name,
+                time.perf_counter() - start_time,
+                num_items=num_items,
+                parent=parent,
+            )
+
+    def add(
+        self,
+        name: str,
+        seconds: float,
+        count: int = 1,
+        num_items: int = 0,
+        parent: Optional[str] = None,
+    ):
+        if not self.enabled:
+            return
+        if name not in self.parents:
+            # a stage's parent is where it first ran, as long as that doesn't
+            # make it its own ancestor
+            ancestor = parent
+            while ancestor is not None and ancestor != name:
+                ancestor = self.parents.get(ancestor)
+            self.parents[name] = parent if ancestor is None else None
+        self.totals[name] += seconds
+        self.counts[name] += count
+        self.items[name] += num_items
+
+    def merge(self, other: "StageTimers") -> None:
+        for name in other.totals:
+            self.add(
+                name,
+                other.totals[name],
+                count=other.counts[name],
+                num_items=other.items[name],
+                parent=other.parents.get(name),
+            )
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            name: {
+                "total_s": self.totals[name],
+                "count": self.counts[name],
+                "mean_s": self.totals[name] / max(self.counts[name], 1),
+                "items": self.items[name],
+                "parent": self.parents.get(name),
+            }
+            for name in self.totals
+        }
+
+    def summary(self) -> str:
+        if len(self.totals) == 0:
+            return "no stages recorded"
+
+        children: Dict[Optional[str], List[str]] = defaultdict(list)
+        for name in sorted(self.totals, key=lambda name: -self.totals[name]):
+            parent = self.parents.get(name)
+            # stages whose parent wasn't recorded (e.g. it's still running) are
+            # reported at the top level
+            children[parent if parent in self.totals else None].append(name)
+
+        # nested stages are part of their parent's time, so only count top-level
+        # stages towards the total
+        grand_total = sum(self.totals[name] for name in children[None])
+
+        ordered: List[Tuple[str, int]] = []
+
+        def visit(name: str, depth: int) -> None:
+            ordered.append((name, depth))
+            for child in children[name]:
+                visit(child, depth + 1)
+
+        for name in children[None]:
+            visit(name, 0)
+
+        width = max(len(name) + 2 * depth for name, depth in ordered)
+        lines = [
+            f"{'stage':<{width}} {'total (s)':>10} {'%':>6} {'count':>8} {'mean (ms)':>10}"
+        ]
+        for name, depth in ordered:
+            total, count = self.totals[name], self.counts[name]
+            label = "  " * depth + name
+            lines.append(
+                f"{label:<{width}} {total:>10.3f} "
+                f"{100 * total / max(grand_total, 1e-12):>6.1f} "
+                f"{count:>8} {1000 * total / max(count, 1):>10.3f}"
+            )
+        return "\n".join(lines)
+
+    def write_json(self, path: Union[str, Path], **metadata) -> None:
+        with open(path, "w") as f:
+            json.dump({"stages": self.to_dict(), **metadata}, f, indent=4)
+
+
 def get_wandb_roc(
     fpr: Union[Sequence, Sequence[Sequence]],
     tpr: Sequence[Sequence],